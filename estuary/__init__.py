@@ -4,11 +4,22 @@ from __future__ import unicode_literals
 
 import logging
 
-import pkg_resources
-
 log = logging.getLogger('estuary')
 
 try:
-    version = pkg_resources.get_distribution('estuary').version
-except pkg_resources.DistributionNotFound:
-    version = 'unknown'
+    from importlib.metadata import PackageNotFoundError
+    from importlib.metadata import version as get_version
+except ImportError:
+    # importlib.metadata was added in Python 3.8. pkg_resources is slow to import, so it's only
+    # used on older versions.
+    import pkg_resources
+
+    try:
+        version = pkg_resources.get_distribution('estuary').version
+    except pkg_resources.DistributionNotFound:
+        version = 'unknown'
+else:
+    try:
+        version = get_version('estuary')
+    except PackageNotFoundError:
+        version = 'unknown'
@@ -0,0 +1,73 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+from datetime import datetime, timedelta
+
+from flask import Blueprint, current_app, request
+
+from estuary.error import ValidationError
+from estuary.utils.admission import limit_concurrency
+from estuary.utils.cache import cache_response
+from estuary.utils.database import set_query_timeout
+from estuary.utils.general import login_required, timestamp_to_date
+from estuary.utils.singleflight import coalesce_requests
+
+analytics_api = Blueprint('analytics_api', __name__)
+
+
+@analytics_api.route('/container-stories')
+@login_required
+@coalesce_requests
+@cache_response
+@limit_concurrency
+@set_query_timeout('analytics')
+def get_container_story_metrics():
+    """
+    Get the lead, wait and processing times of the container stories of a product.
+
+    The "product" query parameter is the product name of the container advisories, and the "since"
+    and "until" query parameters are the first and the last days the container advisories were
+    created on. The "until" query parameter defaults to today.
+
+    :return: the summary of each metric in seconds
+    :rtype: dict
+    :raises ValidationError: if the query parameters are invalid
+    """
+    product = request.args.get('product')
+    if not product:
+        raise ValidationError('The product parameter must be set')
+
+    dates = {}
+    for arg in ('since', 'until'):
+        value = request.args.get(arg)
+        if value is None:
+            continue
+        try:
+            dates[arg] = timestamp_to_date(value)
+        except ValueError:
+            raise ValidationError('The {0} parameter must be a date formatted as '
+                                  '"yyyy-mm-dd"'.format(arg))
+    if 'since' not in dates:
+        raise ValidationError('The since parameter must be set')
+    until = dates.get('until', datetime.utcnow().date())
+    max_days = current_app.config['ANALYTICS_MAX_WINDOW_DAYS']
+    if until < dates['since']:
+        raise ValidationError('The until parameter can\'t be before the since parameter')
+    elif (until - dates['since']).days >= max_days:
+        raise ValidationError('The window can\'t be longer than {0} days'.format(max_days))
+
+    # Import this here so that NumPy is only loaded by the workers serving the analytics
+    from estuary.utils.analytics import get_container_story_analytics
+
+    metrics = get_container_story_analytics(product, dates['since'], until + timedelta(days=1))
+    stories = metrics.pop('stories')
+    return {
+        'data': metrics,
+        'meta': {
+            'product': product,
+            'since': dates['since'].isoformat(),
+            'until': until.isoformat(),
+            'stories': stories,
+        },
+    }
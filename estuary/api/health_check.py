@@ -5,6 +5,8 @@ from __future__ import unicode_literals
 from neomodel import db
 
 from estuary import log
+from estuary.error import is_pool_exhausted_error
+from estuary.utils.database import get_pool_stats
 
 
 def health_check():
@@ -16,10 +18,18 @@ def health_check():
         # database
         results, _ = db.cypher_query('RETURN sqrt(4)')
         assert results[0][0] == 2.0
-    except:  # noqa E722
-        log.exception('An exception was encountered when verifying the database connection in the '
-                      'health check API endpoint')
-        msg = 'The health check failed while verifying the database connection'
+    except Exception as error:
         status = 503
+        if is_pool_exhausted_error(error):
+            # The database itself may be fine, but this worker can't get a connection to it
+            pool_stats = get_pool_stats()
+            log.exception('The Neo4j connection pool was exhausted in the health check API '
+                          'endpoint (%d of %d connections in use)', pool_stats['in_use'],
+                          pool_stats['max_size'])
+            msg = 'The health check failed because the database connection pool is exhausted'
+        else:
+            log.exception('An exception was encountered when verifying the database connection in '
+                          'the health check API endpoint')
+            msg = 'The health check failed while verifying the database connection'
 
     return (msg, status, [('Content-Type', 'text/plain')])
@@ -5,7 +5,11 @@ from __future__ import unicode_literals
 import time
 
 import prometheus_client
-from flask import Blueprint, Response, request
+from flask import Blueprint, Response, g, request
+
+from estuary.utils.admission import get_limiter_stats
+from estuary.utils.database import get_pool_stats
+from estuary.utils.typeahead import get_typeahead_stats
 
 REQUEST_COUNT = prometheus_client.Counter(
     'request_count', 'App Request Count',
@@ -15,6 +19,40 @@ REQUEST_LATENCY = prometheus_client.Histogram(
     'request_latency_seconds', 'Request latency',
     ['app_name', 'endpoint', 'query_string'])
 
+QUERY_TIMEOUT_COUNT = prometheus_client.Counter(
+    'query_timeout_count', 'Requests cancelled because their queries timed out',
+    ['app_name', 'endpoint'])
+
+ADMISSION_REJECTED_COUNT = prometheus_client.Counter(
+    'admission_rejected_count', 'Expensive requests rejected by the admission control',
+    ['app_name', 'endpoint'])
+
+RESPONSE_TRUNCATED_COUNT = prometheus_client.Counter(
+    'response_truncated_count', 'Responses truncated because they reached a size limit',
+    ['app_name', 'endpoint', 'limit'])
+
+EXPENSIVE_REQUESTS = prometheus_client.Gauge(
+    'expensive_requests', 'Expensive requests being processed or waiting in the queue', ['state'])
+EXPENSIVE_REQUESTS.labels('active').set_function(lambda: get_limiter_stats()['active'])
+EXPENSIVE_REQUESTS.labels('queued').set_function(lambda: get_limiter_stats()['queued'])
+
+NEO4J_POOL_CONNECTIONS = prometheus_client.Gauge(
+    'neo4j_pool_connections', 'Connections in the Neo4j driver connection pool', ['state'])
+NEO4J_POOL_CONNECTIONS.labels('in_use').set_function(lambda: get_pool_stats()['in_use'])
+NEO4J_POOL_CONNECTIONS.labels('idle').set_function(lambda: get_pool_stats()['idle'])
+
+NEO4J_POOL_MAX_SIZE = prometheus_client.Gauge(
+    'neo4j_pool_max_size', 'The maximum size of the Neo4j driver connection pool')
+NEO4J_POOL_MAX_SIZE.set_function(lambda: get_pool_stats()['max_size'])
+
+TYPEAHEAD_INDEX_SIZE = prometheus_client.Gauge(
+    'typeahead_index_size', 'Artifacts in the typeahead index of the process')
+TYPEAHEAD_INDEX_SIZE.set_function(lambda: get_typeahead_stats()['size'])
+
+TYPEAHEAD_INDEX_BYTES = prometheus_client.Gauge(
+    'typeahead_index_bytes', 'Estimated memory used by the typeahead index of the process')
+TYPEAHEAD_INDEX_BYTES.set_function(lambda: get_typeahead_stats()['memory_bytes'])
+
 
 def start_request_timer():
     """Start the request timer."""
@@ -49,6 +87,46 @@ def record_request_metadata(response):
     return response
 
 
+def record_query_timeout(response):
+    """
+    Record the request if its queries timed out.
+
+    :param flask.Response response: the Flask response to record the timeout of
+    :return: the Flask response
+    :rtype: flask.Response
+    """
+    if g.get('query_timed_out'):
+        QUERY_TIMEOUT_COUNT.labels('estuary-api', request.endpoint).inc()
+    return response
+
+
+def record_admission_rejection(response):
+    """
+    Record the request if it was rejected by the admission control.
+
+    :param flask.Response response: the Flask response to record the rejection of
+    :return: the Flask response
+    :rtype: flask.Response
+    """
+    if g.get('admission_rejected'):
+        ADMISSION_REJECTED_COUNT.labels('estuary-api', request.endpoint).inc()
+    return response
+
+
+def record_response_truncation(response):
+    """
+    Record the request if its response was truncated because it reached a size limit.
+
+    :param flask.Response response: the Flask response to record the truncation of
+    :return: the Flask response
+    :rtype: flask.Response
+    """
+    if g.get('response_truncated'):
+        RESPONSE_TRUNCATED_COUNT.labels(
+            'estuary-api', request.endpoint, g.response_truncated).inc()
+    return response
+
+
 def configure_monitoring(app):
     """Configure monitoring on the Flask app.
 
@@ -57,6 +135,9 @@ def configure_monitoring(app):
     app.before_request(start_request_timer)
     app.after_request(stop_request_timer)
     app.after_request(record_request_metadata)
+    app.after_request(record_query_timeout)
+    app.after_request(record_admission_rejection)
+    app.after_request(record_response_truncation)
 
 
 monitoring_api = Blueprint('monitoring', __name__)
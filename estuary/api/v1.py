@@ -2,16 +2,30 @@
 
 from __future__ import unicode_literals
 
-from flask import Blueprint, current_app, jsonify, request
-from werkzeug.exceptions import NotFound
+import json
+
+from flask import Blueprint, Response, current_app, g, jsonify, request
+from six import string_types
+from werkzeug.exceptions import NotFound, ServiceUnavailable
 
 import estuary.utils.story
 from estuary import log, version
 from estuary.error import ValidationError
 from estuary.models.base import EstuaryStructuredNode
-from estuary.utils.general import (get_neo4j_node, inflate_node,
-                                   login_required, str_to_bool)
+from estuary.utils.admission import limit_concurrency
+from estuary.utils.cache import cache_response
+from estuary.utils.changelog import (close_stream, get_changelog_poller,
+                                     open_stream, stream_changes)
+from estuary.utils.database import set_query_timeout
+from estuary.utils.general import (decode_cursor, encode_cursor,
+                                   get_neo4j_node, get_pagination_args,
+                                   get_pagination_meta, inflate_node,
+                                   login_required, select_fields, str_to_bool)
 from estuary.utils.recents import get_recent_nodes
+from estuary.utils.search import search_nodes
+from estuary.utils.singleflight import coalesce_requests
+from estuary.utils.truncation import ResponseBudget, count_serialized_nodes
+from estuary.utils.typeahead import get_typeahead_index
 
 api_v1 = Blueprint('api_v1', __name__)
 
@@ -52,25 +66,24 @@ def get_resource(resource, uid):
         raise NotFound('This item does not exist')
 
     if relationship:
-        return jsonify(item.serialized_all)
+        return jsonify(select_fields(item.serialized_all))
     else:
-        return jsonify(item.serialized)
+        return jsonify(select_fields(item.serialized))
 
 
-@api_v1.route('/story/<resource>/<uid>')
-@login_required
-def get_resource_story(resource, uid):
+def _get_story(resource, uid, fallback_resources, window=None):
     """
     Get the story of a resource from Neo4j.
 
     :param str resource: a resource name that maps to a neomodel class
     :param str uid: the value of the UniqueIdProperty to query with
-    :return: a Flask JSON response
-    :rtype: flask.Response
+    :param list fallback_resources: the resource names to try if the resource is not found
+    :kwarg int window: the maximum number of nodes to return in each direction from the resource
+    :return: the story in the API format
+    :rtype: dict
     :raises NotFound: if the item is not found
     :raises ValidationError: if an invalid resource was requested
     """
-    fallback_resources = request.args.getlist('fallback')
     # Try all resources input by the user
     for _resource in [resource] + fallback_resources:
         item = get_neo4j_node(_resource, uid)
@@ -81,8 +94,11 @@ def get_resource_story(resource, uid):
     if not item:
         raise NotFound('This item does not exist')
 
+    # The story type and the longest path can only be determined from the whole story, such as a
+    # module build past the window, so the window is sliced from the whole story
     story_manager = estuary.utils.story.BaseStoryManager.get_story_manager(
         item, current_app.config, limit=True)
+    has_more = {'forward': False, 'backward': False}
 
     def _get_partial_story(results, reverse=False):
 
@@ -91,6 +107,9 @@ def get_resource_story(resource, uid):
 
         # Assuming that if Path is the first result, then that's all we want to process
         results = [list(results[0][0].nodes)]
+        if window is not None and len(results[0]) > window + 1:
+            results = [results[0][:window + 1]]
+            has_more['backward' if reverse else 'forward'] = True
         # Reverse will be true when it is a backward query to preserve the story order
         if reverse:
             results = [results[0][::-1]]
@@ -135,13 +154,109 @@ def get_resource_story(resource, uid):
         rv['data'][0]['resource_type'] = item.__label__
         rv['data'][0]['display_name'] = item.display_name
         rv['data'][0]['timeline_timestamp'] = item.timeline_timestamp
-        return jsonify(rv)
+        rv['data'][0] = select_fields(rv['data'][0])
+    else:
+        rv = story_manager.format_story_results(results, item)
+
+    if window is not None:
+        rv['meta']['window'] = window
+        rv['meta']['has_more_forward'] = has_more['forward']
+        rv['meta']['has_more_backward'] = has_more['backward']
+    return rv
+
+
+@api_v1.route('/story/<resource>/<uid>')
+@login_required
+@limit_concurrency
+@coalesce_requests
+@cache_response
+@set_query_timeout('story')
+def get_resource_story(resource, uid):
+    """
+    Get the story of a resource from Neo4j.
+
+    :param str resource: a resource name that maps to a neomodel class
+    :param str uid: the value of the UniqueIdProperty to query with
+    :return: a Flask JSON response
+    :rtype: flask.Response
+    :raises NotFound: if the item is not found
+    :raises ValidationError: if an invalid resource was requested
+    """
+    window = request.args.get('window')
+    if window is not None:
+        try:
+            window = int(window)
+        except ValueError:
+            window = 0
+        if window < 1:
+            raise ValidationError('The window parameter must be a positive integer')
+
+    return _get_story(resource, uid, request.args.getlist('fallback'), window=window)
 
-    return jsonify(story_manager.format_story_results(results, item))
+
+@api_v1.route('/stories', methods=['POST'])
+@login_required
+@limit_concurrency
+@set_query_timeout('stories')
+def get_resource_stories():
+    """
+    Get the stories of several resources from Neo4j.
+
+    The request body is a JSON object with an "items" key containing a list of objects with the
+    "resource" and "uid" keys, and optionally a "fallback" key with a list of resource names. The
+    nodes, subpaths and sibling counts shared by the stories are only queried and serialized once.
+
+    :return: a Flask JSON response with a result per item in the same order, which is either the
+        story or an error with the status code
+    :rtype: flask.Response
+    :raises ValidationError: if the request body is invalid
+    """
+    payload = request.get_json(force=True, silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('items'), list):
+        raise ValidationError('The JSON body must contain an "items" list')
+
+    max_items = current_app.config['BATCH_STORIES_MAX_ITEMS']
+    if len(payload['items']) > max_items:
+        raise ValidationError('The "items" list can\'t contain more than {0} items'.format(
+            max_items))
+
+    items = []
+    for entry in payload['items']:
+        if not isinstance(entry, dict) or not all(
+                isinstance(entry.get(key), string_types) for key in ('resource', 'uid')):
+            raise ValidationError('Each item must contain the "resource" and "uid" strings')
+        fallback_resources = entry.get('fallback', [])
+        if not isinstance(fallback_resources, list) or not all(
+                isinstance(fallback, string_types) for fallback in fallback_resources):
+            raise ValidationError('The "fallback" key of an item must be a list of strings')
+        items.append((entry['resource'].lower(), entry['uid'],
+                      tuple(fallback.lower() for fallback in fallback_resources)))
+
+    # Share the query results and the serialized nodes between the stories of the batch
+    g.batch_cache = {}
+    stories = {}
+    results = []
+    for item in items:
+        if item not in stories:
+            resource, uid, fallback_resources = item
+            try:
+                stories[item] = _get_story(resource, uid, list(fallback_resources))
+                stories[item]['status'] = 200
+            except NotFound as error:
+                stories[item] = {'status': error.code, 'message': error.description}
+            except ValidationError as error:
+                stories[item] = {'status': 400, 'message': str(error)}
+        results.append(stories[item])
+
+    return jsonify(results)
 
 
 @api_v1.route('/allstories/<resource>/<uid>')
 @login_required
+@limit_concurrency
+@coalesce_requests
+@cache_response
+@set_query_timeout('allstories')
 def get_resource_all_stories(resource, uid):
     """
     Get all unique stories of an artifact from Neo4j.
@@ -161,6 +276,9 @@ def get_resource_all_stories(resource, uid):
         if item:
             break
 
+    if not item:
+        raise NotFound('This item does not exist')
+
     story_manager = estuary.utils.story.BaseStoryManager.get_story_manager(item, current_app.config)
 
     def _get_partial_stories(results, reverse=False):
@@ -170,6 +288,10 @@ def get_resource_all_stories(resource, uid):
         if not results:
             return results_list
 
+        # The paths of the same length are returned in no particular order, so they are sorted by
+        # the IDs of their nodes for the stories and the cursors of the pages to be stable
+        results = sorted(results, reverse=True, key=lambda result: (
+            len(result[0].nodes), [node.id for node in result[0].nodes]))
         # Creating a list of lists where each list is a collection of node IDs
         # of the nodes present in that particular story path.
         # Paths are re-sorted in ascending order to simplify the logic below
@@ -198,12 +320,10 @@ def get_resource_all_stories(resource, uid):
         # list as the for loops will eliminate them. So we add the last element
         # since we are sure it is unique.
         unique_paths.append(results[0][0])
+        # The paths are only inflated when their stories are added to the response
         if reverse:
-            unique_paths_nodes = [path.nodes[::-1] for path in unique_paths]
-        else:
-            unique_paths_nodes = [path.nodes for path in unique_paths]
-
-        return EstuaryStructuredNode.inflate_results(unique_paths_nodes)
+            return [path.nodes[::-1] for path in unique_paths]
+        return [path.nodes for path in unique_paths]
 
     if story_manager.forward_story:
         results_forward = _get_partial_stories(story_manager.forward_story)
@@ -215,29 +335,71 @@ def get_resource_all_stories(resource, uid):
     else:
         results_backward = []
 
+    def _get_story_paths():
+        """Generate the backward and forward paths of each story, without inflating them."""
+        if not results_backward or not results_forward:
+            if results_forward:
+                for result in results_forward:
+                    yield None, result
+            else:
+                for result in results_backward:
+                    yield result, None
+        else:
+            # Combining all the backward and forward paths to generate all the possible full paths
+            for result_forward in results_forward:
+                for result_backward in results_backward:
+                    yield result_backward, result_forward
+
+    # The paths of one direction are repeated in the stories combining them with the paths of the
+    # other direction, so they're inflated once
+    inflated_paths = {}
+
+    def _inflate_path(nodes, reverse=False):
+        """Inflate the nodes of a path with the labels of the story flow."""
+        key = (tuple(node.id for node in nodes), reverse)
+        if key not in inflated_paths:
+            inflated_paths[key] = story_manager.set_story_labels(
+                item.__label__, EstuaryStructuredNode.inflate_results([nodes])[0], reverse=reverse)
+        return inflated_paths[key]
+
+    offset = 0
+    if request.args.get('cursor'):
+        offset = decode_cursor(request.args['cursor'])
+    # The stories are inflated and formatted one at a time so that the response stops growing at
+    # the limits
+    budget = ResponseBudget(current_app.config)
+    # The size of each serialized node is measured once for the same reason
+    node_sizes = {}
     all_results = []
-    if not results_backward or not results_forward:
-        if results_forward:
-            results_unidir = [story_manager.set_story_labels(
-                item.__label__, result) for result in results_forward]
+    meta = {}
+    for index, (path_backward, path_forward) in enumerate(_get_story_paths()):
+        if index < offset:
+            continue
+        if path_backward is None:
+            results = _inflate_path(path_forward)
+        elif path_forward is None:
+            results = _inflate_path(path_backward, reverse=True)
         else:
-            results_unidir = [story_manager.set_story_labels(
-                item.__label__, result, reverse=True) for result in results_backward]
-
-        for result in results_unidir:
-            all_results.append(story_manager.format_story_results(result, item))
-
-    else:
-        # Combining all the backward and forward paths to generate all the possible full paths
-        for result_forward in results_forward:
-            for result_backward in results_backward:
-                results = story_manager.set_story_labels(
-                    item.__label__, result_backward, reverse=True) + \
-                    story_manager.set_story_labels(item.__label__, result_forward)[1:]
-                all_results.append(story_manager.format_story_results(results, item))
+            results = _inflate_path(path_backward, reverse=True) + _inflate_path(path_forward)[1:]
+        story = story_manager.format_story_results(results, item)
+
+        size = None
+        if budget.max_bytes:
+            size = len(json.dumps(story['meta']))
+            for node, serialized_node in zip(results, story['data']):
+                node_key = (node.id, node.__label__, node.id == item.id)
+                if node_key not in node_sizes:
+                    node_sizes[node_key] = len(json.dumps(serialized_node))
+                size += node_sizes[node_key]
+        nodes = sum(count_serialized_nodes(node) for node in story['data'])
+        if not budget.add(story, nodes=nodes, size=size):
+            meta['truncated'] = True
+            meta['next_cursor'] = encode_cursor(index)
+            break
+        all_results.append(story)
 
     # Adding the artifact itself if its story is not available
-    if not all_results:
+    if not all_results and not offset:
         base_instance = estuary.utils.story.BaseStoryManager()
         wait_times, total_wait_time = base_instance.get_wait_times([item])
         rv = {'data': [item.serialized_all], 'meta': {}}
@@ -259,13 +421,18 @@ def get_resource_all_stories(resource, uid):
         rv['data'][0]['resource_type'] = item.__label__
         rv['data'][0]['display_name'] = item.display_name
         rv['data'][0]['timeline_timestamp'] = item.timeline_timestamp
+        rv['data'][0] = select_fields(rv['data'][0])
         all_results.append(rv)
 
-    return jsonify(all_results)
+    return {'data': all_results, 'meta': meta}
 
 
 @api_v1.route('/siblings/<resource>/<uid>')
 @login_required
+@limit_concurrency
+@coalesce_requests
+@cache_response
+@set_query_timeout('siblings')
 def get_siblings(resource, uid):
     """
     Get siblings of next/previous node that are correlated to the node in question.
@@ -306,15 +473,27 @@ def get_siblings(resource, uid):
     else:
         raise ValidationError('Siblings cannot be determined on this kind of resource')
 
-    sibling_nodes = story_manager.get_sibling_nodes(desired_siblings_label, story_node)
+    limit, offset = get_pagination_args()
+    shallow = str_to_bool(request.args.get('shallow'))
+    order = request.args.get('order', 'desc').lower()
+    if order not in ('asc', 'desc'):
+        raise ValidationError('The order parameter must be "asc" or "desc"')
+
+    sibling_nodes, total = story_manager.get_sibling_nodes(
+        desired_siblings_label, story_node, skip=offset, limit=limit,
+        descending=order == 'desc', hub_threshold=current_app.config['HUB_DEGREE_THRESHOLD'],
+        top_k=current_app.config['HUB_TOP_K'])
     # Inflating and formatting results from Neo4j
     serialized_results = []
     for result in sibling_nodes:
-        inflated_node = inflate_node(result[0])
-        serialized_node = inflated_node.serialized_all
-        serialized_node['resource_type'] = inflated_node.__label__
-        serialized_node['display_name'] = inflated_node.display_name
-        serialized_results.append(serialized_node)
+        inflated_node = inflate_node(result)
+        if shallow:
+            serialized_node = inflated_node.serialized
+        else:
+            serialized_node = inflated_node.serialized_all
+            serialized_node['resource_type'] = inflated_node.__label__
+            serialized_node['display_name'] = inflated_node.display_name
+        serialized_results.append(select_fields(serialized_node))
 
     description = story_manager.get_siblings_description(
         story_node.display_name, story_node_story_flow, backward)
@@ -325,12 +504,16 @@ def get_siblings(resource, uid):
             'description': description
         }
     }
+    result['meta'].update(get_pagination_meta(limit, offset, total))
+    if story_manager.partial:
+        result['meta']['partial'] = True
 
-    return jsonify(result)
+    return result
 
 
 @api_v1.route('/relationships/<resource>/<uid>/<relationship>')
 @login_required
+@set_query_timeout('relationships')
 def get_artifact_relationships(resource, uid, relationship):
     """
     Get one-to-many relationships of a particular artifact.
@@ -351,6 +534,11 @@ def get_artifact_relationships(resource, uid, relationship):
         raise ValidationError(
             'Please provide a valid relationship name for {0} with uid {1}'.format(resource, uid))
 
+    limit, offset = get_pagination_args()
+    shallow = str_to_bool(request.args.get('shallow'))
+    related_nodes, total = item.get_related_nodes(
+        relationship, order_by=request.args.get('order_by'), skip=offset, limit=limit)
+
     rel_display_name = relationship.replace('_', ' ')
     results = {
         'data': [],
@@ -358,12 +546,23 @@ def get_artifact_relationships(resource, uid, relationship):
             'description': '{0} of {1}'.format(rel_display_name, item.display_name)
         }
     }
-
-    related_nodes = getattr(item, relationship).match()
-    for node in related_nodes:
-        serialized_node = node.serialized_all
-        serialized_node['resource_type'] = node.__label__
-        serialized_node['display_name'] = node.display_name
+    results['meta'].update(get_pagination_meta(limit, offset, total))
+
+    # The related nodes are serialized one at a time so that the response stops growing at the
+    # limits
+    budget = ResponseBudget(current_app.config)
+    for index, node in enumerate(related_nodes):
+        if shallow:
+            serialized_node = node.serialized
+        else:
+            serialized_node = node.serialized_all
+            serialized_node['resource_type'] = node.__label__
+            serialized_node['display_name'] = node.display_name
+        serialized_node = select_fields(serialized_node)
+        if not budget.add(serialized_node, nodes=count_serialized_nodes(serialized_node)):
+            results['meta']['truncated'] = True
+            results['meta']['next_cursor'] = encode_cursor(offset + index)
+            break
         results['data'].append(serialized_node)
 
     return jsonify(results)
@@ -371,6 +570,7 @@ def get_artifact_relationships(resource, uid, relationship):
 
 @api_v1.route('/recents')
 @login_required
+@set_query_timeout('recents')
 def get_recent_stories():
     """Get stories that were most recently updated, by their artifact type."""
     nodes, meta = get_recent_nodes()
@@ -379,3 +579,155 @@ def get_recent_stories():
         'metadata': meta
     }
     return jsonify(result)
+
+
+def _get_search_limit():
+    """
+    Get the maximum number of results of a search from the limit query parameter.
+
+    :return: the maximum number of results
+    :rtype: int
+    :raises ValidationError: if the limit is invalid
+    """
+    max_limit = current_app.config['SEARCH_MAX_LIMIT']
+    limit = request.args.get('limit', current_app.config['SEARCH_DEFAULT_LIMIT'])
+    try:
+        limit = int(limit)
+    except ValueError:
+        limit = 0
+    if limit < 1 or limit > max_limit:
+        raise ValidationError(
+            'The limit parameter must be an integer between 1 and {0}'.format(max_limit))
+    return limit
+
+
+@api_v1.route('/search')
+@login_required
+@limit_concurrency
+@set_query_timeout('search')
+def search_artifacts():
+    """
+    Search the artifacts by the prefixes of their names and descriptions.
+
+    The "q" query parameter is the searched text, and every word in it must be the prefix of a word
+    of a build name, an advisory name or synopsis, a bug short description or a commit message. The
+    "limit" query parameter is the maximum number of results.
+
+    :return: a Flask JSON response with the artifacts sorted from the most relevant
+    :rtype: flask.Response
+    :raises ValidationError: if the query parameters are invalid
+    """
+    text = request.args.get('q', '').strip()
+    if not text:
+        raise ValidationError('The q parameter must be set')
+
+    limit = _get_search_limit()
+    results = {
+        'data': [],
+        'meta': {
+            'limit': limit,
+            'query': text,
+        }
+    }
+    for node in search_nodes(text, limit):
+        results['data'].append(node.serialized)
+
+    return jsonify(results)
+
+
+@api_v1.route('/typeahead')
+@login_required
+def get_typeahead_matches():
+    """
+    Get the artifacts whose identifier starts with a prefix from the in-memory typeahead index.
+
+    The identifiers are the NVRs of the builds, the names of the advisories and the IDs of the
+    bugs, and they're matched ignoring the case. The "q" query parameter is the prefix, and the
+    "limit" query parameter is the maximum number of results.
+
+    :return: a Flask JSON response with the artifacts sorted by their identifier
+    :rtype: flask.Response
+    :raises NotFound: if the typeahead index is disabled
+    :raises ServiceUnavailable: if the typeahead index is not built yet
+    :raises ValidationError: if the query parameters are invalid
+    """
+    if not current_app.config['TYPEAHEAD_ENABLED']:
+        raise NotFound('The typeahead index is disabled')
+
+    prefix = request.args.get('q', '').strip()
+    if not prefix:
+        raise ValidationError('The q parameter must be set')
+    limit = _get_search_limit()
+
+    index = get_typeahead_index(current_app.config)
+    if index is None:
+        raise ServiceUnavailable('The typeahead index is being built, please try again later')
+
+    results = {
+        'data': [],
+        'meta': {
+            'limit': limit,
+            'query': prefix,
+        }
+    }
+    for _, resource_type, uid, identifier in index.lookup(prefix, limit):
+        results['data'].append(
+            {'resource_type': resource_type, 'id': uid, 'identifier': identifier})
+
+    return jsonify(results)
+
+
+@api_v1.route('/changes')
+@login_required
+def get_changes():
+    """
+    Stream the notifications of the changes to the subscribed nodes as server-sent events.
+
+    The nodes are subscribed to with the node query parameter in the format of
+    ``<resource>:<uid>``, and the recent nodes with the recents query parameter. A notification is
+    sent when a scraper run changes them, as recorded in the changelog.
+
+    :return: a Flask response streaming the server-sent events
+    :rtype: flask.Response
+    :raises ValidationError: if the subscriptions are invalid
+    """
+    node_keys = set()
+    for node in request.args.getlist('node'):
+        resource, _, uid = node.partition(':')
+        if not resource or not uid:
+            raise ValidationError('The node parameter must be in the format of "<resource>:<uid>"')
+        node_keys.add('{0}:{1}'.format(resource.lower(), uid))
+    recents = str_to_bool(request.args.get('recents'))
+    if not node_keys and not recents:
+        raise ValidationError('At least one node or the recents must be subscribed to')
+
+    # A client that reconnects is notified of the changes it missed
+    after = request.headers.get('Last-Event-ID')
+    if after:
+        try:
+            after = int(after)
+        except ValueError:
+            raise ValidationError('The Last-Event-ID header must be an integer')
+    else:
+        after = None
+
+    poll_interval = current_app.config['CHANGELOG_POLL_INTERVAL']
+    if not open_stream(current_app.config['CHANGE_STREAM_MAX_STREAMS']):
+        log.warning('Rejected a change stream since too many change streams are open')
+        raise ServiceUnavailable(
+            'Too many change streams are open, please try again later', retry_after=poll_interval)
+    try:
+        poller = get_changelog_poller(poll_interval)
+        if after is None:
+            after = poller.poll()
+        stream = stream_changes(
+            poller, node_keys, recents, after, current_app.config['CHANGE_STREAM_DURATION'])
+        # Proxies such as nginx must not buffer the events
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        response = Response(stream, mimetype='text/event-stream', headers=headers)
+    except Exception:
+        close_stream()
+        raise
+    # The stream is released when the response ends, even if the client disconnects early
+    response.call_on_close(close_stream)
+    return response
@@ -4,10 +4,11 @@ from __future__ import unicode_literals
 
 import os
 import warnings
+from importlib.util import find_spec
 
 from flask import Flask, current_app, request
-from neo4j.exceptions import AuthError, ServiceUnavailable
-from neomodel import config as neomodel_config
+from neo4j.exceptions import (AuthError, ClientError, ServiceUnavailable,
+                              TransientError)
 from werkzeug.exceptions import default_exceptions
 
 from estuary import log
@@ -15,6 +16,8 @@ from estuary.api.health_check import health_check
 from estuary.api.v1 import api_v1
 from estuary.error import ValidationError, json_error
 from estuary.logger import init_logging
+from estuary.utils.database import configure_database, warm_up
+from estuary.utils.typeahead import get_typeahead_index
 
 
 def load_config(app):
@@ -43,6 +46,8 @@ def load_config(app):
         warnings.warn(
             'The value of the environment variable "ENABLE_AUTH" is invalid and will be ignored')
 
+    if os.environ.get('GUNICORN_THREADS'):
+        app.config['WORKER_THREADS'] = int(os.environ['GUNICORN_THREADS'])
     if os.environ.get('CORS_ORIGINS'):
         app.config['CORS_ORIGINS'] = os.environ['CORS_ORIGINS'].split(',')
     if os.environ.get('EMPLOYEE_TYPES'):
@@ -70,7 +75,7 @@ def insert_headers(response):
     if origin and origin in cors_origins:
         response.headers['Access-Control-Allow-Origin'] = origin
         response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
-        response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
+        response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
     return response
 
 
@@ -98,8 +103,18 @@ def create_app(config_obj=None):
         elif not app.config['OIDC_CLIENT_SECRET']:
             raise RuntimeError(base_error.format('OIDC_CLIENT_SECRET'))
 
-    # Set the Neo4j connection URI based on the Flask config
-    neomodel_config.DATABASE_URL = app.config.get('NEO4J_URI')
+    # The expensive requests, the requests waiting for them and the change streams each occupy a
+    # worker thread, so at least one thread must be left for the other API endpoints
+    reserved_threads = sum(app.config[name] for name in (
+        'EXPENSIVE_REQUESTS_CONCURRENCY', 'EXPENSIVE_REQUESTS_QUEUE_SIZE',
+        'CHANGE_STREAM_MAX_STREAMS'))
+    if reserved_threads >= app.config['WORKER_THREADS']:
+        raise RuntimeError(
+            'The sum of "EXPENSIVE_REQUESTS_CONCURRENCY", "EXPENSIVE_REQUESTS_QUEUE_SIZE" and '
+            '"CHANGE_STREAM_MAX_STREAMS" must be lower than "WORKER_THREADS" ({0})'.format(
+                app.config['WORKER_THREADS']))
+
+    configure_database(app)
 
     if app.config['ENABLE_AUTH']:
         # Import this here so that flask_oidc isn't required to run the app if authentication is
@@ -114,6 +129,8 @@ def create_app(config_obj=None):
     app.register_error_handler(ValidationError, json_error)
     app.register_error_handler(ServiceUnavailable, json_error)
     app.register_error_handler(AuthError, json_error)
+    app.register_error_handler(ClientError, json_error)
+    app.register_error_handler(TransientError, json_error)
     app.register_blueprint(api_v1, url_prefix='/api/v1')
     app.add_url_rule('/healthcheck', view_func=health_check)
     try:
@@ -126,6 +143,20 @@ def create_app(config_obj=None):
         if 'prometheus_client' not in str(e):
             raise
 
+    # NumPy is slow to import, so only check that it's installed until the analytics are requested
+    if find_spec('numpy'):
+        from estuary.api.analytics import analytics_api
+        app.register_blueprint(analytics_api, url_prefix='/api/v1/analytics')
+    else:
+        # If numpy isn't installed, then don't register the analytics blueprint
+        log.warning('NumPy is not installed, so the analytics will be disabled')
+
     app.after_request(insert_headers)
 
+    if app.config['NEO4J_WARMUP']:
+        warm_up(app)
+    if app.config['TYPEAHEAD_ENABLED']:
+        # Start building the typeahead index in the background before serving requests
+        get_typeahead_index(app.config)
+
     return app
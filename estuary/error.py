@@ -2,12 +2,19 @@
 
 from __future__ import unicode_literals
 
-from flask import jsonify
-from neo4j.exceptions import AuthError, ServiceUnavailable
+from flask import g, jsonify
+from neo4j.exceptions import (AuthError, ClientError, Neo4jError,
+                              ServiceUnavailable)
 from werkzeug.exceptions import HTTPException
 
 from estuary import log
 
+# The error codes Neo4j returns when a transaction exceeds its timeout
+QUERY_TIMEOUT_ERROR_CODES = (
+    'Neo.ClientError.Transaction.TransactionTimedOut',
+    'Neo.TransientError.Transaction.TransactionTimedOut',
+)
+
 
 class ValidationError(ValueError):
     """A custom exception handled by Flask to denote bad user input."""
@@ -15,6 +22,31 @@ class ValidationError(ValueError):
     pass
 
 
+def is_pool_exhausted_error(error):
+    """
+    Determine if an exception was raised because the connection pool is exhausted.
+
+    :param Exception error: the exception to check
+    :return: a boolean determining if the connection pool is exhausted
+    :rtype: bool
+    """
+    # The driver doesn't have a dedicated exception for this. The errors returned by Neo4j always
+    # have a status code, while the driver raises a ClientError without one when no connection of
+    # the pool became available within the acquisition timeout.
+    return type(error) is ClientError and error.code is None
+
+
+def is_query_timeout_error(error):
+    """
+    Determine if an exception was raised because a query exceeded its transaction timeout.
+
+    :param Exception error: the exception to check
+    :return: a boolean determining if the query timed out
+    :rtype: bool
+    """
+    return isinstance(error, Neo4jError) and error.code in QUERY_TIMEOUT_ERROR_CODES
+
+
 def json_error(error):
     """
     Convert exceptions to JSON responses.
@@ -29,6 +61,10 @@ def json_error(error):
             'message': error.description
         })
         response.status_code = error.code
+        # Keep the headers specific to the error, such as Retry-After
+        for header, value in error.get_headers():
+            if header != 'Content-Type':
+                response.headers[header] = value
     else:
         # Log the actual exception before it's gobbled up by Flask
         log.exception(error)
@@ -39,6 +75,17 @@ def json_error(error):
         elif isinstance(error, ServiceUnavailable) or isinstance(error, AuthError):
             status_code = 503
             message = 'The database connection failed'
+        elif is_pool_exhausted_error(error):
+            status_code = 503
+            message = 'The database connection pool is exhausted'
+        elif is_query_timeout_error(error):
+            status_code = 504
+            message = 'The request took too long to process and was cancelled'
+            # This is used to record the timeout in the metrics
+            g.query_timed_out = True
+        elif isinstance(error, Neo4jError):
+            # Don't send the Cypher queries and the internal errors of Neo4j to the client
+            message = 'The database failed to process the request'
 
         response = jsonify({
             'status': status_code,
@@ -5,16 +5,27 @@ from __future__ import unicode_literals
 from datetime import datetime
 
 from neomodel import (EITHER, INCOMING, OUTGOING, One, StructuredNode,
-                      UniqueIdProperty, ZeroOrOne)
+                      UniqueIdProperty, ZeroOrOne, db)
 
 from estuary import log
-from estuary.utils.general import inflate_node
+from estuary.error import ValidationError
+from estuary.utils.changelog import is_recording, record_changed_nodes
+from estuary.utils.database import apply_query_timeout
+from estuary.utils.degrees import DEGREE_PROPERTY_PREFIX, get_degree_property
+from estuary.utils.general import (get_batch_cache, get_relationship_limit,
+                                   get_requested_fields, inflate_node)
+
+# The property temporarily set on the nodes created by get_or_create to tell them apart
+CREATED_MARKER_PROPERTY = '_estuary_created'
 
 
 class EstuaryStructuredNode(StructuredNode):
     """Base class for Estuary Neo4j models."""
 
     __abstract_node__ = True
+    # The properties the display name of the node is made of, so that they're always queried even
+    # if they weren't requested with the fields query parameter
+    __display_properties__ = ()
 
     @property
     def display_name(self):
@@ -33,6 +44,40 @@ class EstuaryStructuredNode(StructuredNode):
         """Get the DateTime property used for the Estuary timeline."""
         raise NotImplementedError('The timeline_datetime method is not defined')
 
+    @classmethod
+    def get_projection(cls, variable):
+        """
+        Get the Cypher expression returning a node with only the properties needed by the response.
+
+        When the fields query parameter is set, only the requested properties of the node and of the
+        models inheriting from it are returned, along with its unique identifier and the properties
+        of its display name.
+
+        :param str variable: the Cypher variable of the node
+        :return: the Cypher variable if all the properties are needed, or an expression returning a
+            list of the internal ID, the labels and the properties of the node, which inflate_node
+            accepts
+        :rtype: str
+        """
+        # Avoid circular imports
+        from estuary.models import all_models
+
+        fields = get_requested_fields()
+        if not fields:
+            return variable
+
+        properties = set()
+        for model in all_models:
+            if not issubclass(model, cls):
+                continue
+            for name, prop in model.__all_properties__:
+                if (name in fields or prop.db_property in fields
+                        or name in model.__display_properties__
+                        or isinstance(prop, UniqueIdProperty)):
+                    properties.add(prop.db_property or name)
+        return '[id({0}), labels({0}), {0} {{{1}}}]'.format(
+            variable, ', '.join('.{0}'.format(prop) for prop in sorted(properties)))
+
     @property
     def serialized(self):
         """
@@ -41,6 +86,11 @@ class EstuaryStructuredNode(StructuredNode):
         :return: a serialized form of the node
         :rtype: dictionary
         """
+        cache = get_batch_cache('serialized')
+        if cache is not None and self.id in cache:
+            # The callers add keys to the serialized node, so they get a copy
+            return dict(cache[self.id])
+
         rv = {}
         for key, value in self.__properties__.items():
             # id is the internal Neo4j ID that we don't want to display to the user
@@ -54,6 +104,9 @@ class EstuaryStructuredNode(StructuredNode):
                 rv[actual_key] = value
         rv['resource_type'] = self.__label__
         rv['display_name'] = self.display_name
+        if cache is not None and self.id is not None:
+            cache[self.id] = rv
+            return dict(rv)
         return rv
 
     @property
@@ -68,6 +121,11 @@ class EstuaryStructuredNode(StructuredNode):
         # Avoid circular imports
         from estuary.models import models_inheritance
 
+        cache = get_batch_cache('serialized_all')
+        if cache is not None and self.id in cache:
+            # The callers add keys to the serialized node, so they get a copy
+            return dict(cache[self.id])
+
         # A set that will keep track of all properties on the node that weren't returned from Neo4j
         null_properties = set()
         # A mapping of Neo4j relationship names in the format of:
@@ -77,7 +135,13 @@ class EstuaryStructuredNode(StructuredNode):
         #     }
         # }
         relationship_map = {}
+        # Only the relationships requested with the fields query parameter are queried
+        fields = get_requested_fields()
+        relationship_types = set()
         for property_name, relationship in self.__all_relationships__:
+            if fields and property_name not in fields:
+                continue
+            relationship_types.add(relationship.definition['relation_type'])
             node_label = relationship.definition['node_class'].__label__
             relationship_name = relationship.definition['relation_type']
             for label in models_inheritance[node_label]:
@@ -103,39 +167,74 @@ class EstuaryStructuredNode(StructuredNode):
         # This variable will contain the current node as serialized + all relationships
         serialized = self.serialized
         # Get all the direct relationships in both directions
-        results, _ = self.cypher('MATCH (a) WHERE id(a)={self} MATCH (a)-[r]-(all) RETURN r, all')
-        for relationship, node in results:
+        rel_pattern = 'r'
+        if fields:
+            rel_pattern = 'r:{0}'.format('|'.join(sorted(relationship_types)))
+        limit = get_relationship_limit()
+        if fields and not relationship_types:
+            # None of the relationships were requested, so there is nothing to query
+            results = []
+        elif limit:
+            # Group the related nodes by relationship so that only the most recently created
+            # related nodes of each relationship are returned by Neo4j, along with the total number
+            # of related nodes
+            results, _ = self.cypher(apply_query_timeout(
+                'MATCH (a) WHERE id(a)={{self}} MATCH (a)-[{0}]-(all) '
+                'WITH a, r, all ORDER BY id(all) DESC '
+                'WITH type(r) AS rel_type, startNode(r) = a AS outgoing, labels(all) AS labels, '
+                'count(all) AS total, collect(all)[..{{limit}}] AS related '
+                'RETURN rel_type, outgoing, total, related'.format(rel_pattern)), {'limit': limit})
+        else:
+            results, _ = self.cypher(apply_query_timeout(
+                'MATCH (a) WHERE id(a)={{self}} MATCH (a)-[{0}]-(all) '
+                'RETURN type(r), startNode(r) = a, 1, [all]'.format(rel_pattern)))
+
+        counts = {}
+        # The internal IDs of the related nodes of each one-to-many relationship
+        node_ids = {}
+        for relationship_type, outgoing, count, nodes in results:
             # If the starting node in the relationship is the same as the node being serialized,
             # we know that the relationship is outgoing
-            if relationship.start_node.id == self.id:
+            if outgoing:
                 direction = OUTGOING
             else:
                 direction = INCOMING
 
-            # Convert the Neo4j result into a model object
-            inflated_node = inflate_node(node)
-            try:
-                property_name, cardinality_class = \
-                    relationship_map[inflated_node.__label__][relationship.type][direction]
-            except KeyError:
-                if direction == OUTGOING:
-                    direction_text = 'outgoing'
-                else:
-                    direction_text = 'incoming'
-                log.warn(
-                    'An {0} {1} relationship of {2!r} with {3!r} is not mapped in the models and '
-                    'will be ignored'.format(direction_text, relationship.type, self, inflate_node))
-                continue
+            group_property_name = None
+            for node in nodes:
+                # Convert the Neo4j result into a model object
+                inflated_node = inflate_node(node)
+                try:
+                    property_name, cardinality_class = \
+                        relationship_map[inflated_node.__label__][relationship_type][direction]
+                except KeyError:
+                    if direction == OUTGOING:
+                        direction_text = 'outgoing'
+                    else:
+                        direction_text = 'incoming'
+                    log.warn(
+                        'An {0} {1} relationship of {2!r} with {3!r} is not mapped in the models '
+                        'and will be ignored'.format(
+                            direction_text, relationship_type, self, inflate_node))
+                    continue
+
+                group_property_name = property_name
+                if not serialized.get(property_name):
+                    null_properties.remove(property_name)
 
-            if not serialized.get(property_name):
-                null_properties.remove(property_name)
+                if cardinality_class in (One, ZeroOrOne):
+                    serialized[property_name] = inflated_node.serialized
+                else:
+                    if not serialized.get(property_name):
+                        serialized[property_name] = []
+                        counts[property_name] = 0
+                        node_ids[property_name] = []
+                    serialized[property_name].append(inflated_node.serialized)
+                    node_ids[property_name].append(inflated_node.id)
 
-            if cardinality_class in (One, ZeroOrOne):
-                serialized[property_name] = inflated_node.serialized
-            else:
-                if not serialized.get(property_name):
-                    serialized[property_name] = []
-                serialized[property_name].append(inflated_node.serialized)
+            # The nodes of a relationship may be grouped by several labels
+            if group_property_name in counts:
+                counts[group_property_name] += count
 
         # Neo4j won't return back relationships it doesn't know about, so just make them empty
         # so that the keys are always consistent
@@ -145,9 +244,160 @@ class EstuaryStructuredNode(StructuredNode):
                 serialized[property_name] = None
             else:
                 serialized[property_name] = []
-
+                counts[property_name] = 0
+
+        if limit:
+            serialized['truncated'] = False
+            for property_name, count in counts.items():
+                # The related nodes with different labels are limited in separate groups, so the
+                # most recently created nodes of all the groups are kept
+                related = sorted(zip(node_ids.get(property_name, []), serialized[property_name]),
+                                 key=lambda id_and_node: id_and_node[0], reverse=True)
+                serialized[property_name] = [node for _, node in related[:limit]]
+                serialized['{0}_count'.format(property_name)] = count
+                if count > limit:
+                    serialized['truncated'] = True
+
+        if cache is not None and self.id is not None:
+            cache[self.id] = serialized
+            return dict(serialized)
         return serialized
 
+    def get_related_nodes(self, relationship, order_by=None, skip=0, limit=None):
+        """
+        Get a page of the nodes of a relationship, sorted and paginated by Neo4j.
+
+        The related nodes are counted in a separate query, so that only the nodes of the page are
+        returned by Neo4j.
+
+        :param str relationship: the name of the relationship property
+        :kwarg str order_by: the property of the related nodes to sort by, prefixed with "-" for a
+            descending order. The most recently created nodes are first by default.
+        :kwarg int skip: the number of nodes to skip
+        :kwarg int limit: the maximum number of nodes to return
+        :return: a tuple of the list of related nodes and the total number of related nodes
+        :rtype: tuple
+        :raises ValidationError: if the property to sort by is invalid
+        """
+        definition = dict(self.__all_relationships__)[relationship].definition
+        node_class = definition['node_class']
+        if definition['direction'] == OUTGOING:
+            pattern = '(item)-[:{0}]->(node:{1})'
+        elif definition['direction'] == INCOMING:
+            pattern = '(item)<-[:{0}]-(node:{1})'
+        else:
+            pattern = '(item)-[:{0}]-(node:{1})'
+        pattern = pattern.format(definition['relation_type'], node_class.__label__)
+
+        # The internal ID is used as a tie breaker so that the pages are consistent
+        order = 'id(node) DESC'
+        if order_by:
+            property_name = order_by.lstrip('-')
+            properties = set(prop.db_property or name
+                             for name, prop in node_class.__all_properties__)
+            if property_name not in properties:
+                raise ValidationError(
+                    'The order_by parameter must be one of the following properties: {0}'.format(
+                        ', '.join(sorted(properties))))
+            direction = 'DESC' if order_by.startswith('-') else 'ASC'
+            order = 'node.{0} {1}, id(node) {1}'.format(property_name, direction)
+
+        match = 'MATCH (item) WHERE id(item) = {{self}} MATCH {0} '.format(pattern)
+        results, _ = self.cypher(apply_query_timeout(match + 'RETURN count(node)'))
+        total = results[0][0]
+        if skip >= total:
+            return [], total
+
+        query = match + 'WITH node ORDER BY {0} SKIP {{skip}} '.format(order)
+        if limit is not None:
+            query += 'LIMIT {limit} '
+        query += 'RETURN {0}'.format(node_class.get_projection('node'))
+        results, _ = self.cypher(apply_query_timeout(query), {'skip': skip, 'limit': limit})
+        return [inflate_node(node) for node, in results], total
+
+    @classmethod
+    def inflate(cls, node):
+        """
+        Inflate a Neo4j node to a model object, keeping the degree counters stored on the node.
+
+        The degree counters aren't properties of the models, so neomodel doesn't inflate them.
+
+        :param neo4j.graph.Node node: the node to inflate
+        :return: the model object
+        :rtype: EstuaryStructuredNode
+        """
+        inflated_node = super(EstuaryStructuredNode, cls).inflate(node)
+        if not isinstance(node, int):
+            inflated_node._degrees = {
+                key: value for key, value in node.items()
+                if key.startswith(DEGREE_PROPERTY_PREFIX)
+            }
+        return inflated_node
+
+    def get_degree(self, rel_type, label):
+        """
+        Get the number of nodes with a label related to the node with a relationship type.
+
+        The degree counters are stored on the nodes by the scrapers.
+
+        :param str rel_type: the relationship type
+        :param str label: the label of the related nodes
+        :return: the number of related nodes or None if the counter isn't stored on the node
+        :rtype: int or None
+        """
+        return getattr(self, '_degrees', {}).get(get_degree_property(rel_type, label))
+
+    @classmethod
+    def get_or_create(cls, *props, **kwargs):
+        """
+        Get or create the nodes and record the created nodes in the changelog if it's recording.
+
+        The existing nodes are left unchanged, so they're only recorded when the scrapers connect
+        them to other nodes. This is the MERGE query of neomodel, which also returns whether each
+        node was created.
+
+        :return: the nodes
+        :rtype: list
+        """
+        if not is_recording() or kwargs.get('lazy'):
+            return super(EstuaryStructuredNode, cls).get_or_create(*props, **kwargs)
+        elif kwargs.get('relationship') is not None:
+            # The relationship to the node may have been created even if the node existed
+            nodes = super(EstuaryStructuredNode, cls).get_or_create(*props, **kwargs)
+            record_changed_nodes(nodes)
+            return nodes
+
+        merge_properties = ', '.join(
+            '{0}: params.create.{0}'.format(getattr(cls, prop).db_property or prop)
+            for prop in cls.__required_properties__)
+        # The temporary property marking the created nodes is removed in the same transaction
+        query = (
+            'UNWIND {{merge_params}} AS params '
+            'MERGE (n:{labels} {{{merge_properties}}}) '
+            'ON CREATE SET n = params.create, n.{marker} = true '
+            'WITH n, n.{marker} IS NOT NULL AS created '
+            'REMOVE n.{marker} '
+            'RETURN n, created'
+        ).format(labels=':'.join(cls.inherited_labels()), merge_properties=merge_properties,
+                 marker=CREATED_MARKER_PROPERTY)
+        results, _ = db.cypher_query(
+            query, {'merge_params': [{'create': cls.deflate(p, skip_empty=True)} for p in props]})
+        nodes = [cls.inflate(node) for node, _ in results]
+        record_changed_nodes([node for node, (_, created) in zip(nodes, results) if created])
+        return nodes
+
+    @classmethod
+    def create_or_update(cls, *props, **kwargs):
+        """
+        Create or update the nodes and record them in the changelog if the recording is started.
+
+        :return: the nodes
+        :rtype: list
+        """
+        nodes = super(EstuaryStructuredNode, cls).create_or_update(*props, **kwargs)
+        record_changed_nodes(nodes)
+        return nodes
+
     @classmethod
     def find_or_none(cls, identifier):
         """
@@ -175,10 +425,13 @@ class EstuaryStructuredNode(StructuredNode):
             one
         """
         if new_node not in relationship:
+            record_changed_nodes([relationship.source, new_node])
             if len(relationship) == 0:
                 relationship.connect(new_node)
             else:
                 if isinstance(relationship, ZeroOrOne):
+                    # The replaced node is no longer related to the source node
+                    record_changed_nodes(relationship.all())
                     relationship.replace(new_node)
                 elif isinstance(relationship, One):
                     raise NotImplementedError(
@@ -11,6 +11,8 @@ from estuary.models.base import EstuaryStructuredNode
 class DistGitRepo(EstuaryStructuredNode):
     """Definition of a dist-git repo in Neo4j."""
 
+    __display_properties__ = ('namespace', 'name')
+
     name = StringProperty(required=True)
     namespace = StringProperty(required=True)
     commits = RelationshipTo('DistGitCommit', 'CONTAINS')
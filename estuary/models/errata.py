@@ -15,6 +15,8 @@ from estuary.models.base import EstuaryStructuredNode
 class Advisory(EstuaryStructuredNode):
     """Definition of an Errata advisory in Neo4j."""
 
+    __display_properties__ = ('advisory_name',)
+
     class BuildAttachedRel(StructuredRel):
         """Definition of a relationship between an Advisory and a KojiBuild attached to it."""
 
@@ -16,6 +16,8 @@ from estuary.models.errata import Advisory
 class KojiBuild(EstuaryStructuredNode):
     """Definition of a Koji build in Neo4j."""
 
+    __display_properties__ = ('name', 'version', 'release')
+
     advisories = RelationshipFrom('.errata.Advisory', 'ATTACHED', model=Advisory.BuildAttachedRel)
     commit = RelationshipTo('.distgit.DistGitCommit', 'BUILT_FROM', cardinality=ZeroOrOne)
     completion_time = DateTimeProperty(index=True)
@@ -0,0 +1,128 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import threading
+from functools import wraps
+
+from flask import current_app, g
+from werkzeug.exceptions import ServiceUnavailable
+
+from estuary import log
+
+
+class ConcurrencyLimiter(object):
+    """Limit the number of requests processed concurrently, with a bounded queue for the rest."""
+
+    def __init__(self, max_concurrency, max_queue_size, queue_timeout):
+        """
+        Initialize the ConcurrencyLimiter class.
+
+        :param int max_concurrency: the maximum number of requests processed concurrently
+        :param int max_queue_size: the maximum number of requests waiting to be processed
+        :param float queue_timeout: the maximum number of seconds a request waits in the queue
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.queued = 0
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Acquire a slot to process a request, waiting in the queue if all of them are taken.
+
+        :return: a boolean determining if a slot was acquired
+        :rtype: bool
+        """
+        acquired = self._semaphore.acquire(False)
+        if not acquired:
+            with self._lock:
+                if self.queued >= self.max_queue_size:
+                    return False
+                self.queued += 1
+            try:
+                acquired = self._semaphore.acquire(timeout=self.queue_timeout)
+            finally:
+                with self._lock:
+                    self.queued -= 1
+
+        if acquired:
+            with self._lock:
+                self.active += 1
+        return acquired
+
+    def release(self):
+        """Release the slot acquired to process a request."""
+        with self._lock:
+            self.active -= 1
+        self._semaphore.release()
+
+
+# The limiter of the expensive API endpoints. It's created from the Flask config on first use.
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    """
+    Get the limiter of the expensive API endpoints of this process.
+
+    :return: the limiter
+    :rtype: ConcurrencyLimiter
+    """
+    global _limiter
+
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = ConcurrencyLimiter(
+                current_app.config['EXPENSIVE_REQUESTS_CONCURRENCY'],
+                current_app.config['EXPENSIVE_REQUESTS_QUEUE_SIZE'],
+                current_app.config['EXPENSIVE_REQUESTS_QUEUE_TIMEOUT'])
+        return _limiter
+
+
+def get_limiter_stats():
+    """
+    Get the utilization of the limiter of the expensive API endpoints.
+
+    :return: a dictionary with the number of requests being processed and the queue depth
+    :rtype: dict
+    """
+    if _limiter is None:
+        return {'active': 0, 'queued': 0}
+    return {'active': _limiter.active, 'queued': _limiter.queued}
+
+
+def limit_concurrency(f):
+    """
+    Decorate an expensive Flask route to limit the number of its concurrent requests.
+
+    When the limit is reached, requests wait in a bounded queue. If the queue is full or the
+    request waited for too long, the request is rejected immediately so that the workers remain
+    available for the inexpensive API endpoints.
+
+    :param function f: the function to wrap
+    :return: the wrapper function
+    :rtype: function
+    :raises ServiceUnavailable: if the request can't be processed right now
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        limiter = get_limiter()
+        if not limiter.acquire():
+            log.warning(
+                'Rejected a request to %s since too many expensive requests are in progress',
+                f.__name__)
+            # This is used to record the rejection in the metrics
+            g.admission_rejected = True
+            raise ServiceUnavailable(
+                'Too many expensive requests are in progress, please try again later',
+                retry_after=current_app.config['EXPENSIVE_REQUESTS_RETRY_AFTER'])
+        try:
+            return f(*args, **kwargs)
+        finally:
+            limiter.release()
+    return wrapper
@@ -0,0 +1,258 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import calendar
+import time
+
+import numpy
+
+from estuary.models.errata import ContainerAdvisory
+from estuary.utils.database import run_read_queries
+from estuary.utils.story import (COMPLETION_PROPERTIES,
+                                 FRESHMAKER_FINAL_STATES, TIMELINE_PROPERTIES,
+                                 BaseStoryManager, ContainerStoryManager)
+from estuary.utils.story_metrics import ADVISORY_FINAL_STATES
+
+# The percentiles of the metrics of the stories
+PERCENTILES = (50, 90)
+# The properties of the start and the end of the processing of each artifact, like in
+# BaseStoryManager.get_total_processing_time
+PROCESSING_PROPERTIES = {
+    'FreshmakerEvent': ('time_created', 'time_done'),
+    'KojiBuild': ('creation_time', 'completion_time'),
+    'ModuleKojiBuild': ('creation_time', 'completion_time'),
+    'ContainerKojiBuild': ('creation_time', 'completion_time'),
+    'Advisory': ('created_at', 'status_time'),
+    'ContainerAdvisory': ('created_at', 'status_time'),
+}
+# The properties storing the states of the artifacts
+STATE_PROPERTIES = {
+    'Advisory': 'state',
+    'ContainerAdvisory': 'state',
+    'FreshmakerEvent': 'state_name',
+}
+
+
+def get_container_story_sequence():
+    """
+    Get the labels and relationships of the container stories, from the container advisories.
+
+    :return: the label of the container advisory followed by the relationship and the label of
+        each previous artifact in the story flow
+    :rtype: list
+    """
+    return ContainerStoryManager().get_story_sequence(ContainerAdvisory, reverse=True)
+
+
+def get_container_stories_query():
+    """
+    Create the Cypher query of the timestamps of the container stories in a window.
+
+    There is a story per container build attached to a container advisory of the product created
+    in the window. Like in the story API, the story of each build is the longest path of the
+    container story flow from it, so it stops at the first artifact without a previous artifact
+    on that path.
+
+    :return: the Cypher query, with the "product", "since" and "until" parameters, returning a
+        column with the properties of each artifact from the container advisory to the first
+        artifact, followed by a column with the time each build was attached to an advisory
+    :rtype: str
+    """
+    sequence = get_container_story_sequence()
+    labels = sequence[::2]
+    relationships = sequence[1::2]
+    # The sequences of APOC repeat, so they end with a relationship type that doesn't exist
+    query = (
+        'MATCH (node0:{label}){pattern}(node1:{next_label}) '
+        'WHERE node0.product_name = {{product}} AND node0.{timeline} >= {{since}} '
+        'AND node0.{timeline} < {{until}} '
+        'CALL apoc.path.expandConfig(node1, {{sequence:\'{sequence}, None, None\', '
+        'minLevel:0}}) YIELD path '
+        'WITH node0, rel0, node1, path ORDER BY length(path) DESC '
+        'WITH node0, rel0, node1, head(collect(path)) AS path '
+        'WITH node0, rel0, nodes(path) AS path_nodes, relationships(path) AS path_rels '
+    ).format(label=labels[0], next_label=labels[1], timeline=TIMELINE_PROPERTIES[labels[0]],
+             pattern=BaseStoryManager.get_relationship_pattern(relationships[0], 'rel0'),
+             sequence=', '.join(sequence[2:]))
+    # The nodes and the relationships past the end of a shorter path are null
+    query += 'WITH node0, rel0, {0}, {1} '.format(
+        ', '.join('path_nodes[{0}] AS node{1}'.format(index - 1, index)
+                  for index in range(1, len(labels))),
+        ', '.join('path_rels[{0}] AS rel{1}'.format(index - 1, index)
+                  for index in range(1, len(relationships))))
+
+    columns = []
+    for index, label in enumerate(labels):
+        properties = set([TIMELINE_PROPERTIES[label], COMPLETION_PROPERTIES[label]])
+        properties.update(PROCESSING_PROPERTIES.get(label, ()))
+        if label in STATE_PROPERTIES:
+            properties.add(STATE_PROPERTIES[label])
+        columns.append('node{0} {{{1}}}'.format(
+            index, ', '.join('.{0}'.format(name) for name in sorted(properties))))
+    columns += ['rel{0}.time_attached'.format(index) for index in range(len(relationships))]
+    return query + 'RETURN ' + ', '.join(columns)
+
+
+def _get_property(nodes, name):
+    """
+    Get a timestamp property of the nodes of a step of the stories.
+
+    :param list nodes: the dictionaries of the properties of the nodes, or None for the stories
+        without a node at this step
+    :param str name: the name of the property
+    :return: the timestamps, with NaN for the nodes without the property
+    :rtype: numpy.ndarray
+    """
+    return numpy.array([numpy.nan if node is None or node.get(name) is None else node[name]
+                        for node in nodes], dtype=float)
+
+
+def _is_final(nodes, label):
+    """
+    Check if the artifacts of a step of the stories are done processing.
+
+    :param list nodes: the dictionaries of the properties of the nodes, or None
+    :param str label: the label of the nodes
+    :return: a boolean per node
+    :rtype: numpy.ndarray
+    """
+    final_states = FRESHMAKER_FINAL_STATES if label == 'FreshmakerEvent' else ADVISORY_FINAL_STATES
+    return numpy.array([node is not None and node.get(STATE_PROPERTIES[label]) in final_states
+                        for node in nodes], dtype=bool)
+
+
+def get_story_metrics(labels, nodes, attached_times, now):
+    """
+    Compute the total lead, wait and processing times of stories.
+
+    The metrics are computed like in BaseStoryManager.get_total_lead_time,
+    BaseStoryManager.get_wait_times and BaseStoryManager.get_total_processing_time, but on all the
+    stories at once.
+
+    :param list labels: the labels of the artifacts of the stories, from the oldest to the newest
+    :param list nodes: a list per label of the dictionaries of the properties of the artifacts, or
+        None for the stories that start after this label
+    :param list attached_times: a list of timestamps per pair of consecutive labels, which are
+        the time the build was attached to the advisory, or None
+    :param float now: the current timestamp used for the artifacts still being processed
+    :return: a dictionary of the metric names to an array of the metric of each story, with NaN
+        when the metric can't be computed
+    :rtype: dict
+    """
+    count = len(nodes[0])
+    exists = [numpy.array([node is not None for node in step], dtype=bool) for step in nodes]
+    attached_times = [_get_property([{'time': value} for value in step], 'time')
+                      for step in attached_times]
+
+    # The lead time starts with the first artifact of each story
+    start = numpy.full(count, numpy.nan)
+    for label, step_nodes, step_exists in reversed(list(zip(labels, nodes, exists))):
+        start = numpy.where(step_exists, _get_property(step_nodes, TIMELINE_PROPERTIES[label]),
+                            start)
+    last_label = labels[-1]
+    if last_label.endswith('Advisory'):
+        end = numpy.where(_is_final(nodes[-1], last_label),
+                          _get_property(nodes[-1], 'status_time'), now)
+    else:
+        end = _get_property(nodes[-1], PROCESSING_PROPERTIES[last_label][1])
+        end = numpy.where(numpy.isnan(end), now, end)
+    lead_time = numpy.maximum(end - start, 0)
+
+    wait_time = numpy.zeros(count)
+    for index in range(len(labels) - 1):
+        label = labels[index]
+        next_label = labels[index + 1]
+        # The wait time after a Freshmaker event is part of its processing time
+        if label == 'FreshmakerEvent':
+            continue
+        next_start = _get_property(nodes[index + 1], TIMELINE_PROPERTIES[next_label])
+        if next_label.endswith('Advisory'):
+            # The advisory starts when the build is attached to it
+            next_start = numpy.where(numpy.isnan(next_start), numpy.nan, attached_times[index])
+        wait = next_start - _get_property(nodes[index], COMPLETION_PROPERTIES[label])
+        wait_time += numpy.where(wait >= 0, wait, 0)
+
+    processing_time = numpy.zeros(count)
+    for index, label in enumerate(labels):
+        if label not in PROCESSING_PROPERTIES:
+            continue
+        creation = _get_property(nodes[index], PROCESSING_PROPERTIES[label][0])
+        if label.endswith('Advisory'):
+            completion = numpy.where(_is_final(nodes[index], label),
+                                     _get_property(nodes[index], 'status_time'), now)
+            # The advisory starts processing the build before it when the build is attached
+            build_completion = numpy.full(count, numpy.nan)
+            if index and labels[index - 1].endswith('KojiBuild'):
+                build_completion = _get_property(nodes[index - 1], 'completion_time')
+            attached = attached_times[index - 1] if index else build_completion
+            creation = numpy.where(
+                numpy.isnan(creation), numpy.nan,
+                numpy.where(numpy.isnan(attached), build_completion, attached))
+        elif label == 'FreshmakerEvent' and index != len(labels) - 1:
+            # Only the processing until the next build of the story is created is counted
+            completion = _get_property(
+                nodes[index + 1], PROCESSING_PROPERTIES[labels[index + 1]][0])
+        elif label == 'FreshmakerEvent':
+            completion = numpy.where(_is_final(nodes[index], label),
+                                     _get_property(nodes[index], 'time_done'), now)
+        else:
+            completion = _get_property(nodes[index], PROCESSING_PROPERTIES[label][1])
+            completion = numpy.where(numpy.isnan(completion), now, completion)
+        processing = completion - creation
+        processing_time += numpy.where(processing >= 0, processing, 0)
+
+    return {
+        'lead_time': lead_time,
+        'wait_time': wait_time,
+        'processing_time': processing_time,
+    }
+
+
+def summarize(values):
+    """
+    Summarize a metric of the stories.
+
+    :param numpy.ndarray values: the metric of each story, with NaN when it can't be computed
+    :return: the number of stories with the metric, the mean and the percentiles of the metric
+    :rtype: dict
+    """
+    values = values[~numpy.isnan(values)]
+    summary = {'count': int(values.size), 'mean': None}
+    summary.update(('p{0}'.format(percentile), None) for percentile in PERCENTILES)
+    if values.size:
+        summary['mean'] = round(float(values.mean()), 3)
+        for percentile, value in zip(PERCENTILES, numpy.percentile(values, PERCENTILES)):
+            summary['p{0}'.format(percentile)] = round(float(value), 3)
+    return summary
+
+
+def get_container_story_analytics(product, since, until):
+    """
+    Get the lead, wait and processing times of the container stories of a product.
+
+    The timestamps of all the stories are queried at once, and the metrics are aggregated with
+    NumPy instead of computing the story of each artifact.
+
+    :param str product: the product name of the container advisories
+    :param datetime.date since: the first day the container advisories were created on
+    :param datetime.date until: the day after the last day the container advisories were created on
+    :return: the summary of each metric in seconds and the number of stories
+    :rtype: dict
+    """
+    params = {
+        'product': product,
+        'since': calendar.timegm(since.timetuple()),
+        'until': calendar.timegm(until.timetuple()),
+    }
+    results, _ = run_read_queries([(get_container_stories_query(), params)])[0]
+
+    labels = get_container_story_sequence()[::2]
+    # The columns are in the order of the story, from the first artifact to the container advisory
+    nodes = [[row[index] for row in results] for index in reversed(range(len(labels)))]
+    attached_times = [[row[index] for row in results]
+                      for index in reversed(range(len(labels), 2 * len(labels) - 1))]
+    metrics = get_story_metrics(labels[::-1], nodes, attached_times, time.time())
+    rv = {name: summarize(values) for name, values in metrics.items()}
+    rv['stories'] = len(results)
+    return rv
@@ -0,0 +1,195 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from flask import current_app, request
+
+from estuary import log
+from estuary.utils.singleflight import get_request_key
+
+# The WSGI environment key used by the warmup to replace the cached responses. It can't be set by
+# an HTTP client.
+REFRESH_ENVIRON_KEY = 'estuary.refresh_cache'
+
+
+class ResponseCache(object):
+    """A cache of API responses stored as JSON files, shared by all the API workers of a host."""
+
+    def __init__(self, cache_dir, ttl):
+        """
+        Initialize the ResponseCache class.
+
+        :param str cache_dir: the directory of the cached responses
+        :param float ttl: the number of seconds a cached response is valid for
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self._last_cleanup = time.time()
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _get_path(self, key):
+        """
+        Get the path of the file of a cached response.
+
+        :param str key: the key of the response
+        :return: the path of the file
+        :rtype: str
+        """
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, '{0}.json'.format(digest))
+
+    def get(self, key):
+        """
+        Get a cached response.
+
+        :param str key: the key of the response
+        :return: the response data or None if it isn't cached or it expired
+        """
+        path = self._get_path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, 'r') as cache_file:
+                return json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def set(self, key, data):
+        """
+        Cache a response.
+
+        :param str key: the key of the response
+        :param data: the response data, which must be serializable by the Flask JSON encoder
+        """
+        # The file is renamed so that other processes never read a partially written response
+        with tempfile.NamedTemporaryFile(
+                'w', dir=self.cache_dir, suffix='.tmp', delete=False) as cache_file:
+            json.dump(data, cache_file, cls=current_app.json_encoder)
+        os.rename(cache_file.name, self._get_path(key))
+
+        if time.time() - self._last_cleanup > self.ttl:
+            self._last_cleanup = time.time()
+            self.remove_expired()
+
+    def remove_expired(self):
+        """Remove the expired responses from the cache directory."""
+        now = time.time()
+        for file_name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, file_name)
+            try:
+                if now - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+            except OSError:
+                # Another process removed it first
+                pass
+
+
+# The response cache of this process. It's created from the Flask config on first use.
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Get the response cache of the expensive API endpoints.
+
+    :return: the response cache or None if it's disabled
+    :rtype: ResponseCache or None
+    """
+    global _cache
+
+    cache_dir = current_app.config['RESPONSE_CACHE_DIR']
+    if not cache_dir:
+        return None
+
+    with _cache_lock:
+        if _cache is None or _cache.cache_dir != cache_dir:
+            _cache = ResponseCache(cache_dir, current_app.config['RESPONSE_CACHE_TTL'])
+        return _cache
+
+
+def cache_response(f):
+    """
+    Decorate an expensive Flask route to cache its result in the response cache.
+
+    The route must return data that can be serialized to JSON instead of a Flask response.
+
+    :param function f: the function to wrap
+    :return: the wrapper function
+    :rtype: function
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        cache = get_response_cache()
+        if not cache:
+            return f(*args, **kwargs)
+
+        key = get_request_key()
+        if not request.environ.get(REFRESH_ENVIRON_KEY):
+            data = cache.get(key)
+            if data is not None:
+                return data
+
+        data = f(*args, **kwargs)
+        cache.set(key, data)
+        return data
+    return wrapper
+
+
+def warm_up_response_cache(app, count=5, workers=4):
+    """
+    Compute the story and siblings responses of the most recent nodes into the response cache.
+
+    This picks the nodes shown by the recents API endpoint, so that the first users to open them
+    after a scraper run don't pay for the computation.
+
+    :param flask.Flask app: a Flask application object with the response cache enabled
+    :kwarg int count: the number of recent nodes of each node type to warm up
+    :kwarg int workers: the maximum number of responses computed concurrently
+    :return: a tuple of the number of cached responses and the number of failures
+    :rtype: tuple
+    :raises RuntimeError: if the response cache is disabled
+    """
+    # Avoid circular imports
+    from estuary.utils.recents import get_recent_nodes
+
+    if not app.config['RESPONSE_CACHE_DIR']:
+        raise RuntimeError('The response cache is disabled since RESPONSE_CACHE_DIR is not set')
+
+    with app.app_context():
+        nodes, meta = get_recent_nodes(limit=count)
+
+    urls = []
+    for label, label_nodes in nodes.items():
+        id_key = meta['id_keys'][label]
+        for node in label_nodes:
+            base_path = '{0}/{1}'.format(label.lower(), node[id_key])
+            urls.append('/api/v1/story/{0}'.format(base_path))
+            urls.append('/api/v1/siblings/{0}'.format(base_path))
+            urls.append('/api/v1/siblings/{0}?backward_rel=true'.format(base_path))
+
+    def _warm_up(url):
+        client = app.test_client()
+        rv = client.get(url, environ_base={REFRESH_ENVIRON_KEY: True})
+        if rv.status_code == 200:
+            return True
+        # Siblings can't be determined for the first and last nodes of a story, so there is
+        # nothing to cache
+        elif rv.status_code != 400:
+            log.warning('Failed to warm up %s with the status code %d', url, rv.status_code)
+            return False
+
+    log.info('Warming up %d responses with %d workers', len(urls), workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(_warm_up, urls))
+    return results.count(True), results.count(False)
@@ -0,0 +1,366 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import json
+import threading
+import time
+from collections import deque
+
+from neomodel import UniqueIdProperty, db
+
+from estuary import log
+from estuary.utils.database import get_driver, read_query
+
+# The Neo4j label of the changelog entries written by the scrapers
+CHANGELOG_LABEL = 'EstuaryChangelog'
+# The Neo4j label of the single node holding the sequence number of the last changelog entry
+WATERMARK_LABEL = 'EstuaryChangelogWatermark'
+# The name of the watermark node, which is unique so that the concurrent scraper runs share it
+WATERMARK_NAME = 'changelog'
+# The number of days the changelog entries are kept for
+CHANGELOG_RETENTION_DAYS = 7
+
+# The keys of the nodes created or updated since start_recording was called, or None if the nodes
+# aren't being recorded, which is the case in the API
+_recorded_keys = None
+
+
+def get_node_keys(node):
+    """
+    Get the keys identifying a node in the changelog.
+
+    A key is in the format of ``<resource>:<uid>``, such as ``kojibuild:1234``. A node has a key for
+    its label and the label of every model it inherits from, so that a container build can be
+    subscribed to as a Koji build.
+
+    :param EstuaryStructuredNode node: the node to get the keys of
+    :return: the keys of the node
+    :rtype: set
+    """
+    # Avoid circular imports
+    from estuary.models import models_inheritance
+
+    for name, prop_def in node.__all_properties__:
+        if isinstance(prop_def, UniqueIdProperty):
+            uid = getattr(node, name)
+            break
+    else:
+        return set()
+
+    return set(
+        '{0}:{1}'.format(label.lower(), uid)
+        for label, inherited_labels in models_inheritance.items()
+        if node.__label__ in inherited_labels
+    )
+
+
+def get_node_ids(node_keys):
+    """
+    Get the internal IDs of the nodes identified by their keys in the changelog.
+
+    :param set node_keys: the keys of the nodes, as returned by get_node_keys
+    :return: the sorted internal IDs of the nodes that exist
+    :rtype: list
+    """
+    # Avoid circular imports
+    from estuary.models import names_to_model
+
+    models = {label.lower(): model for label, model in names_to_model.items()}
+    uids = {}
+    for node_key in node_keys:
+        resource, uid = node_key.split(':', 1)
+        if resource in models:
+            uids.setdefault(models[resource], set()).add(uid)
+
+    node_ids = set()
+    for model, model_uids in uids.items():
+        uid_property = [prop.db_property or name for name, prop in model.__all_properties__
+                        if isinstance(prop, UniqueIdProperty)][0]
+        results, _ = db.cypher_query(
+            'MATCH (node:{0}) WHERE node.{1} IN {{uids}} RETURN collect(id(node))'.format(
+                model.__label__, uid_property),
+            {'uids': sorted(model_uids)})
+        node_ids.update(results[0][0])
+    return sorted(node_ids)
+
+
+def start_recording():
+    """Start recording the keys of the nodes created or updated by the current process."""
+    global _recorded_keys
+
+    _recorded_keys = set()
+
+
+def stop_recording():
+    """
+    Stop recording the keys of the nodes created or updated by the current process.
+
+    :return: the keys of the nodes recorded since start_recording was called
+    :rtype: set
+    """
+    global _recorded_keys
+
+    keys = _recorded_keys or set()
+    _recorded_keys = None
+    return keys
+
+
+def is_recording():
+    """
+    Determine if the nodes created or updated by the current process are being recorded.
+
+    :return: whether the recording is started
+    :rtype: bool
+    """
+    return _recorded_keys is not None
+
+
+def record_changed_nodes(nodes):
+    """
+    Record that nodes were created or updated if the recording is started.
+
+    :param list nodes: the EstuaryStructuredNode objects that were changed
+    """
+    if _recorded_keys is None:
+        return
+
+    for node in nodes:
+        _recorded_keys.update(get_node_keys(node))
+
+
+def create_watermark_constraint():
+    """
+    Create the uniqueness constraint of the watermark node if it doesn't exist.
+
+    Without the constraint, the concurrent scraper runs could each create a watermark node when
+    none exists yet. The watermark node written before the constraint existed is named first.
+    """
+    db.cypher_query(
+        'MATCH (w:{0}) WHERE w.name IS NULL SET w.name = {{name}}'.format(WATERMARK_LABEL),
+        {'name': WATERMARK_NAME})
+    # Creating a constraint that already exists does nothing
+    db.cypher_query('CREATE CONSTRAINT ON (w:{0}) ASSERT w.name IS UNIQUE'.format(WATERMARK_LABEL))
+
+
+def write_changelog(source, node_keys, retention_days=CHANGELOG_RETENTION_DAYS):
+    """
+    Write a changelog entry with the nodes changed by a scraper run.
+
+    The entries are numbered by the sequence number stored on the watermark node, which is locked
+    by the update, so that the concurrent scraper runs never write the same sequence number. The
+    uniqueness constraint created by create_watermark_constraint ensures that the concurrent runs
+    merge the same watermark node. The entries older than the retention period are removed.
+
+    :param str source: the name of the scraper that changed the nodes
+    :param set node_keys: the keys of the changed nodes
+    :kwarg int retention_days: the number of days to keep the changelog entries for
+    :return: the sequence number of the entry or None if no nodes changed
+    :rtype: int or None
+    """
+    if not node_keys:
+        log.info('No nodes were changed by the {0} scraper, so no changelog entry is written'
+                 .format(source))
+        return None
+
+    results, _ = db.cypher_query(
+        'MERGE (w:{watermark} {{name: {{name}}}}) '
+        'SET w.sequence = coalesce(w.sequence, 0) + 1 '
+        'CREATE (c:{changelog} {{sequence: w.sequence, source: {{source}}, '
+        'timestamp: timestamp(), node_keys: {{node_keys}}}}) '
+        'RETURN c.sequence'.format(watermark=WATERMARK_LABEL, changelog=CHANGELOG_LABEL),
+        {'name': WATERMARK_NAME, 'source': source, 'node_keys': sorted(node_keys)})
+    sequence = results[0][0]
+    db.cypher_query(
+        'MATCH (c:{0}) WHERE c.timestamp < timestamp() - {{retention}} DETACH DELETE c'
+        .format(CHANGELOG_LABEL),
+        {'retention': retention_days * 24 * 60 * 60 * 1000})
+    log.info('Wrote the changelog entry {0} with {1} nodes changed by the {2} scraper'.format(
+        sequence, len(node_keys), source))
+    return sequence
+
+
+def get_changelog_entries(after):
+    """
+    Get the changelog entries written after a sequence number.
+
+    :param int after: the sequence number of the last entry already seen
+    :return: a list of tuples of the sequence number and the set of node keys of each entry
+    :rtype: list
+    """
+    results, _ = read_query(
+        get_driver(),
+        'MATCH (c:{0}) WHERE c.sequence > {{after}} RETURN c.sequence, c.node_keys '
+        'ORDER BY c.sequence'.format(CHANGELOG_LABEL),
+        {'after': after})
+    return [(sequence, set(node_keys)) for sequence, node_keys in results]
+
+
+def get_latest_sequence():
+    """
+    Get the sequence number of the last changelog entry.
+
+    :return: the sequence number or 0 if no changelog entry was written
+    :rtype: int
+    """
+    results, _ = read_query(
+        get_driver(), 'MATCH (w:{0}) RETURN w.sequence'.format(WATERMARK_LABEL))
+    if results and results[0][0]:
+        return results[0][0]
+    return 0
+
+
+class ChangelogPoller(object):
+    """Poll the changelog on behalf of all the change streams of a process."""
+
+    def __init__(self, interval, max_entries=100):
+        """
+        Initialize the ChangelogPoller class.
+
+        :param float interval: the minimum number of seconds between two queries to Neo4j
+        :kwarg int max_entries: the number of recent changelog entries kept in memory
+        """
+        self.interval = interval
+        self.sequence = None
+        self._entries = deque(maxlen=max_entries)
+        self._last_poll = 0
+        self._lock = threading.Lock()
+
+    def poll(self):
+        """
+        Get the new changelog entries from Neo4j unless it was polled during the interval.
+
+        :return: the sequence number of the last changelog entry
+        :rtype: int
+        """
+        with self._lock:
+            if time.time() - self._last_poll >= self.interval:
+                if self.sequence is None:
+                    # The older entries were handled before this process started
+                    self.sequence = get_latest_sequence()
+                else:
+                    for entry in get_changelog_entries(self.sequence):
+                        self._entries.append(entry)
+                        self.sequence = entry[0]
+                self._last_poll = time.time()
+            return self.sequence
+
+    def get_entries(self, after):
+        """
+        Get the changelog entries written after a sequence number.
+
+        The entries are only queried from Neo4j when they aren't kept in memory, which is the case
+        when a client resumes a change stream from an old sequence number.
+
+        :param int after: the sequence number of the last entry already seen
+        :return: a list of tuples of the sequence number and the set of node keys of each entry
+        :rtype: list
+        """
+        sequence = self.poll()
+        if after >= sequence:
+            return []
+
+        with self._lock:
+            entries = [entry for entry in self._entries if entry[0] > after]
+        if entries and entries[0][0] == after + 1:
+            return entries
+        return get_changelog_entries(after)
+
+
+# The number of change streams open in this process
+_open_streams = 0
+_open_streams_lock = threading.Lock()
+
+
+def open_stream(max_streams):
+    """
+    Reserve a change stream in this process if the maximum number of streams isn't reached.
+
+    Each stream occupies a worker thread for its whole duration, so the streams are limited to
+    leave threads available to the other API endpoints.
+
+    :param int max_streams: the maximum number of change streams open in this process
+    :return: whether the stream was reserved, in which case close_stream must be called when it ends
+    :rtype: bool
+    """
+    global _open_streams
+
+    with _open_streams_lock:
+        if _open_streams >= max_streams:
+            return False
+        _open_streams += 1
+        return True
+
+
+def close_stream():
+    """Release a change stream reserved with open_stream."""
+    global _open_streams
+
+    with _open_streams_lock:
+        _open_streams -= 1
+
+
+# The changelog poller of this process. It's created on first use.
+_poller = None
+_poller_lock = threading.Lock()
+
+
+def get_changelog_poller(interval):
+    """
+    Get the changelog poller shared by the change streams of this process.
+
+    :param float interval: the minimum number of seconds between two queries to Neo4j
+    :return: the changelog poller
+    :rtype: ChangelogPoller
+    """
+    global _poller
+
+    with _poller_lock:
+        if _poller is None or _poller.interval != interval:
+            _poller = ChangelogPoller(interval)
+        return _poller
+
+
+def format_event(sequence, nodes, recents):
+    """
+    Format a change notification as a server-sent event.
+
+    :param int sequence: the sequence number of the changelog entry, used as the event ID
+    :param list nodes: the keys of the subscribed nodes that changed
+    :param bool recents: whether the recent nodes may have changed
+    :return: the server-sent event
+    :rtype: str
+    """
+    data = json.dumps({'sequence': sequence, 'nodes': nodes, 'recents': recents})
+    return 'id: {0}\nevent: changed\ndata: {1}\n\n'.format(sequence, data)
+
+
+def stream_changes(poller, node_keys, recents, after, duration=300):
+    """
+    Generate the server-sent events notifying a client that its subscriptions changed.
+
+    :param ChangelogPoller poller: the changelog poller of the process
+    :param set node_keys: the keys of the nodes the client is subscribed to
+    :param bool recents: whether the client is subscribed to the recent nodes
+    :param int after: the sequence number of the last changelog entry the client was notified of
+    :kwarg float duration: the number of seconds after which the stream ends, so that the client
+        reconnects and the API worker is freed
+    :return: a generator of the server-sent events
+    :rtype: generator
+    """
+    # Tell the client to reconnect after the poll interval
+    yield 'retry: {0}\n\n'.format(int(poller.interval * 1000))
+
+    deadline = time.time() + duration
+    while True:
+        for sequence, entry_keys in poller.get_entries(after):
+            after = sequence
+            changed = sorted(node_keys & entry_keys)
+            if changed or recents:
+                yield format_event(sequence, changed, recents)
+
+        if time.time() >= deadline:
+            break
+        # A comment keeps the connection open through the proxies and detects closed connections
+        yield ': keepalive\n\n'
+        time.sleep(poller.interval)
@@ -0,0 +1,136 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+from neomodel import UniqueIdProperty, db
+
+from estuary import log
+
+# The prefix of the node properties counting the nodes related to a node
+DEGREE_PROPERTY_PREFIX = 'degree_'
+# The number of nodes whose counters are updated per transaction
+BATCH_SIZE = 10000
+
+
+def get_degree_property(rel_type, label):
+    """
+    Get the name of the node property counting the nodes related with a relationship type.
+
+    :param str rel_type: the relationship type
+    :param str label: the label of the related nodes
+    :return: the property name, such as ``degree_ATTACHED_Advisory``
+    :rtype: str
+    """
+    return '{0}{1}_{2}'.format(DEGREE_PROPERTY_PREFIX, rel_type, label)
+
+
+def get_degree_counters():
+    """
+    Get the degree counters stored on the nodes of each label.
+
+    A node is counted by the nodes it's related to with the relationships between the consecutive
+    artifacts of the story flows, which are the sibling counts of the stories.
+
+    :return: a dictionary of the labels to a sorted list of tuples of the relationship type and
+        the label of the related nodes to count
+    :rtype: dict
+    """
+    # Avoid circular imports
+    from estuary.utils.story_metrics import get_story_edges
+
+    counters = {}
+    for label, relationship, next_label in get_story_edges():
+        counters.setdefault(label, set()).add((relationship[:-1], next_label))
+        counters.setdefault(next_label, set()).add((relationship[:-1], label))
+    return {label: sorted(label_counters) for label, label_counters in counters.items()}
+
+
+def get_degree_query(label, counters, match_query):
+    """
+    Create the Cypher query setting the degree counters of nodes.
+
+    :param str label: the label of the nodes
+    :param list counters: tuples of the relationship type and the label of the related nodes
+    :param str match_query: the Cypher query matching the nodes as ``node`` without the label
+    :return: the Cypher query
+    :rtype: str
+    """
+    return '{0} WITH node WHERE node:{1} SET {2}'.format(match_query, label, ', '.join(
+        'node.{0} = size((node)-[:{1}]-(:{2}))'.format(
+            get_degree_property(rel_type, related_label), rel_type, related_label)
+        for rel_type, related_label in counters
+    ))
+
+
+def update_degree_counters(node_keys):
+    """
+    Recompute the degree counters of the changed nodes and of the nodes related to them.
+
+    The scrapers connect the nodes they already connected in previous runs, so the counters are
+    recomputed instead of incremented. The related nodes are updated too since their counters
+    change when a node is connected to them or when a label is added to the node.
+
+    :param set node_keys: the keys of the changed nodes, as recorded by
+        estuary.utils.changelog.record_changed_nodes
+    :return: the number of nodes updated
+    :rtype: int
+    """
+    # Avoid circular imports
+    from estuary.models import names_to_model
+
+    counters = get_degree_counters()
+    rel_types = sorted(set(rel_type for label_counters in counters.values()
+                           for rel_type, _ in label_counters))
+    models = {label.lower(): names_to_model[label] for label in counters}
+    uids = {}
+    for node_key in node_keys:
+        resource, uid = node_key.split(':', 1)
+        if resource in models:
+            uids.setdefault(models[resource], set()).add(uid)
+
+    node_ids = set()
+    for model, model_uids in uids.items():
+        uid_property = [prop.db_property or name for name, prop in model.__all_properties__
+                        if isinstance(prop, UniqueIdProperty)][0]
+        results, _ = db.cypher_query(
+            'MATCH (node:{0}) WHERE node.{1} IN {{uids}} '
+            'OPTIONAL MATCH (node)-[:{2}]-(related) '
+            'RETURN collect(DISTINCT id(node)) + collect(DISTINCT id(related))'.format(
+                model.__label__, uid_property, '|'.join(rel_types)),
+            {'uids': sorted(model_uids)})
+        node_ids.update(results[0][0])
+
+    node_ids = sorted(node_ids)
+    for index in range(0, len(node_ids), BATCH_SIZE):
+        batch = node_ids[index:index + BATCH_SIZE]
+        for label, label_counters in sorted(counters.items()):
+            db.cypher_query(
+                get_degree_query(
+                    label, label_counters, 'MATCH (node) WHERE id(node) IN {node_ids}'),
+                {'node_ids': batch})
+    log.info('Updated the degree counters of {0} nodes'.format(len(node_ids)))
+    return len(node_ids)
+
+
+def repair_degree_counters():
+    """
+    Recompute the degree counters of all the nodes in batches.
+
+    :return: the number of nodes updated
+    :rtype: int
+    """
+    total = 0
+    for label, label_counters in sorted(get_degree_counters().items()):
+        update_query = get_degree_query(label, label_counters, '')
+        results, _ = db.cypher_query(
+            'CALL apoc.periodic.iterate("MATCH (node:{0}) RETURN node", "{1}", '
+            '{{batchSize: {2}, parallel: false}}) '
+            'YIELD total, failedOperations RETURN total, failedOperations'.format(
+                label, update_query.strip(), BATCH_SIZE))
+        processed, failed = results[0]
+        total += processed
+        if failed:
+            log.warning('Failed to repair the degree counters of {0} {1} nodes'.format(
+                failed, label))
+    log.info('Repaired the degree counters of {0} nodes'.format(total))
+    return total
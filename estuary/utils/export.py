@@ -0,0 +1,289 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import calendar
+import json
+import multiprocessing
+import os
+
+from flask import current_app
+from neomodel import UniqueIdProperty
+
+from estuary import log
+from estuary.models.base import EstuaryStructuredNode
+from estuary.utils.database import run_read_queries
+from estuary.utils.general import inflate_node
+from estuary.utils.story import TIMELINE_PROPERTIES, BaseStoryManager
+
+# The file formats the stories can be exported to
+EXPORT_FORMATS = ('ndjson', 'parquet')
+# The tables of an export, which are stored in a directory of the same name
+EXPORT_TABLES = ('stories', 'nodes', 'edges')
+# The name of the file storing the progress of an export in its directory
+CHECKPOINT_FILE = 'checkpoint.json'
+# The version of the format of the checkpoint file, which must be incremented when it changes
+CHECKPOINT_VERSION = 1
+# The Flask application of the export worker processes
+_worker_app = None
+
+
+def _get_uid(node):
+    """
+    Get the value of the UniqueIdProperty of a node.
+
+    :param EstuaryStructuredNode node: the node
+    :return: the unique identifier of the node, or None if it doesn't have one
+    :rtype: str or None
+    """
+    for name, prop_def in node.__all_properties__:
+        if isinstance(prop_def, UniqueIdProperty):
+            return getattr(node, name)
+
+
+def get_export_node_ids(label, since, until, after=-1, limit=1000):
+    """
+    Get the Neo4j IDs of the next batch of nodes to export the story of.
+
+    The nodes are sorted by their Neo4j ID, so the ID of the last node of a batch is the position
+    of the export.
+
+    :param str label: the label of the nodes
+    :param datetime.date since: the first day of the window of the timeline property of the nodes
+    :param datetime.date until: the day after the window of the timeline property of the nodes
+    :kwarg int after: the Neo4j ID after which the nodes are returned
+    :kwarg int limit: the maximum number of nodes to return
+    :return: the sorted Neo4j IDs of the nodes
+    :rtype: list
+    """
+    query = (
+        'MATCH (node:{label}) WHERE node.{timeline} >= {{since}} AND node.{timeline} < {{until}} '
+        'AND id(node) > {{after}} '
+        'RETURN id(node) AS node_id ORDER BY node_id LIMIT {{limit}}'
+    ).format(label=label, timeline=TIMELINE_PROPERTIES[label])
+    params = {
+        'since': calendar.timegm(since.timetuple()),
+        'until': calendar.timegm(until.timetuple()),
+        'after': after,
+        'limit': limit,
+    }
+    results, _ = run_read_queries([(query, params)])[0]
+    return [result[0] for result in results]
+
+
+def get_story_rows(node_id):
+    """
+    Compute the story of a node and convert it to the rows of the export tables.
+
+    The story is the same as the one returned by the story API, and its metrics are computed the
+    same way.
+
+    :param int node_id: the Neo4j ID of the node
+    :return: a dictionary of the table names to the rows of the story in each table
+    :rtype: dict
+    """
+    results, _ = run_read_queries([
+        ('MATCH (node) WHERE id(node) = {node_id} RETURN node', {'node_id': node_id})])[0]
+    item = inflate_node(results[0][0])
+    story_manager = BaseStoryManager.get_story_manager(item, current_app.config, limit=True)
+
+    backward = []
+    forward = []
+    relationships = []
+    if story_manager.backward_story:
+        path = story_manager.backward_story[0][0]
+        backward = story_manager.set_story_labels(
+            item.__label__, EstuaryStructuredNode.inflate_results([list(path.nodes)[::-1]])[0],
+            reverse=True)
+        relationships = list(path.relationships)[::-1]
+    if story_manager.forward_story:
+        path = story_manager.forward_story[0][0]
+        forward = story_manager.set_story_labels(
+            item.__label__, EstuaryStructuredNode.inflate_results([list(path.nodes)])[0])
+        relationships += list(path.relationships)
+    # The requested node is at the end of the backward story and at the start of the forward story
+    nodes = backward[:-1] + forward if backward and forward else backward or forward or [item]
+
+    _, total_wait_time = story_manager.get_wait_times(nodes)
+    total_processing_time = None
+    processing_time_flag = False
+    total_lead_time = 0
+    try:
+        total_processing_time, processing_time_flag = story_manager.get_total_processing_time(
+            nodes)
+    except:  # noqa E722
+        log.exception('Failed to compute total processing time statistic.')
+    if len(nodes) > 1:
+        try:
+            total_lead_time = story_manager.get_total_lead_time(nodes)
+        except:  # noqa E722
+            log.exception('Failed to compute total lead time statistic.')
+
+    return {
+        'stories': [{
+            'story_id': node_id,
+            'resource_type': item.__label__,
+            'uid': _get_uid(item),
+            'story_type': story_manager.__class__.__name__[:-12].lower(),
+            'length': len(nodes),
+            'partial': story_manager.partial,
+            'total_lead_time': total_lead_time,
+            'total_wait_time': total_wait_time,
+            'total_processing_time': total_processing_time,
+            'processing_time_flag': processing_time_flag,
+        }],
+        'nodes': [{
+            'story_id': node_id,
+            'index': index,
+            'node_id': node.id,
+            'resource_type': node.__label__,
+            'uid': _get_uid(node),
+            'display_name': node.display_name,
+            'timeline_timestamp': node.timeline_timestamp,
+        } for index, node in enumerate(nodes)],
+        'edges': [{
+            'story_id': node_id,
+            'index': index,
+            'relationship': relationship.type,
+            'start_node_id': relationship.start_node.id,
+            'end_node_id': relationship.end_node.id,
+        } for index, relationship in enumerate(relationships)],
+    }
+
+
+def _init_export_worker():
+    """Push an application context in an export worker process for the story computations."""
+    global _worker_app
+    # Avoid circular imports
+    from estuary.app import create_app
+
+    _worker_app = create_app()
+    _worker_app.app_context().push()
+
+
+def write_export_part(path, rows, export_format):
+    """
+    Write the rows of a batch of an export table to a file.
+
+    The file is written to a temporary file first, so a file with the final name is always
+    complete even if the export is interrupted.
+
+    :param str path: the path of the file
+    :param list rows: the rows as dictionaries with the same keys
+    :param str export_format: the file format, which is "ndjson" or "parquet"
+    :raises RuntimeError: if the Parquet format is requested but pyarrow is not installed
+    """
+    tmp_path = '{0}.tmp'.format(path)
+    if export_format == 'parquet':
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError('pyarrow must be installed to export the stories to Parquet')
+
+        table = pyarrow.Table.from_pydict({key: [row[key] for row in rows] for key in rows[0]})
+        pyarrow.parquet.write_table(table, tmp_path)
+    else:
+        with open(tmp_path, 'w') as part_file:
+            for row in rows:
+                part_file.write(json.dumps(row, sort_keys=True))
+                part_file.write('\n')
+    os.rename(tmp_path, path)
+
+
+def _write_checkpoint(output_dir, checkpoint):
+    """
+    Atomically write the checkpoint of an export.
+
+    :param str output_dir: the directory of the export
+    :param dict checkpoint: the checkpoint
+    """
+    path = os.path.join(output_dir, CHECKPOINT_FILE)
+    with open('{0}.tmp'.format(path), 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file, sort_keys=True)
+    os.rename('{0}.tmp'.format(path), path)
+
+
+def export_stories(output_dir, label, since, until, export_format='ndjson', workers=4,
+                   batch_size=1000, resume=False):
+    """
+    Export the stories of the nodes of a label with a timeline timestamp in a window.
+
+    The stories are computed in batches by a pool of worker processes, and each batch is written to
+    a new file in the directory of each table, so only a batch is kept in memory. The position of
+    the export is saved in a checkpoint after each batch, so an interrupted export can be resumed
+    from the last complete batch.
+
+    :param str output_dir: the directory of the export
+    :param str label: the label of the nodes to export the story of
+    :param datetime.date since: the first day of the window
+    :param datetime.date until: the day after the window
+    :kwarg str export_format: the file format, which is "ndjson" or "parquet"
+    :kwarg int workers: the number of worker processes, or 1 to compute the stories in this process
+    :kwarg int batch_size: the number of stories in each batch
+    :kwarg bool resume: resume the export in the directory from its checkpoint
+    :return: the number of exported stories
+    :rtype: int
+    :raises RuntimeError: if the export can't be started or resumed
+    """
+    params = {
+        'label': label,
+        'since': since.isoformat(),
+        'until': until.isoformat(),
+        'format': export_format,
+    }
+    checkpoint_path = os.path.join(output_dir, CHECKPOINT_FILE)
+    if os.path.exists(checkpoint_path):
+        if not resume:
+            raise RuntimeError('The directory {0} already contains an export'.format(output_dir))
+        with open(checkpoint_path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        if checkpoint.get('version') != CHECKPOINT_VERSION or checkpoint['params'] != params:
+            raise RuntimeError('The export in the directory {0} has different parameters'.format(
+                output_dir))
+        log.info('Resuming the export after %d stories', checkpoint['stories'])
+    else:
+        checkpoint = {
+            'version': CHECKPOINT_VERSION,
+            'params': params,
+            'last_node_id': -1,
+            'parts': 0,
+            'stories': 0,
+        }
+        for table in EXPORT_TABLES:
+            table_dir = os.path.join(output_dir, table)
+            if not os.path.isdir(table_dir):
+                os.makedirs(table_dir)
+
+    # The worker processes have their own Neo4j connections and application contexts
+    pool = multiprocessing.Pool(workers, initializer=_init_export_worker) if workers > 1 else None
+    try:
+        while True:
+            node_ids = get_export_node_ids(
+                label, since, until, after=checkpoint['last_node_id'], limit=batch_size)
+            if not node_ids:
+                break
+
+            if pool:
+                batch = pool.map(get_story_rows, node_ids, chunksize=max(
+                    1, len(node_ids) // (workers * 4)))
+            else:
+                batch = [get_story_rows(node_id) for node_id in node_ids]
+            part = checkpoint['parts'] + 1
+            for table in EXPORT_TABLES:
+                rows = [row for story_rows in batch for row in story_rows[table]]
+                if rows:
+                    write_export_part(os.path.join(output_dir, table, 'part-{0:05d}.{1}'.format(
+                        part, export_format)), rows, export_format)
+
+            checkpoint['last_node_id'] = node_ids[-1]
+            checkpoint['parts'] = part
+            checkpoint['stories'] += len(node_ids)
+            _write_checkpoint(output_dir, checkpoint)
+            log.info('Exported %d stories', checkpoint['stories'])
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+
+    return checkpoint['stories']
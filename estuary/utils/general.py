@@ -2,17 +2,20 @@
 
 from __future__ import unicode_literals
 
+import base64
+import json
 import re
 from datetime import datetime
 from functools import wraps
 
-from flask import current_app, request
+from flask import current_app, g, has_request_context, request
 from six import text_type
 from werkzeug.exceptions import Unauthorized
 
 from estuary import log
 from estuary.authorization import is_user_authorized
 from estuary.error import ValidationError
+from estuary.utils.database import pin_read_replica
 
 
 def timestamp_to_datetime(timestamp):
@@ -72,16 +75,47 @@ def str_to_bool(item):
         return False
 
 
+class ProjectedNode(object):
+    """A node queried with only some of its properties, which can be inflated like a Neo4j node."""
+
+    def __init__(self, node_id, labels, properties):
+        """
+        Initialize the ProjectedNode class.
+
+        :param int node_id: the internal ID of the node
+        :param list labels: the labels of the node
+        :param dict properties: the queried properties of the node
+        """
+        self.id = node_id
+        self.labels = frozenset(labels)
+        # The properties the node doesn't have are null in a Cypher map projection
+        self._properties = {key: value for key, value in properties.items() if value is not None}
+
+    def items(self):
+        """
+        Get the properties of the node.
+
+        :return: the names and the values of the properties
+        :rtype: list
+        """
+        return list(self._properties.items())
+
+
 def inflate_node(result):
     """
     Inflate a Neo4j result to a neomodel model object.
 
-    :param neo4j.v1.types.Node result: a node from a cypher query result
+    :param result: a node from a cypher query result, or a list of the internal ID, the labels and
+        the properties of a node queried with EstuaryStructuredNode.get_projection
+    :type result: neo4j.v1.types.Node or list
     :return: a model (EstuaryStructuredNode) object
     """
     # To prevent a ciruclar import, this must be imported here
     from estuary.models import names_to_model
 
+    if isinstance(result, list):
+        result = ProjectedNode(*result)
+
     if 'ContainerKojiBuild' in result.labels:
         result_label = 'ContainerKojiBuild'
     elif 'ContainerAdvisory' in result.labels:
@@ -121,7 +155,7 @@ def get_neo4j_node(resource_name, uid):
     for model in all_models:
         if model.__label__.lower() == resource_name.lower():
             try:
-                return model.find_or_none(uid)
+                node = model.find_or_none(uid)
             except RuntimeError:
                 # There is no UniqueIdProperty on this model so raise an exception
                 models_wo_uid = ('DistGitRepo')
@@ -132,6 +166,11 @@ def get_neo4j_node(resource_name, uid):
                                                 model_names[-1]))
                 raise ValidationError(error)
 
+            if node is not None:
+                # The read queries of the request must see the node that was looked up
+                pin_read_replica(node)
+            return node
+
 
 def login_required(f):
     """
@@ -167,3 +206,156 @@ def login_required(f):
                 raise Unauthorized('You must be an employee to access this service')
         return f(*args, **kwargs)
     return wrapper
+
+
+def encode_cursor(offset):
+    """
+    Encode the position of the next page of results in an opaque cursor.
+
+    :param int offset: the number of results before the next page
+    :return: the cursor
+    :rtype: str
+    """
+    cursor = json.dumps({'offset': offset}).encode('utf-8')
+    return base64.urlsafe_b64encode(cursor).decode('utf-8')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor created by encode_cursor.
+
+    :param str cursor: the cursor
+    :return: the number of results before the page
+    :rtype: int
+    :raises ValidationError: if the cursor is invalid
+    """
+    try:
+        offset = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')).decode('utf-8'))
+        offset = offset['offset']
+    except (ValueError, TypeError, KeyError):
+        raise ValidationError('The cursor parameter is invalid')
+
+    if not isinstance(offset, int) or offset < 0:
+        raise ValidationError('The cursor parameter is invalid')
+    return offset
+
+
+def get_pagination_args():
+    """
+    Get the pagination query parameters of the current request.
+
+    :return: a tuple of the maximum number of results to return and the number of results to skip
+    :rtype: tuple
+    :raises ValidationError: if the limit or the cursor is invalid
+    """
+    max_page_size = current_app.config['MAX_PAGE_SIZE']
+    limit = request.args.get('limit', current_app.config['DEFAULT_PAGE_SIZE'])
+    try:
+        limit = int(limit)
+    except ValueError:
+        limit = 0
+    if limit < 1 or limit > max_page_size:
+        raise ValidationError(
+            'The limit parameter must be an integer between 1 and {0}'.format(max_page_size))
+
+    offset = 0
+    if request.args.get('cursor'):
+        offset = decode_cursor(request.args['cursor'])
+    return limit, offset
+
+
+def get_pagination_meta(limit, offset, total):
+    """
+    Get the pagination metadata of a page of results.
+
+    :param int limit: the maximum number of results in the page
+    :param int offset: the number of results before the page
+    :param int total: the total number of results
+    :return: the pagination metadata
+    :rtype: dict
+    """
+    next_cursor = None
+    if offset + limit < total:
+        next_cursor = encode_cursor(offset + limit)
+    return {
+        'limit': limit,
+        'next_cursor': next_cursor,
+        'total': total
+    }
+
+
+def get_relationship_limit():
+    """
+    Get the maximum number of related nodes to serialize per relationship of a node.
+
+    The limit is set with the SERIALIZED_RELATIONSHIP_LIMIT configuration and can be lowered per
+    request with the relationship_limit query parameter.
+
+    :return: the limit or None if the number of related nodes is unlimited
+    :rtype: int or None
+    :raises ValidationError: if the relationship_limit query parameter is invalid
+    """
+    if not has_request_context():
+        return None
+
+    limit = current_app.config['SERIALIZED_RELATIONSHIP_LIMIT']
+    if request.args.get('relationship_limit'):
+        try:
+            request_limit = int(request.args['relationship_limit'])
+        except ValueError:
+            request_limit = 0
+        if request_limit < 1:
+            raise ValidationError('The relationship_limit parameter must be a positive integer')
+        if not limit or request_limit < limit:
+            limit = request_limit
+    return limit
+
+
+def get_requested_fields():
+    """
+    Get the fields of the nodes requested with the fields query parameter.
+
+    :return: the set of requested fields or None if all the fields are requested
+    :rtype: set or None
+    """
+    if not has_request_context() or not request.args.get('fields'):
+        return None
+
+    fields = set(field.strip() for field in request.args['fields'].split(','))
+    fields.discard('')
+    return fields or None
+
+
+def select_fields(serialized_node):
+    """
+    Remove the fields of a serialized node that weren't requested with the fields query parameter.
+
+    The resource_type and truncated fields are always kept, along with the count of the requested
+    relationships.
+
+    :param dict serialized_node: the serialized node
+    :return: the serialized node with only the requested fields
+    :rtype: dict
+    """
+    fields = get_requested_fields()
+    if not fields:
+        return serialized_node
+
+    return {
+        key: value for key, value in serialized_node.items()
+        if key in fields or key in ('resource_type', 'truncated')
+        or (key.endswith('_count') and key[:-len('_count')] in fields)
+    }
+
+
+def get_batch_cache(name):
+    """
+    Get a cache shared by the items of a batch request.
+
+    :param str name: the name of the cache
+    :return: the cache or None if the current request isn't a batch request
+    :rtype: dict or None
+    """
+    if not has_request_context() or g.get('batch_cache') is None:
+        return None
+    return g.batch_cache.setdefault(name, {})
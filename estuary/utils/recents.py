@@ -2,20 +2,20 @@
 
 from __future__ import unicode_literals
 
-from neomodel import db
-
 from estuary.models.bugzilla import BugzillaBug
 from estuary.models.distgit import DistGitCommit
 from estuary.models.errata import Advisory
 from estuary.models.freshmaker import FreshmakerEvent
 from estuary.models.koji import KojiBuild
+from estuary.utils.database import run_read_queries
 from estuary.utils.general import inflate_node
 
 
-def get_recent_nodes():
+def get_recent_nodes(limit=5):
     """
     Get the most recent nodes of each node type.
 
+    :kwarg int limit: the number of nodes to get of each node type
     :return: a tuple with the first value as a dictionary with the keys as
         names of each node type, and values of arrays of the most recents of
         each node, and the second as metadata
@@ -34,14 +34,18 @@ def get_recent_nodes():
         'id_keys': id_dict,
         'timestamp_keys': timestamp_dict
     }
+    queries = []
     for label, time_property in timestamp_dict.items():
         query = (
             'MATCH (node:{label}) '
             'WHERE node.{time_property} IS NOT NULL '
             'RETURN node '
-            'ORDER BY node.{time_property} DESC LIMIT 5'
-        ).format(label=label, time_property=time_property)
-        results, _ = db.cypher_query(query)
+            'ORDER BY node.{time_property} DESC LIMIT {limit}'
+        ).format(label=label, time_property=time_property, limit=int(limit))
+        queries.append((query, None))
+
+    # The query of each label is independent, so they are run concurrently
+    for label, (results, _) in zip(timestamp_dict.keys(), run_read_queries(queries)):
         for result in results:
             node_results = final_result_data.setdefault(label, [])
             # result is always a list of a single node
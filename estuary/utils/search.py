@@ -0,0 +1,94 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import re
+
+from neomodel import db
+
+from estuary import log
+from estuary.utils.database import run_read_queries
+from estuary.utils.general import inflate_node
+
+# The name of the Neo4j full-text index of the searchable artifacts
+SEARCH_INDEX = 'estuary_search'
+# The searchable properties of each label. The container and module builds and the container
+# advisories are also indexed since they have the labels of their base types.
+SEARCH_PROPERTIES = {
+    'Advisory': ('advisory_name', 'synopsis'),
+    'BugzillaBug': ('short_description',),
+    'DistGitCommit': ('log_message',),
+    'KojiBuild': ('name',),
+}
+# The analyzer of the index, which keeps the stop words since the prefix of any word is searched
+SEARCH_ANALYZER = 'standard-no-stop-words'
+# The terms like the tokens of the standard analyzer, which keeps the numbers separated by dots
+# such as the versions together
+_TERM_RE = re.compile(r'\w+(?:\.\d+)*', re.UNICODE)
+
+
+def create_search_index():
+    """
+    Create the full-text index of the searchable artifacts if it doesn't exist.
+
+    Neo4j keeps the index up to date as the artifacts change, so this only needs to run once. The
+    index is recreated if its labels or properties changed.
+
+    :return: True if the index was created
+    :rtype: bool
+    """
+    labels = sorted(SEARCH_PROPERTIES)
+    properties = sorted(set(
+        prop for label_properties in SEARCH_PROPERTIES.values() for prop in label_properties))
+    results, _ = db.cypher_query(
+        'CALL db.indexes() YIELD indexName, tokenNames, properties '
+        'WHERE indexName = {name} RETURN tokenNames, properties', {'name': SEARCH_INDEX})
+    if results:
+        if sorted(results[0][0]) == labels and sorted(results[0][1]) == properties:
+            return False
+        log.info('Recreating the %s full-text index with new labels or properties', SEARCH_INDEX)
+        db.cypher_query('CALL db.index.fulltext.drop({name})', {'name': SEARCH_INDEX})
+
+    db.cypher_query(
+        'CALL db.index.fulltext.createNodeIndex({name}, {labels}, {properties}, '
+        '{analyzer: {analyzer}})',
+        {'name': SEARCH_INDEX, 'labels': labels, 'properties': properties,
+         'analyzer': SEARCH_ANALYZER})
+    log.info('Created the %s full-text index', SEARCH_INDEX)
+    return True
+
+
+def get_search_query(text):
+    """
+    Convert the text searched by a user to a Lucene query with prefix semantics.
+
+    Every term of the text must be the prefix of a word of the artifact, so partial NVRs, advisory
+    names and descriptions match as they're typed. The terms only contain word characters and
+    dots, so they don't need to be escaped.
+
+    :param str text: the searched text
+    :return: the Lucene query, or an empty string if the text doesn't contain any term
+    :rtype: str
+    """
+    return ' AND '.join('{0}*'.format(term.lower()) for term in _TERM_RE.findall(text))
+
+
+def search_nodes(text, limit):
+    """
+    Search the artifacts whose searchable properties start with the terms of a text.
+
+    :param str text: the searched text
+    :param int limit: the maximum number of artifacts to return
+    :return: the artifacts sorted from the most relevant
+    :rtype: list
+    """
+    query = get_search_query(text)
+    if not query:
+        return []
+
+    results, _ = run_read_queries([(
+        'CALL db.index.fulltext.queryNodes({index}, {query}) YIELD node, score '
+        'RETURN node ORDER BY score DESC, id(node) DESC LIMIT {limit}',
+        {'index': SEARCH_INDEX, 'query': query, 'limit': limit},
+    )])[0]
+    return [inflate_node(result[0]) for result in results]
@@ -0,0 +1,248 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, jsonify, request
+
+from estuary import log
+
+
+class _Call(object):
+    """An in progress call of a SingleFlight object."""
+
+    def __init__(self):
+        """Initialize the _Call class."""
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Coalesce the concurrent calls with the same key of a process into a single call."""
+
+    def __init__(self):
+        """Initialize the SingleFlight class."""
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """
+        Call a function unless a call with the same key is in progress, in which case wait for it.
+
+        :param str key: the key identifying identical calls
+        :param function fn: the function to call without arguments
+        :return: the return value of the function, which is shared by all the identical calls
+        :raises Exception: the exception raised by the function, if any
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            log.debug('Waiting for the identical call in progress with the key %s', key)
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._call(key, fn)
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            # Calls made after this point compute a new result
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    def _call(self, key, fn):
+        """
+        Call the function on behalf of all the identical calls of the process.
+
+        :param str key: the key identifying identical calls
+        :param function fn: the function to call without arguments
+        :return: the return value of the function
+        """
+        return fn()
+
+
+class FileLockSingleFlight(SingleFlight):
+    """
+    Coalesce the concurrent calls with the same key of all the processes of the host.
+
+    The identical calls of a process are first coalesced in memory. The remaining call of each
+    process then takes a file lock for the key, and the first process to get it computes the
+    result and shares it with the other processes in a JSON file in the same directory.
+    """
+
+    def __init__(self, lock_dir, lock_timeout):
+        """
+        Initialize the FileLockSingleFlight class.
+
+        :param str lock_dir: the directory of the lock and result files, which must be shared by
+            the processes
+        :param float lock_timeout: the maximum number of seconds to wait for another process
+            before computing the result anyway
+        """
+        super(FileLockSingleFlight, self).__init__()
+        self.lock_dir = lock_dir
+        self.lock_timeout = lock_timeout
+        if not os.path.isdir(lock_dir):
+            os.makedirs(lock_dir)
+
+    def _acquire(self, lock_file):
+        """
+        Acquire the file lock, waiting for up to the lock timeout.
+
+        :param file lock_file: the opened lock file
+        :return: a boolean determining if the lock was acquired
+        :rtype: bool
+        """
+        deadline = time.time() + self.lock_timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except (IOError, OSError):
+                if time.time() >= deadline:
+                    return False
+                time.sleep(0.05)
+
+    def _remove_stale_results(self, max_age):
+        """
+        Remove the result files that are too old to be shared.
+
+        The lock files are kept since another process may be waiting on them.
+
+        :param float max_age: the age in seconds after which a result file is removed
+        """
+        now = time.time()
+        for file_name in os.listdir(self.lock_dir):
+            if not file_name.endswith('.json'):
+                continue
+            path = os.path.join(self.lock_dir, file_name)
+            try:
+                if now - os.path.getmtime(path) > max_age:
+                    os.remove(path)
+            except OSError:
+                # Another process removed it first
+                pass
+
+    def _call(self, key, fn):
+        """
+        Call the function on behalf of all the identical calls of the host.
+
+        :param str key: the key identifying identical calls
+        :param function fn: the function to call without arguments
+        :return: the return value of the function, or its JSON representation if it was computed
+            by another process
+        """
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        lock_path = os.path.join(self.lock_dir, '{0}.lock'.format(digest))
+        result_path = os.path.join(self.lock_dir, '{0}.json'.format(digest))
+        started = time.time()
+
+        with open(lock_path, 'a') as lock_file:
+            if not self._acquire(lock_file):
+                log.warning('Timed out waiting for another process to compute %s', key)
+                return fn()
+
+            try:
+                # A result written after this call started was computed by an identical call that
+                # was in progress in another process
+                try:
+                    if os.path.getmtime(result_path) >= started:
+                        with open(result_path, 'r') as result_file:
+                            return json.load(result_file)
+                except (IOError, OSError, ValueError):
+                    pass
+
+                result = fn()
+                with tempfile.NamedTemporaryFile(
+                        'w', dir=self.lock_dir, suffix='.tmp', delete=False) as result_file:
+                    json.dump(result, result_file, cls=current_app.json_encoder)
+                os.rename(result_file.name, result_path)
+                self._remove_stale_results(max(self.lock_timeout, 60))
+                return result
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# The single-flight object of the expensive API endpoints. It's created from the Flask config on
+# first use.
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+    """
+    Get the single-flight object of the expensive API endpoints of this process.
+
+    :return: the single-flight object
+    :rtype: SingleFlight
+    """
+    global _single_flight
+
+    with _single_flight_lock:
+        if _single_flight is None:
+            lock_dir = current_app.config['SINGLE_FLIGHT_LOCK_DIR']
+            if lock_dir:
+                _single_flight = FileLockSingleFlight(
+                    lock_dir, current_app.config['SINGLE_FLIGHT_LOCK_TIMEOUT'])
+            else:
+                _single_flight = SingleFlight()
+        return _single_flight
+
+
+def get_request_key():
+    """
+    Get the key identifying the identical requests to the current API endpoint.
+
+    The resource names are case insensitive, and the order of the query parameters doesn't matter
+    unless they are repeated, so both are normalized.
+
+    :return: the key of the request
+    :rtype: str
+    """
+    view_args = dict(request.view_args or {})
+    if 'resource' in view_args:
+        view_args['resource'] = view_args['resource'].lower()
+    args = []
+    for arg, values in sorted(request.args.lists()):
+        if arg == 'fallback':
+            values = [value.lower() for value in values]
+        args.append([arg, values])
+    return json.dumps([request.endpoint, view_args, args], sort_keys=True)
+
+
+def coalesce_requests(f):
+    """
+    Decorate an expensive Flask route to share its result with the identical concurrent requests.
+
+    The route must return data that can be serialized to JSON instead of a Flask response.
+
+    :param function f: the function to wrap
+    :return: the wrapper function
+    :rtype: function
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        if not current_app.config['SINGLE_FLIGHT_ENABLED']:
+            return jsonify(f(*args, **kwargs))
+        result = get_single_flight().do(get_request_key(), lambda: f(*args, **kwargs))
+        return jsonify(result)
+    return wrapper
@@ -0,0 +1,529 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import array
+import bisect
+import fcntl
+import json
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from itertools import islice
+
+from neo4j.graph import Path
+
+from estuary import log
+from estuary.utils.database import get_driver, read_query, run_read_queries
+
+# Identifies the graph snapshot files
+SNAPSHOT_MAGIC = b'ESTGRAPH'
+# The version of the format of the graph snapshot files, which must be incremented when it changes
+SNAPSHOT_VERSION = 1
+# The magic, the version and the size of the JSON metadata at the start of a graph snapshot file
+_HEADER = struct.Struct('<8sII')
+# The sections of a graph snapshot file are aligned for the arrays of 64-bit values
+_ALIGNMENT = 8
+
+
+def _align(size):
+    """
+    Round a size up to the alignment of the sections of a graph snapshot file.
+
+    :param int size: the size in bytes
+    :return: the aligned size in bytes
+    :rtype: int
+    """
+    return (size + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _get_csr(node_ids, timestamps, edges):
+    """
+    Create the compressed sparse row (CSR) arrays of the edges of a relationship direction.
+
+    The related nodes of each node are sorted from the most recent to the oldest like
+    ``ORDER BY <timeline property> DESC, id(node) DESC`` in Cypher, so the most recent related
+    nodes of a hub node are first.
+
+    :param array.array node_ids: the sorted Neo4j IDs of the nodes
+    :param array.array timestamps: the timeline timestamps of the nodes, or NaN if not set
+    :param list edges: tuples of the index of the source node, the index of the target node and
+        the Neo4j ID of the relationship
+    :return: a tuple of the offsets, the target node indexes and the relationship IDs arrays
+    :rtype: tuple
+    """
+    def _order(edge):
+        timestamp = timestamps[edge[1]]
+        # Like Cypher, the nodes without a timestamp are first when sorting in descending order
+        if math.isnan(timestamp):
+            return (edge[0], False, 0, -node_ids[edge[1]])
+        return (edge[0], True, -timestamp, -node_ids[edge[1]])
+
+    edges.sort(key=_order)
+    offsets = array.array('q', [0]) * (len(node_ids) + 1)
+    for source, _, _ in edges:
+        offsets[source + 1] += 1
+    for index in range(len(node_ids)):
+        offsets[index + 1] += offsets[index]
+    targets = array.array('i', (edge[1] for edge in edges))
+    relationship_ids = array.array('q', (edge[2] for edge in edges))
+    return offsets, targets, relationship_ids
+
+
+def write_graph_snapshot(path, labels, nodes, relationships):
+    """
+    Write a graph snapshot file.
+
+    The file is renamed once written, so that the processes using the previous snapshot never read
+    a partially written file.
+
+    :param str path: the path of the graph snapshot file
+    :param list labels: the labels of the nodes in the snapshot
+    :param dict nodes: a dictionary of the Neo4j node IDs to a tuple of the bitmask of their labels,
+        following the order of labels, and their timeline timestamp or None
+    :param dict relationships: a dictionary of the relationship types to a dictionary of the Neo4j
+        relationship IDs to a tuple of the IDs of their start and end nodes
+    """
+    node_ids = array.array('q', sorted(nodes))
+    index = {node_id: i for i, node_id in enumerate(node_ids)}
+    # The label bitmasks are 16-bit, which leaves room for more labels in the story flows
+    sections = [
+        ('node_ids', node_ids),
+        ('node_labels', array.array('H', (nodes[node_id][0] for node_id in node_ids))),
+        ('node_timestamps', array.array('d', (
+            float('nan') if nodes[node_id][1] is None else nodes[node_id][1]
+            for node_id in node_ids))),
+    ]
+    timestamps = sections[2][1]
+    for rel_type in sorted(relationships):
+        outgoing = []
+        incoming = []
+        for rel_id, (start_id, end_id) in relationships[rel_type].items():
+            if start_id in index and end_id in index:
+                outgoing.append((index[start_id], index[end_id], rel_id))
+                incoming.append((index[end_id], index[start_id], rel_id))
+        for direction, edges in (('>', outgoing), ('<', incoming)):
+            offsets, targets, rel_ids = _get_csr(node_ids, timestamps, edges)
+            relationship = '{0}{1}'.format(rel_type, direction)
+            sections += [
+                ('{0}.offsets'.format(relationship), offsets),
+                ('{0}.targets'.format(relationship), targets),
+                ('{0}.relationships'.format(relationship), rel_ids),
+            ]
+
+    metadata = {
+        'created': time.time(),
+        'labels': labels,
+        'relationships': ['{0}{1}'.format(rel_type, direction)
+                          for rel_type in sorted(relationships) for direction in '><'],
+        'sections': {},
+    }
+    offset = 0
+    for name, values in sections:
+        size = len(values) * values.itemsize
+        metadata['sections'][name] = [values.typecode, offset, size]
+        offset = _align(offset + size)
+    metadata_bytes = json.dumps(metadata).encode('utf-8')
+    header = _HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(metadata_bytes)) + metadata_bytes
+
+    with tempfile.NamedTemporaryFile(
+            'wb', dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp',
+            delete=False) as snapshot_file:
+        snapshot_file.write(header + b'\0' * (_align(len(header)) - len(header)))
+        for _, values in sections:
+            data = values.tobytes()
+            snapshot_file.write(data + b'\0' * (_align(len(data)) - len(data)))
+    os.rename(snapshot_file.name, path)
+
+
+def build_graph_snapshot(path):
+    """
+    Query Neo4j for the story graph and write it as a graph snapshot file.
+
+    Only the IDs, labels and timeline timestamps of the nodes with a label of the story flows, and
+    the relationships between the consecutive artifacts of the story flows are part of the
+    snapshot.
+
+    :param str path: the path of the graph snapshot file
+    :return: the number of nodes and the number of relationships in the snapshot
+    :rtype: tuple
+    """
+    # Avoid circular imports
+    from estuary.utils.story import TIMELINE_PROPERTIES, BaseStoryManager
+    from estuary.utils.story_metrics import get_story_edges
+
+    started = time.time()
+    driver = get_driver()
+    edges = get_story_edges()
+    labels = sorted(set(edge[0] for edge in edges) | set(edge[2] for edge in edges))
+    nodes = {}
+    for bit, label in enumerate(labels):
+        results, _ = read_query(driver, 'MATCH (node:{0}) RETURN id(node), node.{1}'.format(
+            label, TIMELINE_PROPERTIES[label]))
+        for node_id, timestamp in results:
+            label_bits = nodes.get(node_id, (0, None))[0]
+            nodes[node_id] = (label_bits | 1 << bit, timestamp)
+
+    relationships = {}
+    for label, relationship, next_label in edges:
+        results, _ = read_query(
+            driver,
+            'MATCH (artifact:{0}){1}(next_artifact:{2}) '
+            'RETURN id(r), id(startNode(r)), id(endNode(r))'.format(
+                label, BaseStoryManager.get_relationship_pattern(relationship, 'r'), next_label))
+        rel_type_relationships = relationships.setdefault(relationship[:-1], {})
+        for rel_id, start_id, end_id in results:
+            rel_type_relationships[rel_id] = (start_id, end_id)
+
+    write_graph_snapshot(path, labels, nodes, relationships)
+    rel_count = sum(len(rels) for rels in relationships.values())
+    log.info('Wrote the graph snapshot %s with %d nodes and %d relationships in %.1f seconds',
+             path, len(nodes), rel_count, time.time() - started)
+    return len(nodes), rel_count
+
+
+class GraphSnapshot(object):
+    """
+    A read-only snapshot of the story graph in compressed sparse row (CSR) arrays.
+
+    The arrays are read from a memory-mapped file, so the processes using the same snapshot file
+    share its memory through the page cache.
+    """
+
+    def __init__(self, path):
+        """
+        Initialize the GraphSnapshot class.
+
+        :param str path: the path of the graph snapshot file
+        :raises ValueError: if the file is not a graph snapshot of the supported version
+        """
+        self.path = path
+        with open(path, 'rb') as snapshot_file:
+            self.mtime = os.fstat(snapshot_file.fileno()).st_mtime
+            self._mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._mmap) < _HEADER.size:
+            raise ValueError('The file {0} is not a graph snapshot'.format(path))
+        magic, version, metadata_size = _HEADER.unpack_from(self._mmap)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError('The file {0} is not a graph snapshot of version {1}'.format(
+                path, SNAPSHOT_VERSION))
+        metadata_end = _HEADER.size + metadata_size
+        metadata = json.loads(self._mmap[_HEADER.size:metadata_end].decode('utf-8'))
+
+        self.created = metadata['created']
+        self.labels = metadata['labels']
+        self._label_bits = {label: 1 << bit for bit, label in enumerate(self.labels)}
+        view = memoryview(self._mmap)
+        data_start = _align(metadata_end)
+        sections = {}
+        for name, (typecode, offset, size) in metadata['sections'].items():
+            start = data_start + offset
+            sections[name] = view[start:start + size].cast(str(typecode))
+        self._node_ids = sections['node_ids']
+        self._node_labels = sections['node_labels']
+        self._node_timestamps = sections['node_timestamps']
+        self._relationships = {
+            relationship: (
+                sections['{0}.offsets'.format(relationship)],
+                sections['{0}.targets'.format(relationship)],
+                sections['{0}.relationships'.format(relationship)],
+            )
+            for relationship in metadata['relationships']
+        }
+
+    @property
+    def node_count(self):
+        """
+        Get the number of nodes in the snapshot.
+
+        :return: the number of nodes
+        :rtype: int
+        """
+        return len(self._node_ids)
+
+    def get_index(self, node_id):
+        """
+        Get the index of a node in the arrays of the snapshot.
+
+        :param int node_id: the Neo4j ID of the node
+        :return: the index or None if the node is not in the snapshot
+        :rtype: int or None
+        """
+        index = bisect.bisect_left(self._node_ids, node_id)
+        if index < len(self._node_ids) and self._node_ids[index] == node_id:
+            return index
+        return None
+
+    def get_related_nodes(self, index, relationship, label=None):
+        """
+        Get the nodes related to a node, from the most recent to the oldest.
+
+        :param int index: the index of the node
+        :param str relationship: the relationship type followed by its direction, such as
+            ``ATTACHED<``
+        :kwarg str label: the label of the related nodes to get, or None for all of them
+        :return: a generator of tuples of the index of the related node and the Neo4j ID of the
+            relationship
+        :rtype: generator
+        """
+        if relationship not in self._relationships:
+            return
+        label_bit = self._label_bits.get(label, 0) if label else None
+        offsets, targets, rel_ids = self._relationships[relationship]
+        for position in range(offsets[index], offsets[index + 1]):
+            target = targets[position]
+            if label_bit is None or self._node_labels[target] & label_bit:
+                yield target, rel_ids[position]
+
+    def get_degree(self, node_id, relationship, label=None):
+        """
+        Get the number of nodes related to a node in the direction of a relationship.
+
+        :param int node_id: the Neo4j ID of the node
+        :param str relationship: the relationship type followed by its direction, such as
+            ``ATTACHED<``
+        :kwarg str label: the label of the related nodes to count, or None for all of them
+        :return: the number of related nodes or None if the node is not in the snapshot
+        :rtype: int or None
+        """
+        index = self.get_index(node_id)
+        if index is None:
+            return None
+        return sum(1 for _ in self.get_related_nodes(index, relationship, label))
+
+    def count_related_nodes(self, node_id, rel_type, label):
+        """
+        Count the nodes related to a node in both directions of a relationship type.
+
+        This is the in-memory equivalent of the sibling count queries of the stories.
+
+        :param int node_id: the Neo4j ID of the node
+        :param str rel_type: the relationship type
+        :param str label: the label of the related nodes to count
+        :return: the number of related nodes or None if the node is not in the snapshot
+        :rtype: int or None
+        """
+        index = self.get_index(node_id)
+        if index is None:
+            return None
+        return sum(
+            sum(1 for _ in self.get_related_nodes(index, rel_type + direction, label))
+            for direction in '><'
+        )
+
+    def get_story_path(self, node_id, sequence, max_level=None, top_k=None):
+        """
+        Get the longest path following a story flow from a node.
+
+        This is the in-memory equivalent of the story query with ``apoc.path.expandConfig``
+        limited to its longest path. When several paths are the longest, the one through the most
+        recent nodes is returned.
+
+        :param int node_id: the Neo4j ID of the node
+        :param list sequence: the label of the node followed by the relationship and the label of
+            each next artifact in the story flow
+        :kwarg int max_level: the maximum number of relationships to expand
+        :kwarg int top_k: when set, only the paths through the top_k most recent nodes related to
+            the node are expanded
+        :return: a tuple of the list of the Neo4j IDs of the nodes in the path, and the list of the
+            Neo4j IDs of its relationships, which is empty when the story doesn't continue in that
+            direction, or None if the node is not in the snapshot
+        :rtype: tuple or None
+        """
+        start = self.get_index(node_id)
+        if start is None:
+            return None
+
+        steps = [(sequence[i], sequence[i + 1]) for i in range(1, len(sequence) - 1, 2)]
+        if max_level is not None:
+            steps = steps[:max_level]
+        # The longest path from a node at a step of the story flow is shared by all the paths going
+        # through that node, so the graph is traversed once instead of once per path
+        longest = {}
+
+        def _expand(index, step):
+            key = (index, step)
+            if key not in longest:
+                best = (0, None, None)
+                if step < len(steps):
+                    related_nodes = self.get_related_nodes(index, *steps[step])
+                    if step == 0 and top_k:
+                        related_nodes = islice(related_nodes, top_k)
+                    for target, rel_id in related_nodes:
+                        length = _expand(target, step + 1)[0] + 1
+                        if length > best[0]:
+                            best = (length, target, rel_id)
+                            if length == len(steps) - step:
+                                # A path can't be longer than the story flow
+                                break
+                longest[key] = best
+            return longest[key]
+
+        node_ids = [node_id]
+        rel_ids = []
+        index = start
+        for step in range(len(steps)):
+            _, target, rel_id = _expand(index, step)
+            if target is None:
+                break
+            node_ids.append(self._node_ids[target])
+            rel_ids.append(rel_id)
+            index = target
+        return node_ids, rel_ids
+
+
+def hydrate_story_paths(paths):
+    """
+    Query Neo4j for the nodes and relationships of the story paths computed from a snapshot.
+
+    The nodes and relationships are looked up by their IDs in a single query.
+
+    :param list paths: tuples of the list of the node IDs and the list of the relationship IDs of
+        each path
+    :return: a list with the story query results of each path, which is a list with a record of
+        the neo4j.graph.Path, or an empty list if the path has no relationships; or None if the
+        graph changed since the snapshot was created
+    :rtype: list or None
+    """
+    node_ids = set()
+    rel_ids = set()
+    for path_node_ids, path_rel_ids in paths:
+        if path_rel_ids:
+            node_ids.update(path_node_ids)
+            rel_ids.update(path_rel_ids)
+    if not rel_ids:
+        return [[] for _ in paths]
+
+    results, _ = run_read_queries([(
+        'MATCH (node) WHERE id(node) IN {node_ids} '
+        'WITH collect(node) AS nodes '
+        'MATCH ()-[r]->() WHERE id(r) IN {relationship_ids} '
+        'RETURN nodes, collect(r) AS relationships',
+        {'node_ids': list(node_ids), 'relationship_ids': list(rel_ids)},
+    )])[0]
+    if not results:
+        return None
+    nodes = {node.id: node for node in results[0][0]}
+    relationships = {rel.id: rel for rel in results[0][1]}
+    if len(nodes) != len(node_ids) or len(relationships) != len(rel_ids):
+        log.info('The graph snapshot is missing nodes or relationships deleted from Neo4j')
+        return None
+
+    stories = []
+    for path_node_ids, path_rel_ids in paths:
+        if not path_rel_ids:
+            stories.append([])
+            continue
+        try:
+            path = Path(nodes[path_node_ids[0]], *[relationships[i] for i in path_rel_ids])
+        except ValueError:
+            # The IDs of the deleted relationships were reused by Neo4j
+            log.info('The graph snapshot has relationships that changed in Neo4j')
+            return None
+        stories.append([[path]])
+    return stories
+
+
+def refresh_graph_snapshot(path, interval):
+    """
+    Rebuild the graph snapshot unless it's recent or another process is rebuilding it.
+
+    :param str path: the path of the graph snapshot file
+    :param float interval: the number of seconds after which the graph snapshot is rebuilt
+    :return: a boolean determining if the graph snapshot was rebuilt
+    :rtype: bool
+    """
+    with open('{0}.lock'.format(path), 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            return False
+
+        try:
+            # Another process may have rebuilt it since this process checked it
+            try:
+                if time.time() - os.path.getmtime(path) < interval:
+                    return False
+            except OSError:
+                pass
+            build_graph_snapshot(path)
+            return True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# The graph snapshot of this process. It's loaded on first use and reloaded when the file changes.
+_snapshot = None
+_snapshot_lock = threading.Lock()
+_refresh_thread = None
+_last_refresh = 0
+
+
+def _refresh_in_background(path, interval):
+    """
+    Rebuild the graph snapshot in a background thread of this process.
+
+    :param str path: the path of the graph snapshot file
+    :param float interval: the number of seconds after which the graph snapshot is rebuilt
+    """
+    global _refresh_thread, _last_refresh
+
+    # Don't retry a failed rebuild on every request
+    if (_refresh_thread and _refresh_thread.is_alive()) or time.time() - _last_refresh < interval:
+        return
+
+    def _refresh():
+        try:
+            refresh_graph_snapshot(path, interval)
+        except Exception:
+            log.exception('Failed to rebuild the graph snapshot %s', path)
+
+    _last_refresh = time.time()
+    _refresh_thread = threading.Thread(target=_refresh, name='estuary-snapshot')
+    _refresh_thread.daemon = True
+    _refresh_thread.start()
+
+
+def get_graph_snapshot(config):
+    """
+    Get the graph snapshot of this process if the graph snapshots are enabled.
+
+    The snapshot is reloaded when its file was replaced. When it's older than the refresh
+    interval, it's rebuilt in the background by one of the processes of the host, and the current
+    snapshot is used in the meantime.
+
+    :param flask.config.Config config: flask config
+    :return: the graph snapshot or None if it's disabled or not built yet
+    :rtype: GraphSnapshot or None
+    """
+    global _snapshot
+
+    path = config.get('GRAPH_SNAPSHOT_PATH')
+    if not path:
+        return None
+
+    interval = config['GRAPH_SNAPSHOT_REFRESH_INTERVAL']
+    with _snapshot_lock:
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+
+        if mtime is None:
+            _snapshot = None
+        elif _snapshot is None or _snapshot.path != path or _snapshot.mtime != mtime:
+            try:
+                _snapshot = GraphSnapshot(path)
+                log.info('Loaded the graph snapshot %s with %d nodes', path, _snapshot.node_count)
+            except (IOError, OSError, ValueError):
+                log.exception('Failed to load the graph snapshot %s', path)
+                _snapshot = None
+
+        if mtime is None or time.time() - mtime >= interval:
+            _refresh_in_background(path, interval)
+        return _snapshot
@@ -10,97 +10,307 @@ from neomodel import db
 
 from estuary import log
 from estuary.error import ValidationError
+from estuary.models import names_to_model
 from estuary.models.bugzilla import BugzillaBug
 from estuary.models.distgit import DistGitCommit
 from estuary.models.errata import Advisory, ContainerAdvisory
 from estuary.models.freshmaker import FreshmakerEvent
 from estuary.models.koji import ContainerKojiBuild, KojiBuild, ModuleKojiBuild
+from estuary.utils.database import apply_query_timeout, run_read_queries
+from estuary.utils.general import get_batch_cache, select_fields
+from estuary.utils.traversal import (ApocBackend, SnapshotBackend, Traversal,
+                                     get_degree_query, get_traversal_backends)
+
+# The properties used as the timeline_datetime of the models
+TIMELINE_PROPERTIES = {
+    'Advisory': 'created_at',
+    'BugzillaBug': 'creation_time',
+    'ContainerAdvisory': 'created_at',
+    'ContainerKojiBuild': 'creation_time',
+    'DistGitCommit': 'commit_date',
+    'FreshmakerEvent': 'time_created',
+    'KojiBuild': 'creation_time',
+    'ModuleKojiBuild': 'creation_time'
+}
+# The properties used as the completion time of the artifacts when computing the wait times. Some
+# services do not have a real completion time because they perform a single action that takes a
+# negligible amount of time.
+COMPLETION_PROPERTIES = {
+    'BugzillaBug': 'creation_time',
+    'DistGitCommit': 'commit_date',
+    'Advisory': 'status_time',
+    'ContainerAdvisory': 'status_time',
+    # Although Freshmaker has a duration, we need to see how long it takes to trigger a
+    # ContainerKojiBuild from when it started
+    'FreshmakerEvent': 'time_created',
+    'KojiBuild': 'completion_time',
+    'ModuleKojiBuild': 'completion_time',
+    'ContainerKojiBuild': 'completion_time'
+}
+# The properties storing the metrics precomputed by estuary.utils.story_metrics on the story
+# relationships and nodes
+WAIT_TIME_PROPERTY = 'wait_time'
+PROCESSING_TIME_PROPERTY = 'processing_time'
+# The states of a Freshmaker event that is done processing
+FRESHMAKER_FINAL_STATES = ['COMPLETE', 'SKIPPED', 'FAILED', 'CANCELED']
+
+
+def run_story_queries(queries):
+    """
+    Run independent story queries concurrently.
+
+    In a batch request, the results are shared by the items of the batch, so that the subpaths
+    and the sibling counts shared by several stories are only queried once.
+
+    :param list queries: Cypher queries, where the empty ones are skipped
+    :return: the results of each query in the same order, with an empty list for empty queries
+    :rtype: list
+    """
+    cache = get_batch_cache('story_queries')
+    if cache is None:
+        cache = {}
+    # Preserve the order of the queries while removing the duplicates
+    missing = [query for query in dict.fromkeys(queries) if query and query not in cache]
+    for query, (results, _) in zip(missing, run_read_queries([(q, None) for q in missing])):
+        cache[query] = results
+    return [cache[query] if query else [] for query in queries]
 
 
 class BaseStoryManager(object):
     """A class containing utility methods to create a story for an artifact."""
 
+    # Set when only the most recent nodes related to a hub node were traversed
+    partial = False
+    # The Neo4j paths of the story, set by get_story_manager
+    forward_story = None
+    backward_story = None
+    # The graph snapshot used instead of Neo4j for the traversals, set by get_story_manager
+    snapshot = None
+
     @staticmethod
-    def get_story_manager(item, config, limit=False):
+    def get_story_manager(item, config, limit=False, max_level=None):
         """
         Select which story flow to follow.
 
         :param node item: a Neo4j node whose story is requested by the user
         :param flask.config.Config config: flask config
         :kwarg bool limit: specifies if LIMIT keyword should be added to the created cypher query
+        :kwarg int max_level: the maximum number of relationships to expand in each direction
         :return: instance of one of the story manager classes
         :rtype: ModuleStoryManager/ContainerStoryManager
         """
+        backends = get_traversal_backends(config, limit=limit)
         for class_name in config['STORY_MANAGER_SEQUENCE']:
             story_manager_cls = getattr(sys.modules[__name__], class_name, None)
             if not story_manager_cls:
                 raise RuntimeError('Story manager class of {0} could not be found'
                                    .format(class_name))
             story_manager = story_manager_cls()
-            story_manager.forward_story = story_manager.get_story_nodes(item, limit=limit)
-            story_manager.backward_story = story_manager.get_story_nodes(
-                item, reverse=True, limit=limit)
+            story_manager.forward_story, story_manager.backward_story = story_manager.get_stories(
+                item, config, backends, limit=limit, max_level=max_level)
 
             if story_manager.is_valid():
                 return story_manager
 
         return story_manager
 
-    def get_story_nodes(self, item, reverse=False, limit=False):
+    def get_stories(self, item, config, backends, limit=False, max_level=None):
         """
-        Create a raw cypher query for story of an artifact and query neo4j with it.
+        Get the forward and backward story paths of an artifact from the first backend able to.
+
+        :param node item: a Neo4j node whose story is requested by the user
+        :param flask.config.Config config: flask config
+        :param list backends: the TraversalBackend objects to try in order
+        :kwarg bool limit: specifies if only the longest path of the stories is needed
+        :kwarg int max_level: the maximum number of relationships to expand in each direction
+        :return: the results of the forward and the backward story paths like the story queries
+        :rtype: list
+        """
+        sequences = [self.get_story_sequence(item), self.get_story_sequence(item, reverse=True)]
+        threshold = config['HUB_DEGREE_THRESHOLD']
+        for backend in backends:
+            # Expanding the story of a hub node enumerates a path per related node, so only its
+            # most recent related nodes are expanded when it's above the degree threshold
+            top_k = [None, None]
+            if threshold:
+                degrees = backend.get_degrees(item.id, sequences)
+                if degrees is None:
+                    continue
+                for index, degree in enumerate(degrees):
+                    if degree > threshold:
+                        log.info('Only expanding the %d most recent nodes related to the %s node '
+                                 'with the ID %d', config['HUB_TOP_K'], item.__label__, item.id)
+                        top_k[index] = config['HUB_TOP_K']
+            stories = backend.get_story_paths([
+                Traversal(item.id, sequence, limit, max_level, sequence_top_k)
+                for sequence, sequence_top_k in zip(sequences, top_k)
+            ])
+            if stories is not None:
+                if any(top_k):
+                    self.partial = True
+                if isinstance(backend, SnapshotBackend):
+                    # The sibling counts are also computed from the snapshot the stories come from
+                    self.snapshot = backend.snapshot
+                return stories
+
+    def get_story_sequence(self, item, reverse=False):
+        """
+        Get the labels and relationships of the story flow of an artifact.
 
         :param node item: a Neo4j node whose story is requested by the user
         :kwarg bool reverse: specifies the direction to proceed from current node
             corresponding to the story_flow
-        :kwarg bool limit: specifies if LIMIT keyword should be added to the created cypher query
+        :return: the label of the artifact followed by the relationship and the label of each
+            next artifact in the story flow
+        :rtype: list
+        :raises ValidationError: if the artifact has no story
+        """
+        if item.__label__ not in self.story_flow_list:
+            raise ValidationError('The story is not available for this kind of resource')
+
+        direction = 'backward' if reverse else 'forward'
+        sequence = [item.__label__]
+        curr_node_info = self.story_flow(item.__label__)
+        while curr_node_info and curr_node_info['{0}_relationship'.format(direction)]:
+            next_label = curr_node_info['{0}_label'.format(direction)]
+            sequence += [curr_node_info['{0}_relationship'.format(direction)], next_label]
+            curr_node_info = self.story_flow(next_label)
+        return sequence
+
+    def get_story_nodes(self, item, reverse=False, limit=False, backend=None):
+        """
+        Traverse the story of an artifact in a direction.
+
+        :param node item: a Neo4j node whose story is requested by the user
+        :kwarg bool reverse: specifies the direction to proceed from current node
+            corresponding to the story_flow
+        :kwarg bool limit: specifies if only the longest story path should be returned
+        :kwarg TraversalBackend backend: the backend traversing the story, which defaults to APOC
         :return: story paths for a particular artifact
         :rtype: list
         """
-        query = ''
+        traversal = Traversal(
+            item.id, self.get_story_sequence(item, reverse=reverse), limit, None, None)
+        return (backend or ApocBackend()).get_story_paths([traversal])[0]
+
+    @staticmethod
+    def get_relationship_pattern(relationship, variable=''):
+        """
+        Convert a relationship of the story flow to a Cypher relationship pattern.
+
+        :param str relationship: the relationship type followed by its direction, such as
+            ``ATTACHED<``
+        :kwarg str variable: the Cypher variable of the relationship
+        :return: the Cypher relationship pattern, such as ``<-[:ATTACHED]-``
+        :rtype: str
+        """
+        if relationship.endswith('<'):
+            return '<-[{0}:{1}]-'.format(variable, relationship[:-1])
+        return '-[{0}:{1}]->'.format(variable, relationship[:-1])
+
+    def _get_story_elements(self):
+        """
+        Get the nodes and relationships of the Neo4j paths of the story by their IDs.
+
+        :return: a tuple of a dictionary of the nodes by ID, and a dictionary of the relationships
+            by the set of the IDs of the nodes they connect
+        :rtype: tuple
+        """
+        if getattr(self, '_story_elements', None) is None:
+            nodes = {}
+            relationships = {}
+            for record in (self.forward_story or []) + (self.backward_story or []):
+                for node in record[0].nodes:
+                    nodes[node.id] = node
+                for rel in record[0].relationships:
+                    relationships[frozenset((rel.start_node.id, rel.end_node.id))] = rel
+            self._story_elements = (nodes, relationships)
+        return self._story_elements
+
+    def get_story_relationship(self, artifact, next_artifact):
+        """
+        Get the relationship between two consecutive artifacts from the Neo4j paths of the story.
+
+        :param EstuaryStructuredNode artifact: an artifact of the story
+        :param EstuaryStructuredNode next_artifact: the next artifact of the story
+        :return: the relationship or None if it's not part of the paths of the story
+        :rtype: neo4j.graph.Relationship or None
+        """
+        return self._get_story_elements()[1].get(frozenset((artifact.id, next_artifact.id)))
 
-        if reverse is True:
-            rel_label = 'backward_relationship'
-            node_label = 'backward_label'
+    def get_precomputed_metric(self, name, artifact, next_artifact=None):
+        """
+        Get a metric precomputed after the scrapers ran from the Neo4j paths of the story.
+
+        This avoids querying Neo4j for the relationships between the artifacts of the story.
+
+        :param str name: the name of the property of the metric
+        :param EstuaryStructuredNode artifact: the artifact of the metric
+        :kwarg EstuaryStructuredNode next_artifact: the next artifact of the story when the metric
+            is stored on the relationship between the two artifacts
+        :return: the value of the metric or None if it wasn't precomputed
+        :rtype: float or None
+        """
+        if next_artifact is None:
+            entity = self._get_story_elements()[0].get(artifact.id)
         else:
-            rel_label = 'forward_relationship'
-            node_label = 'forward_label'
+            entity = self.get_story_relationship(artifact, next_artifact)
+        if entity is None or entity.get(name) is None:
+            return None
+        # The timestamps are stored as floats, so remove the rounding errors of the subtraction
+        return round(entity.get(name), 6)
 
-        curr_node_label = item.__label__
-        if curr_node_label not in self.story_flow_list:
-            raise ValidationError('The story is not available for this kind of resource')
+    def get_attached_build_time(self, advisory, build):
+        """
+        Get the time that a build was attached to an advisory.
 
-        while True:
-            curr_node_info = self.story_flow(curr_node_label)
-            if not curr_node_info:
-                break
+        The relationship is taken from the Neo4j paths of the story when possible, instead of
+        querying Neo4j for it.
 
-            if curr_node_label == item.__label__:
-                query = """\
-                    MATCH ({var}:{label}) WHERE id({var})= {node_id}
-                    CALL apoc.path.expandConfig({var}, {{sequence:\'{label}
-                    """.format(
-                        var=curr_node_label.lower(), label=curr_node_label, node_id=item.id)
+        :param Advisory advisory: the advisory
+        :param KojiBuild build: the build attached to the advisory
+        :return: the time the build was attached
+        :rtype: datetime object
+        """
+        rel = self.get_story_relationship(build, advisory)
+        if rel is not None and rel.type == advisory.attached_builds.definition['relation_type']:
+            return Advisory.BuildAttachedRel.inflate(rel).time_attached
+        return advisory.attached_build_time(advisory, build)
 
-            query += ', {0}, {1}'.format(curr_node_info[rel_label],
-                                         curr_node_info[node_label])
+    def get_story_degree_query(self, item):
+        """
+        Create the Cypher query of the number of nodes related to an artifact in its story.
 
-            curr_node_label = curr_node_info[node_label]
+        The relationships are counted without matching the related nodes, so that Neo4j can use
+        the degree stored on the node instead of traversing the relationships.
 
-        if query:
-            query += """\
-                \', minLevel:1}) YIELD path
-                RETURN path
-                ORDER BY length(path) DESC
-                """
+        :param node item: a Neo4j node whose story is requested by the user
+        :return: the Cypher query of the forward and backward degrees, or an empty string if the
+            story isn't available for this kind of node
+        :rtype: str
+        """
+        if item.__label__ not in self.story_flow_list:
+            return ''
+        return get_degree_query(
+            item.id, [self.get_story_sequence(item), self.get_story_sequence(item, reverse=True)])
 
-        if query and limit:
-            query += ' LIMIT 1'
+    def get_story_query(self, item, reverse=False, limit=False, max_level=None, top_k=None):
+        """
+        Create the APOC Cypher query of the story of an artifact.
 
-        results = []
-        if query:
-            results, _ = db.cypher_query(query)
-        return results
+        :param node item: a Neo4j node whose story is requested by the user
+        :kwarg bool reverse: specifies the direction to proceed from current node
+            corresponding to the story_flow
+        :kwarg bool limit: specifies if LIMIT keyword should be added to the created cypher query
+        :kwarg int max_level: the maximum number of relationships to expand, which stops the
+            traversal early when only part of the story is needed
+        :kwarg int top_k: when set, only the paths through the top_k most recent nodes related to
+            the artifact are expanded, which is used for hub nodes
+        :return: the Cypher query or an empty string if there is no story in that direction
+        :rtype: str
+        """
+        return ApocBackend().get_story_query(Traversal(
+            item.id, self.get_story_sequence(item, reverse=reverse), limit, max_level, top_k))
 
     @abc.abstractmethod
     def story_flow(self, label):
@@ -127,17 +337,34 @@ class BaseStoryManager(object):
         if len_story < 2:
             raise RuntimeError('This function can\'t be called with one or zero elements')
 
-        correlated_nodes = []
+        siblings = []
         if not reverse:
             for index in range(len_story - 1):
-                correlated_nodes.append(self.get_sibling_nodes(
-                    results[index].__label__, results[index + 1], count=True))
+                siblings.append((results[index].__label__, results[index + 1]))
         else:
             # Iterate over results backwards for convenience --
             # will be reversed to correct order later
             for index in range(len_story - 1, 0, -1):
-                correlated_nodes.append(self.get_sibling_nodes(
-                    results[index].__label__, results[index - 1], count=True))
+                siblings.append((results[index].__label__, results[index - 1]))
+
+        # The counts are read from the degree counters stored on the nodes or from the graph
+        # snapshot when possible, and the other ones are queried
+        counts = []
+        for label, story_node in siblings:
+            rel_type = self.get_sibling_relationship(label, story_node)
+            count = story_node.get_degree(rel_type, label)
+            if count is None and self.snapshot is not None:
+                count = self.snapshot.count_related_nodes(story_node.id, rel_type, label)
+            counts.append(count)
+        missing = [index for index, count in enumerate(counts) if count is None]
+        # Each count is independent of the others, so they are queried concurrently
+        queries = [self.get_sibling_nodes_query(siblings[index][0], siblings[index][1], count=True)
+                   for index in missing]
+        for index, count_results in zip(missing, run_story_queries(queries)):
+            counts[index] = count_results[0][0]
+
+        # We reduce the count by one to ignore the node already being shown in the story
+        correlated_nodes = [count - 1 if count else 0 for count in counts]
 
         # When traversing the story, the last node is skipped because there is no next node for it,
         # so we must add a value of 0 as a placeholder
@@ -160,37 +387,27 @@ class BaseStoryManager(object):
         if len_story < 2:
             return [0], 0
 
-        # Some services do not have a real completion time because they perform a single action
-        # that takes a negligible amount of time
-        completion_times = {
-            'BugzillaBug': 'creation_time',
-            'DistGitCommit': 'commit_date',
-            'Advisory': 'status_time',
-            'ContainerAdvisory': 'status_time',
-            # Although Freshmaker has a duration, we need to see how long it takes to trigger a
-            # ContainerKojiBuild from when it started
-            'FreshmakerEvent': 'time_created',
-            'KojiBuild': 'completion_time',
-            'ModuleKojiBuild': 'completion_time',
-            'ContainerKojiBuild': 'completion_time'
-        }
-
         total_wait_time = 0
         wait_times = [None for i in range(len_story - 1)]
 
         for index in range(len_story - 1):
             artifact = results[index]
             next_artifact = results[index + 1]
-            property_name = completion_times[artifact.__label__]
+            wait_time = self.get_precomputed_metric(WAIT_TIME_PROPERTY, artifact, next_artifact)
+            if wait_time is not None:
+                wait_times[index] = wait_time
+                if artifact.__label__ != 'FreshmakerEvent':
+                    total_wait_time += wait_time
+                continue
+
+            property_name = COMPLETION_PROPERTIES[artifact.__label__]
             completion_time = getattr(artifact, property_name)
             if not completion_time or not next_artifact.timeline_datetime:
                 continue
 
             if next_artifact.__label__.endswith('Advisory'):
-                if next_artifact.attached_build_time(next_artifact, artifact):
-                    next_artifact_start_time = next_artifact.attached_build_time(next_artifact,
-                                                                                 artifact)
-                else:
+                next_artifact_start_time = self.get_attached_build_time(next_artifact, artifact)
+                if not next_artifact_start_time:
                     id_num = getattr(next_artifact, artifact.unique_id_property + '_')
                     log.warning(
                         'While calculating the wait time, a %s with ID %s was '
@@ -260,12 +477,20 @@ class BaseStoryManager(object):
                 build = artifact
 
             if artifact.__label__.endswith('Advisory'):
+                processing_time = None
+                if build:
+                    processing_time = self.get_precomputed_metric(
+                        PROCESSING_TIME_PROPERTY, build, artifact)
+                if processing_time is not None:
+                    total += processing_time
+                    continue
+
                 if artifact.state in ['SHIPPED_LIVE', 'DROPPED_NO_SHIP']:
                     completion_time = getattr(artifact, timed_processes[artifact.__label__][1])
                 else:
                     completion_time = datetime.utcnow()
                 if build:
-                    creation_time = artifact.attached_build_time(artifact, build)
+                    creation_time = self.get_attached_build_time(artifact, build)
                     if not creation_time:
                         creation_time = getattr(build, timed_processes[build.__label__][1])
                 if not build or not creation_time:
@@ -284,7 +509,12 @@ class BaseStoryManager(object):
                     next_artifact = results[index + 1]
                     completion_time = getattr(next_artifact,
                                               timed_processes[next_artifact.__label__][0])
-                elif artifact.state_name in ['COMPLETE', 'SKIPPED', 'FAILED', 'CANCELED']:
+                elif artifact.state_name in FRESHMAKER_FINAL_STATES:
+                    processing_time = self.get_precomputed_metric(
+                        PROCESSING_TIME_PROPERTY, artifact)
+                    if processing_time is not None:
+                        total += processing_time
+                        continue
                     completion_time = getattr(artifact, timed_processes['FreshmakerEvent'][1])
                     if completion_time is None:
                         id_num = getattr(artifact, artifact.unique_id_property + '_')
@@ -299,6 +529,10 @@ class BaseStoryManager(object):
                     completion_time = datetime.utcnow()
 
             else:
+                processing_time = self.get_precomputed_metric(PROCESSING_TIME_PROPERTY, artifact)
+                if processing_time is not None:
+                    total += processing_time
+                    continue
                 completion_time = getattr(artifact, timed_processes[artifact.__label__][1])
                 if not completion_time:
                     completion_time = datetime.utcnow()
@@ -379,29 +613,104 @@ class BaseStoryManager(object):
             return 0
         return total.total_seconds()
 
-    def get_sibling_nodes(self, siblings_node_label, story_node, count=False):
+    def get_sibling_nodes(self, siblings_node_label, story_node, count=False, skip=0, limit=None,
+                          descending=True, hub_threshold=None, top_k=None):
         """
         Return sibling nodes with the label siblings_node_label that are related to story_node.
 
+        The sibling nodes are sorted by their timeline property, and they are returned with the
+        total number of sibling nodes in a single query.
+
         :param str siblings_node_label: node label for which the siblings count is to be calculated
         :param EstuaryStructuredNode story_node: node in the story that has the desired
             relationships with the siblings (specified with siblings_node_label)
         :kwarg bool count: determines if only count of sibling nodes should be returned
             or the nodes themselves
-        :return: siblings count of curr_node | sibling nodes
-        :rtype: int | EstuaryStructuredNode
+        :kwarg int skip: the number of sibling nodes to skip
+        :kwarg int limit: the maximum number of sibling nodes to return
+        :kwarg bool descending: determines if the most recent sibling nodes are first
+        :kwarg int hub_threshold: the number of sibling nodes above which only the top_k most
+            recent sibling nodes are returned, in which case the partial attribute is set
+        :kwarg int top_k: the number of most recent sibling nodes returned above hub_threshold
+        :return: siblings count of curr_node | a tuple of the sibling nodes and their total count
+        :rtype: int | tuple
+        """
+        if count:
+            total = self.get_sibling_count(siblings_node_label, story_node)
+            # We reduce the count by one to ignore the node already being shown in the story
+            return total - 1 if total else 0
+
+        if not (hub_threshold and top_k):
+            hub_threshold = top_k = None
+        query = self.get_sibling_nodes_query(
+            siblings_node_label, story_node, skip=skip, limit=limit, descending=descending,
+            hub_threshold=hub_threshold, top_k=top_k)
+        results, _ = db.cypher_query(apply_query_timeout(query))
+        total, siblings = results[0]
+        if hub_threshold and total > hub_threshold:
+            self.partial = True
+        return siblings, total
+
+    def get_sibling_count(self, siblings_node_label, story_node):
+        """
+        Get the number of nodes with the label siblings_node_label that are related to story_node.
+
+        The count is read from the degree counter stored on story_node when it's set.
+
+        :param str siblings_node_label: the label of the sibling nodes
+        :param EstuaryStructuredNode story_node: node in the story that has the desired
+            relationships with the siblings (specified with siblings_node_label)
+        :return: the number of sibling nodes, including the one in the story
+        :rtype: int
+        """
+        total = story_node.get_degree(
+            self.get_sibling_relationship(siblings_node_label, story_node), siblings_node_label)
+        if total is None:
+            results, _ = db.cypher_query(apply_query_timeout(self.get_sibling_nodes_query(
+                siblings_node_label, story_node, count=True)))
+            total = results[0][0]
+        return total
+
+    def get_sibling_relationship(self, siblings_node_label, story_node):
+        """
+        Get the type of the relationship between a node in the story and its sibling nodes.
+
+        :param str siblings_node_label: the label of the sibling nodes
+        :param EstuaryStructuredNode story_node: node in the story that has the desired
+            relationships with the siblings (specified with siblings_node_label)
+        :return: the relationship type
+        :rtype: str
+        :raises RuntimeError: if the node isn't related to nodes with that label in the story
         """
         item_story_flow = self.story_flow(story_node.__label__)
         # Based on the desired siblings label, we can determine which story_node
         # relationship to query for
         if item_story_flow['forward_label'] == siblings_node_label:
-            relationship = item_story_flow['forward_relationship'][:-1]
+            return item_story_flow['forward_relationship'][:-1]
         elif item_story_flow['backward_label'] == siblings_node_label:
-            relationship = item_story_flow['backward_relationship'][:-1]
-        else:
-            RuntimeError('The node with label "{0}" does not have a relationship with '
-                         'nodes of label "{1}"'.format(story_node.__label__, siblings_node_label))
+            return item_story_flow['backward_relationship'][:-1]
+        raise RuntimeError('The node with label "{0}" does not have a relationship with '
+                           'nodes of label "{1}"'.format(story_node.__label__, siblings_node_label))
+
+    def get_sibling_nodes_query(self, siblings_node_label, story_node, count=False, skip=0,
+                                limit=None, descending=True, hub_threshold=None, top_k=None):
+        """
+        Create the Cypher query of the sibling nodes with the label siblings_node_label.
 
+        :param str siblings_node_label: node label for which the siblings count is to be calculated
+        :param EstuaryStructuredNode story_node: node in the story that has the desired
+            relationships with the siblings (specified with siblings_node_label)
+        :kwarg bool count: determines if the query should only count the sibling nodes
+        :kwarg int skip: the number of sibling nodes to skip
+        :kwarg int limit: the maximum number of sibling nodes to return
+        :kwarg bool descending: determines if the most recent sibling nodes are first
+        :kwarg int hub_threshold: the number of sibling nodes above which only the top_k most
+            recent sibling nodes are returned
+        :kwarg int top_k: the number of most recent sibling nodes returned above hub_threshold
+        :return: the Cypher query
+        :rtype: str
+        """
+        relationship = self.get_sibling_relationship(siblings_node_label, story_node)
         query = ('MATCH (next_node:{next_label})-[:{rel}]-(sibling:{curr_label})'
                  'WHERE id(next_node)= {next_node_id}').format(
             next_label=story_node.__label__, rel=relationship, curr_label=siblings_node_label,
@@ -409,16 +718,39 @@ class BaseStoryManager(object):
 
         if count:
             query += ' RETURN COUNT(sibling) as count'
-            results, _ = db.cypher_query(query)
-            count = results[0][0]
-            if count == 0:
-                return count
-            # We reduce the count by one to ignore the node already being shown in the story
-            return count - 1
-        else:
-            query += ' RETURN sibling'
-            results, _ = db.cypher_query(query)
-            return results
+            return query
+
+        def _get_order_by(order):
+            # The internal ID is used as a tie breaker so that the pages are consistent
+            order_by = 'id(sibling) {0}'.format(order)
+            if siblings_node_label in TIMELINE_PROPERTIES:
+                order_by = 'sibling.{0} {1}, {2}'.format(
+                    TIMELINE_PROPERTIES[siblings_node_label], order, order_by)
+            return order_by
+
+        hub = hub_threshold and top_k
+        # The most recent sibling nodes of a hub are kept, so they're sorted from the most recent
+        # and reversed afterwards if needed
+        order_by = _get_order_by('DESC' if descending or hub else 'ASC')
+        query += (' WITH sibling ORDER BY {0}'
+                  ' WITH collect(sibling) AS siblings'
+                  ' WITH size(siblings) AS total, siblings').format(order_by)
+        if hub:
+            # The total is the number of all the sibling nodes even if only the top_k are returned,
+            # so the hub check doesn't need another query
+            query += (' WITH total, CASE WHEN total > {0} THEN siblings[..{1}] ELSE siblings END'
+                      ' AS siblings').format(int(hub_threshold), int(top_k))
+            if not descending:
+                query += ' WITH total, reverse(siblings) AS siblings'
+        page = 'siblings[{0}..]'.format(int(skip))
+        if limit is not None:
+            page = 'siblings[{0}..{1}]'.format(int(skip), int(skip) + int(limit))
+        # Only the properties requested with the fields query parameter are returned
+        projection = names_to_model[siblings_node_label].get_projection('sibling')
+        if projection != 'sibling':
+            page = '[sibling IN {0} | {1}]'.format(page, projection)
+        query += ' RETURN total, {0} AS siblings'.format(page)
+        return query
 
     def format_story_results(self, results, requested_item):
         """
@@ -439,21 +771,20 @@ class BaseStoryManager(object):
             serialized_node['resource_type'] = node.__label__
             serialized_node['display_name'] = node.display_name
             serialized_node['timeline_timestamp'] = node.timeline_timestamp
-            data.append(serialized_node)
+            data.append(select_fields(serialized_node))
 
-        base_instance = BaseStoryManager()
-        wait_times, total_wait_time = base_instance.get_wait_times(results)
+        wait_times, total_wait_time = self.get_wait_times(results)
         total_processing_time = 0
         processing_time_flag = False
         total_lead_time = 0
         try:
-            processing_time, flag = base_instance.get_total_processing_time(results)
+            processing_time, flag = self.get_total_processing_time(results)
             total_processing_time = processing_time
             processing_time_flag = flag
         except:  # noqa E722
             log.exception('Failed to compute total processing time statistic.')
         try:
-            total_lead_time = base_instance.get_total_lead_time(results)
+            total_lead_time = self.get_total_lead_time(results)
         except:  # noqa E722
             log.exception('Failed to compute total lead time statistic.')
         formatted_results = {
@@ -471,6 +802,8 @@ class BaseStoryManager(object):
                 'total_lead_time': total_lead_time
             }
         }
+        if self.partial:
+            formatted_results['meta']['partial'] = True
         return formatted_results
 
     def set_story_labels(self, requested_node_label, results, reverse=False):
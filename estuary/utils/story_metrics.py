@@ -0,0 +1,228 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+from neomodel import db
+
+from estuary import log
+from estuary.utils.changelog import get_node_ids
+from estuary.utils.story import (COMPLETION_PROPERTIES,
+                                 FRESHMAKER_FINAL_STATES,
+                                 PROCESSING_TIME_PROPERTY, TIMELINE_PROPERTIES,
+                                 WAIT_TIME_PROPERTY, ContainerStoryManager,
+                                 ModuleStoryManager)
+
+# The number of nodes or relationships updated per transaction
+BATCH_SIZE = 10000
+# The states of an advisory that is done processing
+ADVISORY_FINAL_STATES = ['SHIPPED_LIVE', 'DROPPED_NO_SHIP']
+
+
+def get_story_edges():
+    """
+    Get the pairs of consecutive artifacts in the story flows.
+
+    :return: a sorted list of tuples of the label of an artifact, the relationship to the next
+        artifact as in the story flow, and the label of the next artifact
+    :rtype: list
+    """
+    edges = set()
+    for story_manager in (ContainerStoryManager(), ModuleStoryManager()):
+        for label in story_manager.story_flow_list:
+            item_story_flow = story_manager.story_flow(label)
+            if item_story_flow['forward_relationship']:
+                edges.add((label, item_story_flow['forward_relationship'],
+                           item_story_flow['forward_label']))
+    return sorted(edges)
+
+
+def _get_batch_query(match_query, update_query):
+    """
+    Create a Cypher query that updates the matched entities in batches.
+
+    :param str match_query: the Cypher query returning the entities to update
+    :param str update_query: the Cypher query updating each entity
+    :return: the Cypher query
+    :rtype: str
+    """
+    return ('CALL apoc.periodic.iterate("{0}", "{1}", {{batchSize: {2}, parallel: false}}) '
+            'YIELD total, failedOperations RETURN total, failedOperations').format(
+        match_query, update_query, BATCH_SIZE)
+
+
+def _get_cypher_list(values):
+    """
+    Format strings as a Cypher list literal.
+
+    :param list values: the strings
+    :return: the Cypher list
+    :rtype: str
+    """
+    return '[{0}]'.format(', '.join("'{0}'".format(value) for value in values))
+
+
+def _get_wait_time_metric(label, relationship, next_label):
+    """
+    Get the Cypher clauses computing the wait times on the relationships between two artifacts.
+
+    :param str label: the label of the artifact
+    :param str relationship: the relationship to the next artifact as in the story flow
+    :param str next_label: the label of the next artifact
+    :return: a tuple of the MATCH clause, the variables of the matched nodes, the variables
+        returned to the update query and the update query
+    :rtype: tuple
+    """
+    if next_label.endswith('Advisory'):
+        # The advisory starts when the build is attached to it
+        start = ('CASE WHEN next_artifact.{0} IS NOT NULL THEN r.time_attached END'
+                 .format(TIMELINE_PROPERTIES[next_label]))
+    else:
+        start = 'next_artifact.{0}'.format(TIMELINE_PROPERTIES[next_label])
+
+    match = 'MATCH (artifact:{0}){1}(next_artifact:{2})'.format(
+        label, ContainerStoryManager.get_relationship_pattern(relationship, 'r'), next_label)
+    update = (
+        'WITH r, artifact.{completion} AS completion, {start} AS start '
+        'SET r.{prop} = CASE WHEN completion <= start THEN start - completion END'
+    ).format(completion=COMPLETION_PROPERTIES[label], start=start, prop=WAIT_TIME_PROPERTY)
+    return match, ('artifact', 'next_artifact'), 'artifact, r, next_artifact', update
+
+
+def _get_processing_time_metrics():
+    """
+    Get the Cypher clauses computing the processing times of the artifacts.
+
+    :return: a list of tuples like _get_wait_time_metric
+    :rtype: list
+    """
+    build_metric = (
+        'MATCH (build:KojiBuild)', ('build',), 'build',
+        'SET build.{0} = CASE WHEN build.creation_time <= build.completion_time '
+        'THEN build.completion_time - build.creation_time END'.format(PROCESSING_TIME_PROPERTY))
+    event_metric = (
+        'MATCH (event:FreshmakerEvent)', ('event',), 'event',
+        'SET event.{0} = CASE WHEN event.state_name IN {1} '
+        'AND event.time_created <= event.time_done '
+        'THEN event.time_done - event.time_created END'.format(
+            PROCESSING_TIME_PROPERTY, _get_cypher_list(FRESHMAKER_FINAL_STATES)))
+    advisory_metric = (
+        'MATCH (advisory:Advisory)-[r:ATTACHED]->(build:KojiBuild)', ('advisory', 'build'),
+        'advisory, r, build',
+        'WITH advisory, r, coalesce(r.time_attached, build.completion_time) AS start '
+        'SET r.{0} = CASE WHEN advisory.state IN {1} AND advisory.created_at IS NOT NULL '
+        'AND start <= advisory.status_time THEN advisory.status_time - start END'.format(
+            PROCESSING_TIME_PROPERTY, _get_cypher_list(ADVISORY_FINAL_STATES)))
+    return [build_metric, event_metric, advisory_metric]
+
+
+def _get_metrics():
+    """
+    Get the Cypher clauses computing all the story metrics.
+
+    :return: a list of tuples like _get_wait_time_metric
+    :rtype: list
+    """
+    return [_get_wait_time_metric(*edge) for edge in get_story_edges()] + \
+        _get_processing_time_metrics()
+
+
+def get_wait_time_query(label, relationship, next_label):
+    """
+    Create the Cypher query storing the wait times on the relationships between two artifacts.
+
+    The wait time is the time between the completion of an artifact and the start of the next
+    artifact in the story. The wait time is removed when it can't be computed, so that it's
+    computed when the story is requested.
+
+    :param str label: the label of the artifact
+    :param str relationship: the relationship to the next artifact as in the story flow
+    :param str next_label: the label of the next artifact
+    :return: the Cypher query
+    :rtype: str
+    """
+    match, _, returned, update = _get_wait_time_metric(label, relationship, next_label)
+    return _get_batch_query('{0} RETURN {1}'.format(match, returned), update)
+
+
+def get_processing_time_queries():
+    """
+    Create the Cypher queries storing the processing times of the artifacts.
+
+    The processing time of a build or a Freshmaker event is stored on its node. The processing
+    time of an advisory depends on the build that precedes it in the story, so it's stored on the
+    relationship between them. Only the processing times that don't depend on the current time are
+    stored.
+
+    :return: the Cypher queries
+    :rtype: list
+    """
+    return [_get_batch_query('{0} RETURN {1}'.format(match, returned), update)
+            for match, _, returned, update in _get_processing_time_metrics()]
+
+
+def get_node_metric_queries():
+    """
+    Create the Cypher queries storing the story metrics that depend on a set of nodes.
+
+    Each metric depends on the nodes it's stored on or between, so there is a query per metric
+    and per node it depends on. The queries take the internal IDs of the nodes as the node_ids
+    parameter.
+
+    :return: the Cypher queries
+    :rtype: list
+    """
+    queries = []
+    for match, variables, _, update in _get_metrics():
+        for variable in variables:
+            queries.append('{0} WHERE id({1}) IN {{node_ids}} {2} RETURN count(*)'.format(
+                match, variable, update))
+    return queries
+
+
+def precompute_story_metrics():
+    """
+    Compute the wait times and the processing times of all the stories and store them in Neo4j.
+
+    The scrapers only update the metrics of the nodes they changed, so this is only needed after
+    the nodes were changed by other means. The stories then only sum the stored values instead
+    of querying the relationships between their artifacts.
+
+    :return: the number of nodes and relationships processed
+    :rtype: int
+    """
+    queries = [get_wait_time_query(*edge) for edge in get_story_edges()]
+    queries += get_processing_time_queries()
+    total = 0
+    for query in queries:
+        results, _ = db.cypher_query(query)
+        processed, failed = results[0]
+        total += processed
+        if failed:
+            log.warning('Failed to precompute {0} story metrics with the query: {1}'.format(
+                failed, query))
+    log.info('Precomputed the story metrics of {0} nodes and relationships'.format(total))
+    return total
+
+
+def update_story_metrics(node_keys):
+    """
+    Recompute the story metrics of the changed nodes and of the relationships adjacent to them.
+
+    The wait times and the processing times only depend on the artifacts they're stored on or
+    between, so the rest of the graph keeps its stored values.
+
+    :param set node_keys: the keys of the changed nodes, as recorded by
+        estuary.utils.changelog.record_changed_nodes
+    :return: the number of nodes and relationships updated
+    :rtype: int
+    """
+    node_ids = get_node_ids(node_keys)
+    queries = get_node_metric_queries()
+    total = 0
+    for index in range(0, len(node_ids), BATCH_SIZE):
+        batch = node_ids[index:index + BATCH_SIZE]
+        for query in queries:
+            results, _ = db.cypher_query(query, {'node_ids': batch})
+            total += results[0][0]
+    log.info('Updated the story metrics of {0} nodes and relationships'.format(total))
+    return total
@@ -0,0 +1,329 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import abc
+from collections import namedtuple
+
+from estuary.utils.snapshot import get_graph_snapshot, hydrate_story_paths
+
+# A traversal of the story flow from a node. The sequence is the label of the node followed by the
+# relationship and the label of each next artifact in the story flow. When limit is set, only the
+# longest path is needed. When top_k is set, only the paths through the top_k most recent nodes
+# related to the node are expanded, which is used for hub nodes.
+Traversal = namedtuple('Traversal', ['node_id', 'sequence', 'limit', 'max_level', 'top_k'])
+
+
+def get_story_steps(traversal):
+    """
+    Get the relationships and the labels of the nodes to expand in a traversal.
+
+    :param Traversal traversal: the traversal
+    :return: tuples of the relationship and the label of the next node for each step, up to the
+        maximum level of the traversal
+    :rtype: list
+    """
+    sequence = traversal.sequence
+    steps = [(sequence[i], sequence[i + 1]) for i in range(1, len(sequence) - 1, 2)]
+    if traversal.max_level:
+        steps = steps[:int(traversal.max_level)]
+    return steps
+
+
+def get_degree_query(node_id, sequences):
+    """
+    Create the Cypher query of the number of nodes related to a node with the story flows.
+
+    The relationships are counted without matching the related nodes, so that Neo4j can use the
+    degree stored on the node instead of traversing the relationships.
+
+    :param int node_id: the Neo4j ID of the node
+    :param list sequences: the story flow sequences starting at the node
+    :return: the Cypher query of the degree of the first relationship of each sequence
+    :rtype: str
+    """
+    # Avoid circular imports
+    from estuary.utils.story import BaseStoryManager
+
+    degrees = []
+    for sequence in sequences:
+        if len(sequence) > 1:
+            degrees.append('size((node){0}())'.format(
+                BaseStoryManager.get_relationship_pattern(sequence[1])))
+        else:
+            degrees.append('0')
+    return 'MATCH (node) WHERE id(node) = {0} RETURN {1}'.format(node_id, ', '.join(degrees))
+
+
+class TraversalBackend(object):
+    """The interface of the engines that traverse the story flows of the artifacts."""
+
+    # The name of the backend in the STORY_TRAVERSAL_BACKEND configuration
+    name = None
+
+    @abc.abstractmethod
+    def get_degrees(self, node_id, sequences):
+        """
+        Get the number of nodes related to a node with the first relationship of story flows.
+
+        :param int node_id: the Neo4j ID of the node
+        :param list sequences: the story flow sequences starting at the node
+        :return: the degree for each sequence, or None if the backend can't traverse the graph
+            from this node
+        :rtype: list or None
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_story_paths(self, traversals):
+        """
+        Get the story paths of traversals.
+
+        :param list traversals: the Traversal tuples
+        :return: the results of each traversal like the results of the Cypher story queries, which
+            are lists of records with a neo4j.graph.Path from the longest path to the shortest; or
+            None if the backend can't compute the traversals
+        :rtype: list or None
+        """
+        pass
+
+
+class QueryBackend(TraversalBackend):
+    """A base class for the backends traversing the story flows with a Cypher query."""
+
+    def get_degrees(self, node_id, sequences):
+        """
+        Query Neo4j for the number of nodes related to a node with the story flows.
+
+        :param int node_id: the Neo4j ID of the node
+        :param list sequences: the story flow sequences starting at the node
+        :return: the degree for each sequence
+        :rtype: list
+        """
+        # Avoid circular imports
+        from estuary.utils.story import run_story_queries
+
+        return run_story_queries([get_degree_query(node_id, sequences)])[0][0]
+
+    def get_story_paths(self, traversals):
+        """
+        Query Neo4j for the story paths of traversals.
+
+        :param list traversals: the Traversal tuples
+        :return: the results of the story query of each traversal
+        :rtype: list
+        """
+        # Avoid circular imports
+        from estuary.utils.story import run_story_queries
+
+        # The traversals are independent, so they are queried concurrently
+        return run_story_queries([self.get_story_query(traversal) for traversal in traversals])
+
+    @abc.abstractmethod
+    def get_story_query(self, traversal):
+        """
+        Create the Cypher query of the story paths of a traversal.
+
+        :param Traversal traversal: the traversal
+        :return: the Cypher query or an empty string if there is no story in that direction
+        :rtype: str
+        """
+        pass
+
+
+class ApocBackend(QueryBackend):
+    """A backend traversing the story flows with ``apoc.path.expandConfig``."""
+
+    name = 'apoc'
+
+    def get_story_query(self, traversal):
+        """
+        Create the Cypher query of the story paths of a traversal with APOC.
+
+        :param Traversal traversal: the traversal
+        :return: the Cypher query or an empty string if there is no story in that direction
+        :rtype: str
+        """
+        # Avoid circular imports
+        from estuary.utils.story import TIMELINE_PROPERTIES, BaseStoryManager
+
+        sequence = traversal.sequence
+        if len(sequence) < 2:
+            return ''
+
+        # The sequences of APOC repeat, so they end with a relationship type that doesn't exist
+        if traversal.top_k:
+            # Expand the story from the most recent related nodes and prepend the artifact
+            expand_config = 'minLevel:0'
+            if traversal.max_level:
+                expand_config += ', maxLevel:{0}'.format(int(traversal.max_level) - 1)
+            query = (
+                'MATCH ({var}:{label}) WHERE id({var})= {node_id} '
+                'MATCH first_hop = ({var}){pattern}(next_node:{next_label}) '
+                'WITH first_hop, next_node '
+                'ORDER BY next_node.{timeline} DESC, id(next_node) DESC LIMIT {top_k} '
+                'CALL apoc.path.expandConfig(next_node, {{sequence:\'{sequence}, None, None\', '
+                '{config}}}) YIELD path '
+                'RETURN apoc.path.combine(first_hop, path) AS path '
+                'ORDER BY length(path) DESC'
+            ).format(
+                var=sequence[0].lower(), label=sequence[0], node_id=traversal.node_id,
+                pattern=BaseStoryManager.get_relationship_pattern(sequence[1]),
+                next_label=sequence[2], timeline=TIMELINE_PROPERTIES[sequence[2]],
+                top_k=int(traversal.top_k), sequence=', '.join(sequence[2:]),
+                config=expand_config)
+        else:
+            expand_config = 'minLevel:1'
+            if traversal.max_level:
+                expand_config += ', maxLevel:{0}'.format(int(traversal.max_level))
+            query = (
+                'MATCH ({var}:{label}) WHERE id({var})= {node_id} '
+                'CALL apoc.path.expandConfig({var}, {{sequence:\'{sequence}, None, None\', '
+                '{config}}}) YIELD path '
+                'RETURN path '
+                'ORDER BY length(path) DESC'
+            ).format(
+                var=sequence[0].lower(), label=sequence[0], node_id=traversal.node_id,
+                sequence=', '.join(sequence), config=expand_config)
+
+        if traversal.limit:
+            query += ' LIMIT 1'
+        return query
+
+
+class CypherBackend(QueryBackend):
+    """A backend traversing the story flows with a variable-length Cypher pattern."""
+
+    name = 'cypher'
+
+    def get_story_query(self, traversal):
+        """
+        Create the Cypher query of the story paths of a traversal without APOC.
+
+        The relationship types, directions and node labels of each step of the story flow are
+        checked on the paths matched by a variable-length pattern.
+
+        :param Traversal traversal: the traversal
+        :return: the Cypher query or an empty string if there is no story in that direction
+        :rtype: str
+        """
+        # Avoid circular imports
+        from estuary.utils.story import TIMELINE_PROPERTIES, BaseStoryManager
+
+        steps = get_story_steps(traversal)
+        if not steps:
+            return ''
+
+        sequence = traversal.sequence
+        query = 'MATCH (node:{0}) WHERE id(node) = {1} '.format(sequence[0], traversal.node_id)
+        condition = ''
+        if traversal.top_k:
+            # Only expand the story from the most recent related nodes
+            query += (
+                'MATCH (node){0}(next_node:{1}) WITH node, next_node '
+                'ORDER BY next_node.{2} DESC, id(next_node) DESC LIMIT {3} '
+            ).format(BaseStoryManager.get_relationship_pattern(sequence[1]), sequence[2],
+                     TIMELINE_PROPERTIES[sequence[2]], int(traversal.top_k))
+            condition = 'nodes(path)[1] = next_node AND '
+
+        query += (
+            'MATCH path = (node)-[:{rel_types}*1..{max_level}]-() '
+            'WHERE {condition}all(index IN range(0, length(path) - 1) WHERE '
+            'type(relationships(path)[index]) = [{types}][index] AND '
+            '(startNode(relationships(path)[index]) = nodes(path)[index]) = [{outgoing}][index] '
+            'AND [{labels}][index] IN labels(nodes(path)[index + 1])) '
+            'RETURN path '
+            'ORDER BY length(path) DESC'
+        ).format(
+            rel_types='|'.join(sorted(set(rel[:-1] for rel, _ in steps))), max_level=len(steps),
+            condition=condition,
+            types=', '.join('\'{0}\''.format(rel[:-1]) for rel, _ in steps),
+            outgoing=', '.join('true' if rel.endswith('>') else 'false' for rel, _ in steps),
+            labels=', '.join('\'{0}\''.format(label) for _, label in steps))
+
+        if traversal.limit:
+            query += ' LIMIT 1'
+        return query
+
+
+class SnapshotBackend(TraversalBackend):
+    """A backend traversing the story flows in the memory-mapped graph snapshot."""
+
+    name = 'snapshot'
+
+    def __init__(self, snapshot):
+        """
+        Initialize the backend.
+
+        :param GraphSnapshot snapshot: the graph snapshot
+        """
+        self.snapshot = snapshot
+
+    def get_degrees(self, node_id, sequences):
+        """
+        Count the nodes related to a node with the story flows in the graph snapshot.
+
+        :param int node_id: the Neo4j ID of the node
+        :param list sequences: the story flow sequences starting at the node
+        :return: the degree for each sequence, or None if the node is not in the snapshot
+        :rtype: list or None
+        """
+        if self.snapshot.get_index(node_id) is None:
+            return None
+        return [self.snapshot.get_degree(node_id, sequence[1], sequence[2])
+                if len(sequence) > 1 else 0 for sequence in sequences]
+
+    def get_story_paths(self, traversals):
+        """
+        Compute the longest story paths of traversals in the graph snapshot.
+
+        Neo4j is only queried for the properties of the nodes and relationships of the paths.
+
+        :param list traversals: the Traversal tuples
+        :return: the results of each traversal like the results of the Cypher story queries, or
+            None if not only the longest paths are needed, or if a node or its story changed
+            since the snapshot was created
+        :rtype: list or None
+        """
+        # Only the longest path of each traversal is computed in memory
+        if not all(traversal.limit for traversal in traversals):
+            return None
+
+        paths = []
+        for traversal in traversals:
+            path = self.snapshot.get_story_path(
+                traversal.node_id, traversal.sequence, max_level=traversal.max_level,
+                top_k=traversal.top_k)
+            if path is None:
+                return None
+            paths.append(path)
+        return hydrate_story_paths(paths)
+
+
+# The backends that can traverse all the stories, by their name
+QUERY_BACKENDS = {backend.name: backend for backend in (ApocBackend, CypherBackend)}
+
+
+def get_traversal_backends(config, limit=False):
+    """
+    Get the backends to traverse the story flows with, in the order they're tried.
+
+    :param flask.config.Config config: flask config
+    :kwarg bool limit: specifies if only the longest path of the stories is needed
+    :return: the graph snapshot backend when it's configured and only the longest paths are needed,
+        followed by the backend configured with STORY_TRAVERSAL_BACKEND
+    :rtype: list
+    :raises RuntimeError: if the configured backend doesn't exist
+    """
+    backends = []
+    if limit:
+        snapshot = get_graph_snapshot(config)
+        if snapshot is not None:
+            backends.append(SnapshotBackend(snapshot))
+
+    backend_cls = QUERY_BACKENDS.get(config['STORY_TRAVERSAL_BACKEND'])
+    if not backend_cls:
+        raise RuntimeError('The story traversal backend {0} could not be found'.format(
+            config['STORY_TRAVERSAL_BACKEND']))
+    backends.append(backend_cls())
+    return backends
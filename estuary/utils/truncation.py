@@ -0,0 +1,90 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import json
+
+from flask import g, has_request_context, request
+
+from estuary import log
+
+
+def count_serialized_nodes(serialized_node):
+    """
+    Count the nodes in a serialized node, including its serialized relationships.
+
+    :param dict serialized_node: the serialized node
+    :return: the number of nodes
+    :rtype: int
+    """
+    count = 1
+    for value in serialized_node.values():
+        if isinstance(value, dict):
+            count += 1
+        elif isinstance(value, list):
+            count += sum(1 for related_node in value if isinstance(related_node, dict))
+    return count
+
+
+class ResponseBudget(object):
+    """
+    Track the size of a response as it's built to enforce the configured limits.
+
+    The items are added one at a time before they're added to the response, so the response stops
+    growing as soon as a limit is reached instead of being truncated after it was built.
+    """
+
+    def __init__(self, config):
+        """
+        Initialize the ResponseBudget class.
+
+        :param flask.config.Config config: flask config
+        """
+        self.max_nodes = config['RESPONSE_MAX_NODES']
+        self.max_bytes = config['RESPONSE_MAX_BYTES']
+        self.nodes = 0
+        self.bytes = 0
+        self.items = 0
+        # The name of the limit that was reached, or None if the response is complete
+        self.exceeded = None
+
+    def add(self, item, nodes=1, size=None):
+        """
+        Account for an item if it fits in the response.
+
+        The first item is always accepted, so that a client continuing a truncated response
+        always makes progress.
+
+        :param item: the JSON serializable item
+        :kwarg int nodes: the number of nodes in the item
+        :kwarg int size: the number of bytes of the item serialized to JSON, which is measured
+            when it's not provided
+        :return: True if the item fits in the response, or False if a limit is reached and the
+            response must be truncated before the item
+        :rtype: bool
+        """
+        if self.exceeded:
+            return False
+
+        if not self.max_bytes:
+            size = 0
+        elif size is None:
+            size = len(json.dumps(item))
+        if self.items:
+            if self.max_nodes and self.nodes + nodes > self.max_nodes:
+                self.exceeded = 'nodes'
+            elif self.max_bytes and self.bytes + size > self.max_bytes:
+                self.exceeded = 'bytes'
+            if self.exceeded:
+                endpoint = request.endpoint if has_request_context() else None
+                log.warning('Truncated the response of %s after %d items since the %s limit was '
+                            'reached', endpoint, self.items, self.exceeded)
+                if has_request_context():
+                    # This is used to record the truncation in the metrics
+                    g.response_truncated = self.exceeded
+                return False
+
+        self.nodes += nodes
+        self.bytes += size
+        self.items += 1
+        return True
@@ -0,0 +1,246 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import bisect
+import sys
+import threading
+import time
+
+from neo4j import READ_ACCESS
+
+from estuary import log
+from estuary.utils.changelog import get_changelog_entries, get_latest_sequence
+from estuary.utils.database import get_driver
+
+# The labels of the indexed artifacts, by the label of their node keys in the changelog. The
+# container and module builds and the container advisories have the labels of their base types.
+TYPEAHEAD_LABELS = {
+    'kojibuild': 'KojiBuild',
+    'advisory': 'Advisory',
+    'bugzillabug': 'BugzillaBug',
+}
+# The base label of the resource type of each indexed artifact
+_BASE_LABELS = {
+    'Advisory': 'Advisory',
+    'BugzillaBug': 'BugzillaBug',
+    'ContainerAdvisory': 'Advisory',
+    'ContainerKojiBuild': 'KojiBuild',
+    'KojiBuild': 'KojiBuild',
+    'ModuleKojiBuild': 'KojiBuild',
+}
+# The columns of the indexed artifacts: the most specific resource type, the unique identifier and
+# the identifier that is searched, which is the NVR of the builds, the name of the advisories and
+# the ID of the bugs
+_RETURN_CLAUSE = (
+    'RETURN CASE WHEN node:ContainerKojiBuild THEN \'ContainerKojiBuild\' '
+    'WHEN node:ModuleKojiBuild THEN \'ModuleKojiBuild\' '
+    'WHEN node:ContainerAdvisory THEN \'ContainerAdvisory\' '
+    'ELSE {label} END AS resource_type, node.id AS uid, '
+    'CASE WHEN node:KojiBuild THEN node.name + \'-\' + node.version + \'-\' + node.release '
+    'WHEN node:Advisory THEN node.advisory_name ELSE node.id END AS identifier'
+)
+
+
+def get_typeahead_query(uids=None):
+    """
+    Create the Cypher query of the identifiers of the indexed artifacts.
+
+    :kwarg dict uids: the unique identifiers of the artifacts to get by their label, or None to
+        get all the artifacts
+    :return: the Cypher query and its parameters
+    :rtype: tuple
+    """
+    queries = []
+    params = {}
+    for label in sorted(TYPEAHEAD_LABELS.values()):
+        query = 'MATCH (node:{0}) '.format(label)
+        if uids is not None:
+            if not uids.get(label):
+                continue
+            query += 'WHERE node.id IN {{{0}_uids}} '.format(label.lower())
+            params['{0}_uids'.format(label.lower())] = sorted(uids[label])
+        queries.append(query + _RETURN_CLAUSE.format(label='\'{0}\''.format(label)))
+    return ' UNION ALL '.join(queries), params
+
+
+def _scan(uids=None):
+    """
+    Stream the entries of the indexed artifacts from Neo4j.
+
+    :kwarg dict uids: the unique identifiers of the artifacts to get by their label, or None to
+        get all the artifacts
+    :return: the entries, which are tuples of the lowercase identifier, the resource type, the
+        unique identifier and the identifier
+    :rtype: list
+    """
+    query, params = get_typeahead_query(uids)
+    if not query:
+        return []
+
+    entries = []
+    with get_driver().session(default_access_mode=READ_ACCESS) as session:
+        # The records are converted as they're received instead of all being loaded first
+        for resource_type, uid, identifier in session.run(query, params):
+            if identifier is not None:
+                entries.append((identifier.lower(), resource_type, uid, identifier))
+    return entries
+
+
+class TypeaheadIndex(object):
+    """A sorted in-memory index of the identifiers of the artifacts for prefix lookups."""
+
+    def __init__(self):
+        """Initialize the TypeaheadIndex class."""
+        # The sorted entries, which are replaced rather than modified so lookups don't need a lock
+        self._entries = []
+        # The sequence number of the last changelog entry applied to the index
+        self.sequence = None
+        self.memory_bytes = 0
+        self.last_refresh = 0
+
+    @property
+    def size(self):
+        """Get the number of artifacts in the index."""
+        return len(self._entries)
+
+    def _set_entries(self, entries):
+        """
+        Replace the entries of the index and measure its memory usage.
+
+        :param list entries: the sorted entries
+        """
+        # The strings of the resource types are shared by the entries, so they're not counted
+        self.memory_bytes = sys.getsizeof(entries) + sum(
+            sys.getsizeof(entry) + sys.getsizeof(entry[0]) + sys.getsizeof(entry[2])
+            + sys.getsizeof(entry[3]) for entry in entries)
+        self._entries = entries
+        self.last_refresh = time.time()
+
+    def build(self):
+        """Build the index from a scan of all the indexed artifacts."""
+        # The changes during the scan are applied by the next refresh
+        sequence = get_latest_sequence()
+        start = time.time()
+        entries = _scan()
+        entries.sort()
+        self._set_entries(entries)
+        self.sequence = sequence
+        log.info('Built the typeahead index of %d artifacts using %d bytes in %.1f seconds',
+                 len(entries), self.memory_bytes, time.time() - start)
+
+    def refresh(self):
+        """Update the artifacts changed by the scrapers since the index was built or refreshed."""
+        changelog_entries = get_changelog_entries(self.sequence)
+        if not changelog_entries:
+            self.last_refresh = time.time()
+            return
+
+        uids = {}
+        for _, node_keys in changelog_entries:
+            for node_key in node_keys:
+                resource, _, uid = node_key.partition(':')
+                if resource in TYPEAHEAD_LABELS:
+                    uids.setdefault(TYPEAHEAD_LABELS[resource], set()).add(uid)
+        changed = set((label, uid) for label, label_uids in uids.items() for uid in label_uids)
+        # The changed artifacts are replaced since their identifiers may have changed, such as
+        # the revision of an advisory name
+        entries = [entry for entry in self._entries
+                   if (_BASE_LABELS[entry[1]], entry[2]) not in changed]
+        entries += _scan(uids)
+        # The entries are mostly sorted, so this is close to linear
+        entries.sort()
+        self._set_entries(entries)
+        self.sequence = changelog_entries[-1][0]
+        log.info('Refreshed %d artifacts of the typeahead index', len(changed))
+
+    def lookup(self, prefix, limit):
+        """
+        Get the artifacts whose identifier starts with a prefix, ignoring the case.
+
+        :param str prefix: the prefix
+        :param int limit: the maximum number of artifacts to return
+        :return: the entries of the artifacts, sorted by their identifier
+        :rtype: list
+        """
+        entries = self._entries
+        prefix = prefix.lower()
+        results = []
+        for index in range(bisect.bisect_left(entries, (prefix,)), len(entries)):
+            if len(results) == limit or not entries[index][0].startswith(prefix):
+                break
+            results.append(entries[index])
+        return results
+
+
+# The typeahead index of this process. It's created on first use.
+_index = None
+_index_lock = threading.Lock()
+_update_thread = None
+
+
+def get_typeahead_stats():
+    """
+    Get the size and the memory usage of the typeahead index of this process.
+
+    :return: a dictionary with the number of artifacts and the number of bytes of the index
+    :rtype: dict
+    """
+    index = _index
+    if index is None:
+        return {'size': 0, 'memory_bytes': 0}
+    return {'size': index.size, 'memory_bytes': index.memory_bytes}
+
+
+def _update_in_background(index):
+    """
+    Build or refresh the typeahead index in a background thread of this process.
+
+    :param TypeaheadIndex index: the typeahead index
+    """
+    global _update_thread
+
+    if _update_thread and _update_thread.is_alive():
+        return
+
+    def _update():
+        try:
+            if index.sequence is None:
+                index.build()
+            else:
+                index.refresh()
+        except Exception:
+            log.exception('Failed to update the typeahead index')
+            # Don't retry a failed update on every request
+            index.last_refresh = time.time()
+
+    _update_thread = threading.Thread(target=_update, name='estuary-typeahead')
+    _update_thread.daemon = True
+    _update_thread.start()
+
+
+def get_typeahead_index(config):
+    """
+    Get the typeahead index of this process if it's enabled.
+
+    The index is built in the background on first use. When it's older than the refresh interval,
+    the changes recorded by the scrapers in the changelog are applied in the background, and the
+    current index is used in the meantime.
+
+    :param flask.config.Config config: flask config
+    :return: the typeahead index or None if it's disabled or not built yet
+    :rtype: TypeaheadIndex or None
+    """
+    global _index
+
+    if not config['TYPEAHEAD_ENABLED']:
+        return None
+
+    with _index_lock:
+        if _index is None:
+            _index = TypeaheadIndex()
+        if time.time() - _index.last_refresh >= config['TYPEAHEAD_REFRESH_INTERVAL']:
+            _update_in_background(_index)
+        if _index.sequence is None:
+            return None
+        return _index
@@ -162,16 +162,16 @@ class DistGitScraper(BaseScraper):
 
                 log.debug('Creating the relationships associated with commit ID {0}'
                           .format(result['commit_id']))
-                repo.commits.connect(commit)
+                repo.conditional_connect(repo.commits, commit)
 
                 commit.conditional_connect(commit.author, author)
 
                 if result['bugzilla_type'] == 'related':
-                    commit.related_bugs.connect(bug)
+                    commit.conditional_connect(commit.related_bugs, bug)
                 elif result['bugzilla_type'] == 'resolves':
-                    commit.resolved_bugs.connect(bug)
+                    commit.conditional_connect(commit.resolved_bugs, bug)
                 elif result['bugzilla_type'] == 'reverted':
-                    commit.reverted_bugs.connect(bug)
+                    commit.conditional_connect(commit.reverted_bugs, bug)
                 # This is no longer needed so it can be cleared to save RAM
                 del repo_info
         finally:
@@ -7,6 +7,7 @@ from estuary.models.bugzilla import BugzillaBug
 from estuary.models.errata import Advisory, ContainerAdvisory
 from estuary.models.koji import ContainerKojiBuild, KojiBuild
 from estuary.models.user import User
+from estuary.utils.changelog import record_changed_nodes
 from estuary.utils.general import timestamp_to_date
 from scrapers.base import BaseScraper
 
@@ -80,6 +81,8 @@ class ErrataScraper(BaseScraper):
                 # This relationship needs to be deleted if it exists.
                 if associated_build['removed_index_id']:
                     if build:
+                        # The build isn't related to the advisory anymore, so it changed too
+                        record_changed_nodes([build])
                         adv.attached_builds.disconnect(build)
                 else:
                     # Query Teiid and create the entry only if the build is not present in Neo4j
@@ -106,10 +109,13 @@ class ErrataScraper(BaseScraper):
 
                     attached_rel = adv.attached_builds.relationship(build)
                     time_attached = associated_build['time_attached']
+                    # The relationship has properties, so conditional_connect can't be used
                     if attached_rel:
                         if attached_rel.time_attached != time_attached:
+                            record_changed_nodes([adv, build])
                             adv.attached_builds.replace(build, {'time_attached': time_attached})
                     else:
+                        record_changed_nodes([adv, build])
                         adv.attached_builds.connect(build, {'time_attached': time_attached})
 
             assigned_to = User.get_or_create({'username': advisory['assigned_to'].split('@')[0]})[0]
@@ -119,7 +125,7 @@ class ErrataScraper(BaseScraper):
 
             for attached_bug in self.get_attached_bugs(advisory['id']):
                 bug = BugzillaBug.get_or_create(attached_bug)[0]
-                adv.attached_bugs.connect(bug)
+                adv.conditional_connect(adv.attached_bugs, bug)
 
     def get_advisories(self, since, until):
         """
@@ -108,7 +108,7 @@ class FreshmakerScraper(BaseScraper):
                     if build_dict['build_id']:
                         fb_params['build_id'] = build_dict['build_id']
                     fb = FreshmakerBuild.create_or_update(fb_params)[0]
-                    event.requested_builds.connect(fb)
+                    event.conditional_connect(event.requested_builds, fb)
 
                     # The build ID obtained from Freshmaker API is actually a Koji task ID
                     task_result = None
@@ -147,7 +147,7 @@ class FreshmakerScraper(BaseScraper):
                         build.add_label(ContainerKojiBuild.__label__)
                         build = ContainerKojiBuild.create_or_update(build_params)[0]
 
-                    event.successful_koji_builds.connect(build)
+                    event.conditional_connect(event.successful_koji_builds, build)
 
             if rv_json['meta'].get('next'):
                 fm_url = rv_json['meta']['next']
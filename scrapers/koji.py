@@ -247,7 +247,7 @@ class KojiScraper(BaseScraper):
                             module_component = KojiBuild.get_or_create(dict(
                                 id_=item['build_id']
                             ))[0]
-                            build.components.connect(module_component)
+                            build.conditional_connect(build.components, module_component)
 
                         component_builds = self.get_build_info(
                             [item['build_id'] for item in module_components])
@@ -0,0 +1,141 @@
+#! /usr/bin/env python
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import argparse
+import logging
+import os
+import random
+import string
+import sys
+import time
+
+# So we can import the estuary module
+sys.path.insert(1, os.path.abspath(os.path.join(sys.path[0], '..')))
+
+from neomodel import db  # noqa: E402
+
+from estuary.app import create_app  # noqa: E402
+from estuary.utils import search  # noqa: E402
+
+logging.basicConfig(format='[%(filename)s:%(lineno)s:%(funcName)s] %(message)s')
+log = logging.getLogger('estuary')
+log.setLevel(logging.INFO)
+
+parser = argparse.ArgumentParser(
+    description=('Measure the latency of the search API on a synthetic dataset of builds, '
+                 'advisories, bugs and commits. The dataset is created in the Neo4j database '
+                 'configured for the API, which must be empty, and it is deleted afterwards.'))
+parser.add_argument('--nodes', type=int, default=100000,
+                    help='The number of nodes of each label in the dataset')
+parser.add_argument('--queries', type=int, default=1000, help='The number of searches to run')
+parser.add_argument('--limit', type=int, default=10, help='The number of results of each search')
+parser.add_argument('--seed', type=int, default=0, help='The seed of the synthetic dataset')
+parser.add_argument('--keep', action='store_true',
+                    help='Keep the synthetic dataset in the database after the benchmark')
+args = parser.parse_args()
+
+rand = random.Random(args.seed)
+# The words of the synthetic names and descriptions
+words = [''.join(rand.choice(string.ascii_lowercase) for _ in range(rand.randint(3, 10)))
+         for _ in range(5000)]
+
+
+def get_words(count):
+    """
+    Get random words.
+
+    :param int count: the number of words
+    :return: the words separated by spaces
+    :rtype: str
+    """
+    return ' '.join(rand.choice(words) for _ in range(count))
+
+
+def create_synthetic_dataset():
+    """Create random searchable artifacts in Neo4j."""
+    labels = (
+        ('KojiBuild', lambda index: {
+            'id': str(index),
+            'name': '{0}-{1}'.format(rand.choice(words), rand.choice(words)),
+            'version': '{0}.{1}'.format(rand.randint(0, 9), rand.randint(0, 20)),
+            'release': '{0}.el{1}'.format(rand.randint(1, 30), rand.randint(6, 8)),
+        }),
+        ('Advisory', lambda index: {
+            'id': str(index),
+            'advisory_name': 'RH{0}-{1}:{2:05d}-{3:02d}'.format(
+                rand.choice('BES'), rand.randint(2010, 2020), index, rand.randint(1, 20)),
+            'synopsis': get_words(5),
+        }),
+        ('BugzillaBug', lambda index: {
+            'id': str(index),
+            'short_description': get_words(8),
+        }),
+        ('DistGitCommit', lambda index: {
+            'hash': '{0:040x}'.format(rand.getrandbits(160)),
+            'log_message': get_words(12),
+        }),
+    )
+    batch_size = 10000
+    for label, get_properties in labels:
+        for start in range(0, args.nodes, batch_size):
+            nodes = [get_properties(index)
+                     for index in range(start, min(start + batch_size, args.nodes))]
+            db.cypher_query(
+                'UNWIND {{nodes}} AS properties CREATE (node:{0}) SET node = properties'.format(
+                    label),
+                {'nodes': nodes})
+
+
+def get_percentile(timings, percentile):
+    """
+    Get a percentile of the timings.
+
+    :param list timings: the sorted timings
+    :param int percentile: the percentile to get
+    :return: the timing at that percentile
+    :rtype: float
+    """
+    return timings[min(len(timings) - 1, len(timings) * percentile // 100)]
+
+
+app = create_app()
+with app.app_context():
+    results, _ = db.cypher_query('MATCH (node) RETURN count(node)')
+    if results[0][0]:
+        log.error('The synthetic dataset can only be created in an empty database')
+        sys.exit(1)
+
+    try:
+        create_synthetic_dataset()
+        search.create_search_index()
+        # Wait for the index to be populated
+        db.cypher_query('CALL db.awaitIndexes(3600)')
+        log.info('Created a synthetic dataset of %d nodes', args.nodes * 4)
+
+        # Search the prefixes of one or two words, like a user typing
+        texts = []
+        for _ in range(args.queries):
+            text = get_words(rand.randint(1, 2))
+            texts.append(text[:rand.randint(2, len(text))])
+        # Warm up the page cache before measuring
+        for text in texts[:100]:
+            search.search_nodes(text, args.limit)
+
+        timings = []
+        total = 0
+        for text in texts:
+            start = time.time()
+            total += len(search.search_nodes(text, args.limit))
+            timings.append((time.time() - start) * 1000)
+        timings.sort()
+        log.info('%d searches with %.1f results on average: mean %.1f ms, p50 %.1f ms, '
+                 'p90 %.1f ms, p99 %.1f ms, max %.1f ms', len(timings), total / len(timings),
+                 sum(timings) / len(timings), get_percentile(timings, 50),
+                 get_percentile(timings, 90), get_percentile(timings, 99), timings[-1])
+    finally:
+        if not args.keep:
+            db.cypher_query(
+                'CALL apoc.periodic.iterate("MATCH (node) RETURN node", "DETACH DELETE node", '
+                '{batchSize: 10000})')
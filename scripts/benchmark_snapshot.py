@@ -0,0 +1,119 @@
+#! /usr/bin/env python
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+# So we can import the estuary module
+sys.path.insert(1, os.path.abspath(os.path.join(sys.path[0], '..')))
+
+from estuary.app import create_app  # noqa: E402
+from estuary.models.base import EstuaryStructuredNode  # noqa: E402
+from estuary.utils.database import run_read_queries  # noqa: E402
+from estuary.utils.general import inflate_node  # noqa: E402
+from estuary.utils.snapshot import build_graph_snapshot  # noqa: E402
+from estuary.utils.story import TIMELINE_PROPERTIES  # noqa: E402
+from estuary.utils.story import BaseStoryManager  # noqa: E402
+
+logging.basicConfig(format='[%(filename)s:%(lineno)s:%(funcName)s] %(message)s')
+log = logging.getLogger('estuary')
+log.setLevel(logging.INFO)
+
+parser = argparse.ArgumentParser(
+    description=('Compare the latency of the stories computed with APOC to the stories computed '
+                 'from a graph snapshot, using the most recent artifacts of each type. This uses '
+                 'the same configuration as the API.'))
+parser.add_argument('snapshot', help='The path of the graph snapshot file')
+parser.add_argument('--build', action='store_true',
+                    help='Build the graph snapshot even if the file already exists')
+parser.add_argument('--count', type=int, default=20,
+                    help='The number of recent artifacts of each type to get the story of')
+parser.add_argument('--repeat', type=int, default=3,
+                    help='The number of times the story of each artifact is computed')
+args = parser.parse_args()
+
+
+def get_story(item, config):
+    """
+    Get the longest story path of an artifact and the sibling counts of its nodes.
+
+    :param EstuaryStructuredNode item: the artifact
+    :param dict config: the API configuration
+    :return: the Neo4j IDs of the nodes in the story
+    :rtype: list
+    """
+    story_manager = BaseStoryManager.get_story_manager(item, config, limit=True)
+    results = []
+    for reverse, story in ((True, story_manager.backward_story),
+                           (False, story_manager.forward_story)):
+        if not story:
+            continue
+        nodes = list(story[0][0].nodes)
+        if reverse:
+            nodes = nodes[::-1]
+        path = story_manager.set_story_labels(
+            item.__label__, EstuaryStructuredNode.inflate_results([nodes])[0], reverse=reverse)
+        story_manager.get_sibling_nodes_count(path, reverse=reverse)
+        results += [node.id for node in path]
+    return results
+
+
+def get_percentile(timings, percentile):
+    """
+    Get a percentile of the timings.
+
+    :param list timings: the sorted timings
+    :param int percentile: the percentile to get
+    :return: the timing at that percentile
+    :rtype: float
+    """
+    return timings[min(len(timings) - 1, len(timings) * percentile // 100)]
+
+
+app = create_app()
+with app.app_context():
+    if args.build or not os.path.isfile(args.snapshot):
+        build_graph_snapshot(args.snapshot)
+
+    queries = [(
+        'MATCH (node:{0}) RETURN node ORDER BY node.{1} DESC LIMIT {2}'.format(
+            label, timeline_property, args.count),
+        None,
+    ) for label, timeline_property in sorted(TIMELINE_PROPERTIES.items())]
+    items = [inflate_node(result[0]) for results, _ in run_read_queries(queries)
+             for result in results]
+    if not items:
+        log.error('There are no artifacts to get the story of')
+        sys.exit(1)
+    log.info('Computing the stories of %d artifacts %d times', len(items), args.repeat)
+
+    stories = {}
+    for engine, path in (('apoc', None), ('snapshot', args.snapshot)):
+        config = dict(app.config)
+        config['GRAPH_SNAPSHOT_PATH'] = path
+        # Don't rebuild the snapshot during the benchmark
+        config['GRAPH_SNAPSHOT_REFRESH_INTERVAL'] = float('inf')
+        # Load the snapshot before measuring
+        get_story(items[0], config)
+        timings = []
+        for item in items:
+            for _ in range(args.repeat):
+                start = time.time()
+                stories[(engine, item.id)] = get_story(item, config)
+                timings.append((time.time() - start) * 1000)
+        timings.sort()
+        log.info('%s: mean %.1f ms, p50 %.1f ms, p90 %.1f ms, max %.1f ms', engine,
+                 sum(timings) / len(timings), get_percentile(timings, 50),
+                 get_percentile(timings, 90), timings[-1])
+
+    # The longest paths may differ when several paths are the longest, but not their length
+    different = [item.id for item in items
+                 if len(stories[('apoc', item.id)]) != len(stories[('snapshot', item.id)])]
+    if different:
+        log.error('The stories of the nodes with the IDs %s are different', different)
+        sys.exit(1)
@@ -0,0 +1,204 @@
+#! /usr/bin/env python
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import argparse
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# So we can import the estuary module
+sys.path.insert(1, os.path.abspath(os.path.join(sys.path[0], '..')))
+
+from neomodel import UniqueIdProperty, db  # noqa: E402
+
+from estuary.app import create_app  # noqa: E402
+from estuary.models import names_to_model  # noqa: E402
+from estuary.utils.database import run_read_queries  # noqa: E402
+from estuary.utils.general import inflate_node  # noqa: E402
+from estuary.utils.snapshot import build_graph_snapshot  # noqa: E402
+from estuary.utils.story import TIMELINE_PROPERTIES  # noqa: E402
+from estuary.utils.story import BaseStoryManager  # noqa: E402
+from estuary.utils.story_metrics import get_story_edges  # noqa: E402
+
+logging.basicConfig(format='[%(filename)s:%(lineno)s:%(funcName)s] %(message)s')
+log = logging.getLogger('estuary')
+log.setLevel(logging.INFO)
+
+parser = argparse.ArgumentParser(
+    description=('Run the same story workload through each story traversal backend on a '
+                 'synthetic graph, and check that they return the same stories. The graph is '
+                 'created in the Neo4j database configured for the API, which must be empty, and '
+                 'it is deleted afterwards.'))
+parser.add_argument('--nodes', type=int, default=1000,
+                    help='The number of nodes of each label in the story flows')
+parser.add_argument('--degree', type=int, default=3,
+                    help='The maximum number of next artifacts of each artifact')
+parser.add_argument('--hub-degree', type=int, default=1500,
+                    help='The number of next artifacts of the first artifact of each label')
+parser.add_argument('--count', type=int, default=20,
+                    help='The number of artifacts of each label to get the story of')
+parser.add_argument('--repeat', type=int, default=3,
+                    help='The number of times the story of each artifact is computed')
+parser.add_argument('--seed', type=int, default=0, help='The seed of the synthetic graph')
+parser.add_argument('--keep', action='store_true',
+                    help='Keep the synthetic graph in the database after the benchmark')
+args = parser.parse_args()
+
+BACKENDS = (
+    ('apoc', {'STORY_TRAVERSAL_BACKEND': 'apoc', 'GRAPH_SNAPSHOT_PATH': None}),
+    ('cypher', {'STORY_TRAVERSAL_BACKEND': 'cypher', 'GRAPH_SNAPSHOT_PATH': None}),
+    ('snapshot', {'STORY_TRAVERSAL_BACKEND': 'apoc', 'GRAPH_SNAPSHOT_PATH': True}),
+)
+
+
+def create_synthetic_graph():
+    """
+    Create a random graph following the story flows in Neo4j.
+
+    :return: the number of nodes and the number of relationships created, and the Neo4j IDs of the
+        hub nodes
+    :rtype: tuple
+    """
+    rand = random.Random(args.seed)
+    edges = get_story_edges()
+    node_ids = {}
+    for label in sorted(set(edge[0] for edge in edges) | set(edge[2] for edge in edges)):
+        model = names_to_model[label]
+        uid_property = [prop.db_property or name for name, prop in model.__all_properties__
+                        if isinstance(prop, UniqueIdProperty)][0]
+        nodes = [{
+            uid_property: '{0}-{1}'.format(label, index),
+            TIMELINE_PROPERTIES[label]: rand.uniform(1.5e9, 1.6e9),
+        } for index in range(args.nodes)]
+        results, _ = db.cypher_query(
+            'UNWIND {{nodes}} AS properties CREATE (node:{0}) SET node = properties '
+            'RETURN collect(id(node))'.format(':'.join(model.inherited_labels())),
+            {'nodes': nodes})
+        node_ids[label] = results[0][0]
+
+    total = 0
+    for label, relationship, next_label in edges:
+        pairs = []
+        for index, node_id in enumerate(node_ids[label]):
+            degree = args.hub_degree if index == 0 else rand.randint(0, args.degree)
+            for next_node_id in rand.sample(node_ids[next_label], min(degree, args.nodes)):
+                if relationship.endswith('<'):
+                    pairs.append([next_node_id, node_id])
+                else:
+                    pairs.append([node_id, next_node_id])
+        db.cypher_query(
+            'UNWIND {{pairs}} AS pair MATCH (start), (end) '
+            'WHERE id(start) = pair[0] AND id(end) = pair[1] CREATE (start)-[:{0}]->(end)'.format(
+                relationship[:-1]),
+            {'pairs': pairs})
+        total += len(pairs)
+    hub_ids = [ids[0] for ids in node_ids.values()]
+    return sum(len(ids) for ids in node_ids.values()), total, hub_ids
+
+
+def get_story(item, config, limit=True):
+    """
+    Get the story paths of an artifact.
+
+    :param EstuaryStructuredNode item: the artifact
+    :param dict config: the API configuration
+    :kwarg bool limit: specifies if only the longest story paths are computed
+    :return: the sorted tuples of the Neo4j IDs of the nodes of each backward and forward path
+    :rtype: list
+    """
+    story_manager = BaseStoryManager.get_story_manager(item, config, limit=limit)
+    return [sorted(tuple(node.id for node in record[0].nodes) for record in story or [])
+            for story in (story_manager.backward_story, story_manager.forward_story)]
+
+
+def get_percentile(timings, percentile):
+    """
+    Get a percentile of the timings.
+
+    :param list timings: the sorted timings
+    :param int percentile: the percentile to get
+    :return: the timing at that percentile
+    :rtype: float
+    """
+    return timings[min(len(timings) - 1, len(timings) * percentile // 100)]
+
+
+app = create_app()
+snapshot_dir = tempfile.mkdtemp()
+with app.app_context():
+    results, _ = db.cypher_query('MATCH (node) RETURN count(node)')
+    if results[0][0]:
+        log.error('The synthetic graph can only be created in an empty database')
+        sys.exit(1)
+
+    try:
+        node_count, relationship_count, hub_ids = create_synthetic_graph()
+        log.info('Created a synthetic graph of %d nodes and %d relationships', node_count,
+                 relationship_count)
+        snapshot_path = os.path.join(snapshot_dir, 'graph.snapshot')
+        build_graph_snapshot(snapshot_path)
+
+        queries = [(
+            'MATCH (node:{0}) RETURN node ORDER BY node.{1} DESC LIMIT {2}'.format(
+                label, timeline_property, args.count),
+            None,
+        ) for label, timeline_property in sorted(TIMELINE_PROPERTIES.items())]
+        items = [inflate_node(result[0]) for results, _ in run_read_queries(queries)
+                 for result in results]
+        # Include the hub nodes in the workload
+        item_ids = set(item.id for item in items)
+        results, _ = db.cypher_query(
+            'MATCH (node) WHERE id(node) IN {hub_ids} RETURN node', {'hub_ids': hub_ids})
+        items += [inflate_node(result[0]) for result in results if result[0].id not in item_ids]
+        log.info('Computing the stories of %d artifacts %d times', len(items), args.repeat)
+
+        stories = {}
+        for name, backend_config in BACKENDS:
+            config = dict(app.config)
+            config.update(backend_config)
+            if config['GRAPH_SNAPSHOT_PATH'] is True:
+                config['GRAPH_SNAPSHOT_PATH'] = snapshot_path
+            # Don't rebuild the snapshot during the benchmark
+            config['GRAPH_SNAPSHOT_REFRESH_INTERVAL'] = float('inf')
+            # Load the snapshot and warm up the page cache before measuring
+            for item in items:
+                get_story(item, config)
+            timings = []
+            for item in items:
+                for _ in range(args.repeat):
+                    start = time.time()
+                    stories[(name, item.id)] = get_story(item, config)
+                    timings.append((time.time() - start) * 1000)
+            timings.sort()
+            log.info('%s: mean %.1f ms, p50 %.1f ms, p90 %.1f ms, max %.1f ms', name,
+                     sum(timings) / len(timings), get_percentile(timings, 50),
+                     get_percentile(timings, 90), timings[-1])
+            if name != 'snapshot':
+                # The backends querying Neo4j can also return all the paths of the stories
+                for item in items:
+                    stories[(name, item.id, 'all')] = get_story(item, config, limit=False)
+
+        different = set()
+        for item in items:
+            # The longest paths may differ when several paths are the longest, but not their length
+            lengths = [[len(path) for paths in stories[(name, item.id)] for path in paths]
+                       for name, _ in BACKENDS]
+            if any(length != lengths[0] for length in lengths) or \
+                    stories[('apoc', item.id, 'all')] != stories[('cypher', item.id, 'all')]:
+                different.add(item.id)
+        if different:
+            log.error('The stories of the nodes with the IDs %s are different', sorted(different))
+            sys.exit(1)
+        log.info('The stories of every backend are the same')
+    finally:
+        shutil.rmtree(snapshot_dir)
+        if not args.keep:
+            db.cypher_query(
+                'CALL apoc.periodic.iterate("MATCH (node) RETURN node", "DETACH DELETE node", '
+                '{batchSize: 10000})')
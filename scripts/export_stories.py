@@ -0,0 +1,64 @@
+#! /usr/bin/env python
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import argparse
+import logging
+import os
+import sys
+from datetime import timedelta
+
+# So we can import the estuary module
+sys.path.insert(1, os.path.abspath(os.path.join(sys.path[0], '..')))
+
+from estuary.app import create_app  # noqa: E402
+from estuary.utils.export import EXPORT_FORMATS, export_stories  # noqa: E402
+from estuary.utils.general import timestamp_to_date  # noqa: E402
+from estuary.utils.story import TIMELINE_PROPERTIES  # noqa: E402
+
+logging.basicConfig(format='[%(filename)s:%(lineno)s:%(funcName)s] %(message)s')
+log = logging.getLogger('estuary')
+log.setLevel(logging.INFO)
+
+labels = {label.lower(): label for label in TIMELINE_PROPERTIES}
+parser = argparse.ArgumentParser(
+    description=('Export the stories of the artifacts created in a window to files, with a file '
+                 'per batch of stories in the "stories", "nodes" and "edges" directories. This '
+                 'uses the same configuration as the API.'))
+parser.add_argument('resource', choices=sorted(labels),
+                    help='The type of the artifacts to export the story of')
+parser.add_argument('output_dir', help='The directory to export the stories to')
+parser.add_argument('--since', required=True,
+                    help='Export the artifacts created starting from a UTC date formatted in '
+                         '"yyyy-mm-dd"')
+parser.add_argument('--until', required=True,
+                    help='Export the artifacts created until a UTC date formatted in "yyyy-mm-dd", '
+                         'inclusive')
+parser.add_argument('--format', choices=EXPORT_FORMATS, default='ndjson',
+                    help='The format of the files. Parquet requires pyarrow to be installed.')
+parser.add_argument('--workers', type=int, default=4,
+                    help='The number of processes computing the stories')
+parser.add_argument('--batch-size', type=int, default=1000,
+                    help='The number of stories in each file')
+parser.add_argument('--resume', action='store_true',
+                    help='Resume an interrupted export in the directory')
+args = parser.parse_args()
+
+try:
+    since = timestamp_to_date(args.since)
+    until = timestamp_to_date(args.until)
+except ValueError:
+    log.error('The dates must be formatted as "yyyy-mm-dd"')
+    sys.exit(1)
+
+with create_app().app_context():
+    try:
+        count = export_stories(
+            args.output_dir, labels[args.resource], since, until + timedelta(days=1),
+            export_format=args.format, workers=args.workers, batch_size=args.batch_size,
+            resume=args.resume)
+    except RuntimeError as error:
+        log.error(str(error))
+        sys.exit(1)
+log.info('Exported %d stories to %s', count, args.output_dir)
@@ -0,0 +1,29 @@
+#! /usr/bin/env python
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import argparse
+import logging
+import os
+import sys
+
+# So we can import the estuary module
+sys.path.insert(1, os.path.abspath(os.path.join(sys.path[0], '..')))
+
+from estuary.app import create_app  # noqa: E402
+from estuary.utils.story_metrics import precompute_story_metrics  # noqa: E402
+
+logging.basicConfig(format='[%(filename)s:%(lineno)s:%(funcName)s] %(message)s')
+log = logging.getLogger('estuary')
+log.setLevel(logging.INFO)
+
+parser = argparse.ArgumentParser(
+    description=('Recompute the wait times and the processing times stored for the stories of '
+                 'all the artifacts. The scrapers keep them up to date, so this is only needed '
+                 'after the nodes were changed by other means. This uses the same configuration '
+                 'as the API.'))
+parser.parse_args()
+
+with create_app().app_context():
+    precompute_story_metrics()
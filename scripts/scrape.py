@@ -12,6 +12,8 @@ from datetime import datetime, timedelta
 # So we can import the scrapers module
 sys.path.insert(1, os.path.abspath(os.path.join(sys.path[0], '..')))
 
+from estuary.utils import (changelog, degrees, search,  # noqa: E402
+                           story_metrics)
 from scrapers import all_scrapers  # noqa: E402
 
 logging.basicConfig(format='[%(filename)s:%(lineno)s:%(funcName)s] %(message)s')
@@ -62,6 +64,10 @@ if not scraper_classes:
     log.error(error)
     raise RuntimeError(error)
 
+# The changelog entries of the concurrent scraper runs are numbered by the same watermark node
+changelog.create_watermark_constraint()
+# The keys of the nodes changed by all the scrapers
+changed_node_keys = set()
 for scraper_class in scraper_classes:
     scraper = scraper_class(
         args.teiid_user, args.teiid_password, args.kerberos, args.neo4j_user, args.neo4j_password,
@@ -70,4 +76,16 @@ for scraper_class in scraper_classes:
     until = args.until
     if args.days_ago:
         since = (datetime.utcnow() - timedelta(days=args.days_ago)).strftime('%Y-%m-%d')
+    # Record the nodes changed by the scraper so that the API can notify the subscribed clients
+    changelog.start_recording()
     scraper.run(since=since, until=args.until)
+    node_keys = changelog.stop_recording()
+    # The counters are updated before the clients are notified of the changes
+    degrees.update_degree_counters(node_keys)
+    changelog.write_changelog(scraper_class.__name__[0:-7].lower(), node_keys)
+    changed_node_keys.update(node_keys)
+
+# The story metrics depend on the artifacts updated by the scrapers, so they're computed last
+story_metrics.update_story_metrics(changed_node_keys)
+# Neo4j keeps the search index up to date, so it's only created when it doesn't exist
+search.create_search_index()
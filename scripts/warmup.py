@@ -0,0 +1,37 @@
+#! /usr/bin/env python
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import argparse
+import logging
+import os
+import sys
+
+# So we can import the estuary module
+sys.path.insert(1, os.path.abspath(os.path.join(sys.path[0], '..')))
+
+from estuary.app import create_app  # noqa: E402
+from estuary.utils.cache import warm_up_response_cache  # noqa: E402
+
+logging.basicConfig(format='[%(filename)s:%(lineno)s:%(funcName)s] %(message)s')
+log = logging.getLogger('estuary')
+log.setLevel(logging.DEBUG)
+
+parser = argparse.ArgumentParser(
+    description=('Precompute the story and siblings responses of the most recently updated '
+                 'artifacts into the API response cache. This uses the same configuration as '
+                 'the API, so it should run on the same host after the scrapers.'))
+parser.add_argument('--count', type=int, default=5,
+                    help='The number of recent artifacts of each type to warm up')
+parser.add_argument('--workers', type=int, default=4,
+                    help='The maximum number of responses computed concurrently')
+args = parser.parse_args()
+
+app = create_app()
+# The requests are made internally, so they don't need a token
+app.config['ENABLE_AUTH'] = False
+cached, failed = warm_up_response_cache(app, count=args.count, workers=args.workers)
+log.info('Cached {0} responses, {1} failed'.format(cached, failed))
+if failed:
+    sys.exit(1)
@@ -21,6 +21,8 @@ setup(
         'six',
     ],
     extras_require={
+        'analytics': ['numpy'],
         'auth': ['flask_oidc', 'ldap3'],
+        'export': ['pyarrow'],
     }
 )
@@ -6,12 +6,14 @@ import json
 from datetime import datetime
 
 import pytest
+from mock import patch
 
 from estuary.models.bugzilla import BugzillaBug
 from estuary.models.distgit import DistGitCommit
 from estuary.models.errata import Advisory
 from estuary.models.freshmaker import FreshmakerEvent
 from estuary.models.koji import ContainerKojiBuild, KojiBuild
+from estuary.utils.general import encode_cursor
 
 
 @pytest.mark.parametrize('resource,uid,expected', [
@@ -888,7 +890,7 @@ def test_all_stories(client, resource, uid, expected):
 
     rv = client.get('/api/v1/allstories/{0}/{1}'.format(resource, uid))
     assert rv.status_code == 200
-    assert json.loads(rv.data.decode('utf-8')) == expected
+    assert json.loads(rv.data.decode('utf-8')) == {'data': expected, 'meta': {}}
 
 
 def test_get_stories_fallback(client):
@@ -989,4 +991,70 @@ def test_get_stories_fallback(client):
 
     rv = client.get('/api/v1/allstories/containerkojibuild/2345?fallback=kojibuild')
     assert rv.status_code == 200
-    assert json.loads(rv.data.decode('utf-8')) == expected
+    assert json.loads(rv.data.decode('utf-8')) == {'data': expected, 'meta': {}}
+
+
+def test_all_stories_truncated(client):
+    """Test that all the stories are truncated and continued with the cursor in the meta."""
+    build = KojiBuild.get_or_create({
+        'completion_time': datetime(2018, 6, 2, 10, 55, 47),
+        'creation_time': datetime(2018, 6, 2, 10, 36, 47),
+        'epoch': '0',
+        'id_': '2345',
+        'name': 'slf4j',
+        'release': '4.el7_4',
+        'start_time': datetime(2018, 6, 2, 10, 36, 47),
+        'state': 1,
+        'version': '1.7.4'
+    })[0]
+    hashes = [
+        '8a63adb248ba633e200067e1ad6dc61931727bad',
+        'f4dfc64c10a90492303e4f14ad3549a1a2b13575',
+        '0a0b8b9ae5bf15e63ae1cfd3c5b2e0bff70c3b7d',
+    ]
+    for index, hash_ in enumerate(hashes):
+        bug = BugzillaBug.get_or_create({
+            'creation_time': datetime(2017, 4, 2 + index, 19, 39, 6),
+            'id_': str(12345 + index),
+            'modified_time': datetime(2018, 2, 7, 19, 30, 47),
+        })[0]
+        commit = DistGitCommit.get_or_create({
+            'author_date': datetime(2017, 4, 26 + index, 11, 44, 38),
+            'commit_date': datetime(2018, 5, 2 + index, 10, 36, 47),
+            'hash_': hash_,
+        })[0]
+        commit.resolved_bugs.connect(bug)
+        commit.koji_builds.connect(build)
+
+    url = '/api/v1/allstories/kojibuild/2345'
+    # Every page only has one story since the first story of a page is always returned
+    with patch.dict(client.application.config, {'RESPONSE_MAX_NODES': 1}):
+        rv = client.get(url)
+        assert rv.status_code == 200
+        rv_json = json.loads(rv.data.decode('utf-8'))
+        assert [story['data'][1]['hash'] for story in rv_json['data']] == hashes[:1]
+        assert rv_json['meta'] == {'truncated': True, 'next_cursor': encode_cursor(1)}
+
+        rv = client.get('{0}?cursor={1}'.format(url, rv_json['meta']['next_cursor']))
+        assert rv.status_code == 200
+        rv_json = json.loads(rv.data.decode('utf-8'))
+        assert [story['data'][1]['hash'] for story in rv_json['data']] == hashes[1:2]
+        assert rv_json['meta'] == {'truncated': True, 'next_cursor': encode_cursor(2)}
+
+        rv = client.get('{0}?cursor={1}'.format(url, rv_json['meta']['next_cursor']))
+        assert rv.status_code == 200
+        rv_json = json.loads(rv.data.decode('utf-8'))
+        assert [story['data'][1]['hash'] for story in rv_json['data']] == hashes[2:]
+        assert rv_json['meta'] == {}
+        # The truncation is only set in the meta of the response
+        assert all('truncated' not in story['meta'] for story in rv_json['data'])
+
+
+def test_all_stories_not_found(client):
+    """Test that all the stories of an artifact that doesn't exist aren't found."""
+    rv = client.get('/api/v1/allstories/kojibuild/2345?fallback=containerkojibuild')
+    assert rv.status_code == 404
+    assert json.loads(rv.data.decode('utf-8')) == {
+        'message': 'This item does not exist',
+        'status': 404,
+    }
@@ -0,0 +1,116 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import json
+from datetime import datetime
+
+import pytest
+
+from estuary.models.bugzilla import BugzillaBug
+from estuary.models.distgit import DistGitCommit
+from estuary.models.errata import Advisory, ContainerAdvisory
+from estuary.models.freshmaker import FreshmakerEvent
+from estuary.models.koji import ContainerKojiBuild, KojiBuild
+
+pytest.importorskip('numpy')
+
+
+def test_get_container_story_metrics(client):
+    """Test that the metrics of the container stories are the same as in the story API."""
+    bug = BugzillaBug.get_or_create({
+        'creation_time': datetime(2017, 4, 1, 17, 41, 4),
+        'id_': '12345',
+    })[0]
+    commit = DistGitCommit.get_or_create({
+        'commit_date': datetime(2017, 4, 2, 10, 39, 6),
+        'hash_': '8a63adb248ba633e200067e1ad6dc61931727bad',
+    })[0]
+    build = KojiBuild.get_or_create({
+        'completion_time': datetime(2017, 4, 2, 19, 39, 6),
+        'creation_time': datetime(2017, 4, 2, 12, 39, 6),
+        'id_': '2345',
+        'name': 'slf4j',
+        'release': '4.el7_4',
+        'version': '1.7.4'
+    })[0]
+    advisory = Advisory.get_or_create({
+        'advisory_name': 'RHBA-2017:2251-02',
+        'created_at': datetime(2017, 4, 3, 14, 47, 23),
+        'id_': '27825',
+        'state': 'SHIPPED_LIVE',
+        'status_time': datetime(2017, 4, 10, 14, 47, 23),
+    })[0]
+    fm_event = FreshmakerEvent.get_or_create({
+        'id_': '1180',
+        'state_name': 'COMPLETE',
+        'time_created': datetime(2017, 4, 10, 15, 43, 51),
+        'time_done': datetime(2017, 4, 11, 5, 43, 51)
+    })[0]
+    cb = ContainerKojiBuild.get_or_create({
+        'completion_time': datetime(2017, 4, 11, 5, 43, 51),
+        'creation_time': datetime(2017, 4, 10, 17, 43, 51),
+        'id_': '710',
+        'name': 'slf4j_2',
+        'release': '4.el7_4_as',
+        'version': '1.7.4'
+    })[0]
+    containeradvisory = ContainerAdvisory.get_or_create({
+        'advisory_name': 'RHBA-2017:2251-03',
+        'created_at': datetime(2017, 4, 11, 7, 4, 51),
+        'id_': '12327',
+        'product_name': 'Red Hat Enterprise Linux',
+        'state': 'SHIPPED_LIVE',
+        'status_time': datetime(2017, 4, 20, 15, 43, 51),
+    })[0]
+    commit.resolved_bugs.connect(bug)
+    commit.koji_builds.connect(build)
+    advisory.attached_builds.connect(build, {'time_attached': datetime(2017, 4, 3, 15, 43, 51)})
+    fm_event.triggered_by_advisory.connect(advisory)
+    fm_event.successful_koji_builds.connect(cb)
+    containeradvisory.attached_builds.connect(
+        cb, {'time_attached': datetime(2017, 4, 12, 7, 4, 51)})
+    # A more recent Freshmaker event without an advisory doesn't end the story early, since the
+    # story is the longest path like in the story API
+    FreshmakerEvent.get_or_create({
+        'id_': '1181',
+        'state_name': 'COMPLETE',
+        'time_created': datetime(2017, 4, 10, 16, 43, 51),
+        'time_done': datetime(2017, 4, 11, 6, 43, 51)
+    })[0].successful_koji_builds.connect(cb)
+
+    rv = client.get('/api/v1/story/containeradvisory/12327')
+    story_meta = json.loads(rv.data.decode('utf-8'))['meta']
+    rv = client.get('/api/v1/analytics/container-stories?product=Red%20Hat%20Enterprise%20Linux'
+                    '&since=2017-04-11&until=2017-04-11')
+    assert rv.status_code == 200
+    rv_json = json.loads(rv.data.decode('utf-8'))
+    assert rv_json['meta'] == {
+        'product': 'Red Hat Enterprise Linux',
+        'since': '2017-04-11',
+        'until': '2017-04-11',
+        'stories': 1,
+    }
+    for name in ('lead_time', 'wait_time', 'processing_time'):
+        assert rv_json['data'][name]['count'] == 1
+        assert rv_json['data'][name]['p50'] == rv_json['data'][name]['p90'] == \
+            round(story_meta['total_{0}'.format(name)], 3)
+
+    rv = client.get('/api/v1/analytics/container-stories?product=Red%20Hat%20Enterprise%20Linux'
+                    '&since=2017-04-12')
+    assert json.loads(rv.data.decode('utf-8'))['meta']['stories'] == 0
+
+
+@pytest.mark.parametrize('query_string,error', [
+    ('since=2017-04-11', 'The product parameter must be set'),
+    ('product=RHEL', 'The since parameter must be set'),
+    ('product=RHEL&since=April', 'The since parameter must be a date formatted as "yyyy-mm-dd"'),
+    ('product=RHEL&since=2017-04-11&until=2017-04-10',
+     'The until parameter can\'t be before the since parameter'),
+    ('product=RHEL&since=2016-01-01&until=2017-01-01', 'The window can\'t be longer than 366 days'),
+])
+def test_get_container_story_metrics_invalid(client, query_string, error):
+    """Test that the invalid query parameters are rejected."""
+    rv = client.get('/api/v1/analytics/container-stories?{0}'.format(query_string))
+    assert rv.status_code == 400
+    assert json.loads(rv.data.decode('utf-8')) == {'message': error, 'status': 400}
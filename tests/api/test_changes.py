@@ -0,0 +1,64 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import json
+
+import pytest
+from mock import patch
+
+from estuary.models.koji import ContainerKojiBuild
+from estuary.utils.changelog import (start_recording, stop_recording,
+                                     write_changelog)
+
+
+@patch('estuary.utils.changelog._poller', None)
+def test_get_changes(client):
+    """Test that a client resuming the change stream is notified of the changes it missed."""
+    start_recording()
+    ContainerKojiBuild.get_or_create({'id_': '710', 'name': 'slf4j_2'})
+    assert write_changelog('koji', stop_recording()) == 1
+    assert write_changelog('errata', set(['advisory:27825'])) == 2
+
+    config = client.application.config
+    with patch.dict(config, {'CHANGELOG_POLL_INTERVAL': 0, 'CHANGE_STREAM_DURATION': 0}):
+        rv = client.get('/api/v1/changes?node=KojiBuild:710&node=kojibuild:711',
+                        headers={'Last-Event-ID': '0'})
+        assert rv.status_code == 200
+        assert rv.mimetype == 'text/event-stream'
+        assert rv.headers['Cache-Control'] == 'no-cache'
+        assert rv.data.decode('utf-8') == (
+            'retry: 0\n\nid: 1\nevent: changed\ndata: {0}\n\n'.format(json.dumps(
+                {'sequence': 1, 'nodes': ['kojibuild:710'], 'recents': False})))
+
+        rv = client.get('/api/v1/changes?recents=true', headers={'Last-Event-ID': '1'})
+        assert rv.status_code == 200
+        assert rv.data.decode('utf-8') == (
+            'retry: 0\n\nid: 2\nevent: changed\ndata: {0}\n\n'.format(json.dumps(
+                {'sequence': 2, 'nodes': [], 'recents': True})))
+
+        # Without the Last-Event-ID header, only the changes from now on are notified
+        rv = client.get('/api/v1/changes?node=advisory:27825')
+        assert rv.data.decode('utf-8') == 'retry: 0\n\n'
+
+
+@pytest.mark.parametrize('query_string,headers,error', [
+    ('', {}, 'At least one node or the recents must be subscribed to'),
+    ('?recents=false', {}, 'At least one node or the recents must be subscribed to'),
+    ('?node=kojibuild', {}, 'The node parameter must be in the format of "<resource>:<uid>"'),
+    ('?recents=true', {'Last-Event-ID': 'last'}, 'The Last-Event-ID header must be an integer'),
+])
+def test_get_changes_invalid(client, query_string, headers, error):
+    """Test that an invalid subscription to the change stream is rejected."""
+    rv = client.get('/api/v1/changes{0}'.format(query_string), headers=headers)
+    assert rv.status_code == 400
+    assert json.loads(rv.data.decode('utf-8')) == {'message': error, 'status': 400}
+
+
+@patch('estuary.utils.changelog._open_streams', 0)
+def test_get_changes_too_many_streams(client):
+    """Test that a change stream is rejected when too many streams are open."""
+    with patch.dict(client.application.config, {'CHANGE_STREAM_MAX_STREAMS': 0}):
+        rv = client.get('/api/v1/changes?recents=true')
+    assert rv.status_code == 503
+    assert rv.headers['Retry-After'] == '5'
@@ -108,3 +108,27 @@ def test_get_on_model_wo_uid(client, resource):
                    'freshmakerevent, freshmakerbuild, kojibuild, modulekojibuild, and '
                    'user.'.format(resource))
     assert json.loads(rv.data.decode('utf-8')) == {'message': invalid_msg, 'status': 400}
+
+
+def test_get_resource_fields(client):
+    """Test that the fields are only selected on the requested node and not on its relationships."""
+    advisory = Advisory.get_or_create({
+        'id_': '27825',
+        'advisory_name': 'RHBA-2017:2251-02',
+        'product_name': 'Red Hat Enterprise Linux',
+    })[0]
+    build = KojiBuild.get_or_create({
+        'id_': '2345',
+        'name': 'slf4j',
+        'release': '4.el7_4',
+        'version': '1.7.4',
+    })[0]
+    advisory.attached_builds.connect(build)
+
+    rv = client.get('/api/v1/advisory/27825?fields=id,attached_builds')
+    assert rv.status_code == 200
+    assert json.loads(rv.data.decode('utf-8')) == {
+        'attached_builds': [build.serialized],
+        'id': '27825',
+        'resource_type': 'Advisory',
+    }
@@ -3,6 +3,7 @@
 from __future__ import unicode_literals
 
 from mock import patch
+from neo4j.exceptions import ClientError
 
 
 def test_healthcheck(client):
@@ -20,3 +21,14 @@ def test_healthcheck_failure(client):
     assert rv.status_code == 503
     assert rv.data.decode('utf-8') == \
         'The health check failed while verifying the database connection'
+
+
+def test_healthcheck_pool_exhausted(client):
+    """Test the health check endpoint reports an exhausted connection pool separately."""
+    with patch('estuary.api.health_check.db') as mock_db:
+        mock_db.cypher_query.side_effect = ClientError(
+            'Failed to obtain a connection from pool within 60s')
+        rv = client.get('/healthcheck')
+    assert rv.status_code == 503
+    assert rv.data.decode('utf-8') == \
+        'The health check failed because the database connection pool is exhausted'
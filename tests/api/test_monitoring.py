@@ -23,3 +23,13 @@ def test_monitoring(client):
     expected = ('request_latency_seconds_sum{app_name="estuary-api",endpoint="/api/v1/story/'
                 'containeradvisory/123123123",query_string="fallback=advisory"}')
     assert expected in rv_data
+
+
+def test_monitoring_pool_metrics(client):
+    """Test the Neo4j connection pool metrics are exported."""
+    rv = client.get('/monitoring/metrics')
+    assert rv.status_code == 200
+    rv_data = rv.data.decode('utf-8')
+    assert 'neo4j_pool_connections{state="in_use"}' in rv_data
+    assert 'neo4j_pool_connections{state="idle"}' in rv_data
+    assert 'neo4j_pool_max_size 100.0' in rv_data
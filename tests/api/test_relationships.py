@@ -6,6 +6,7 @@ import json
 from datetime import datetime
 
 import pytest
+from mock import patch
 
 from estuary.models.freshmaker import FreshmakerEvent
 from estuary.models.koji import ContainerKojiBuild
@@ -106,7 +107,10 @@ from estuary.models.koji import ContainerKojiBuild
             }
         ],
         'meta': {
-            'description': 'successful koji builds of Freshmaker event 1180'
+            'description': 'successful koji builds of Freshmaker event 1180',
+            'limit': 100,
+            'next_cursor': None,
+            'total': 3
         }
     })
 ])
@@ -197,3 +201,100 @@ def test_one_to_many_node_relationships_failed(client):
     rv = client.get('/api/v1/relationships/freshmakerevent/1180/some_non-existent_relationship')
     assert rv.status_code == 400
     assert json.loads(rv.data.decode('utf-8')) == expected
+
+
+def _create_freshmaker_event_with_builds():
+    """Create a Freshmaker event with three successful Koji builds."""
+    fm_event = FreshmakerEvent.get_or_create({
+        'id_': '1180',
+        'state_name': 'COMPLETE',
+        'time_created': datetime(2019, 8, 21, 13, 42, 20)
+    })[0]
+    for build_id, day in (('710', 3), ('811', 1), ('2011', 2)):
+        build = ContainerKojiBuild.get_or_create({
+            'completion_time': datetime(2018, 4, day, 19, 39, 6),
+            'epoch': '0',
+            'id_': build_id,
+            'name': 'build_{0}'.format(build_id),
+            'release': '1',
+            'version': '1.0'
+        })[0]
+        fm_event.successful_koji_builds.connect(build)
+
+
+def test_relationships_pagination(client):
+    """Tests paginating the one-to-many relationships of an artifact with a cursor."""
+    _create_freshmaker_event_with_builds()
+
+    url = '/api/v1/relationships/freshmakerevent/1180/successful_koji_builds'
+    rv = client.get(url + '?limit=2&order_by=-completion_time&shallow=true')
+    assert rv.status_code == 200
+    rv_json = json.loads(rv.data.decode('utf-8'))
+    assert [build['id'] for build in rv_json['data']] == ['710', '2011']
+    # Shallow nodes don't include the relationships
+    assert 'triggered_by_freshmaker_event' not in rv_json['data'][0]
+    assert rv_json['data'][0]['display_name'] == 'build_710-1.0-1'
+    assert rv_json['meta']['total'] == 3
+    assert rv_json['meta']['next_cursor']
+
+    rv = client.get(url + '?limit=2&order_by=-completion_time&shallow=true&cursor={0}'.format(
+        rv_json['meta']['next_cursor']))
+    assert rv.status_code == 200
+    rv_json = json.loads(rv.data.decode('utf-8'))
+    assert [build['id'] for build in rv_json['data']] == ['811']
+    assert rv_json['meta']['total'] == 3
+    assert rv_json['meta']['next_cursor'] is None
+
+
+def test_relationships_truncated(client):
+    """Tests that the relationships are truncated when the response reaches the node limit."""
+    _create_freshmaker_event_with_builds()
+
+    url = '/api/v1/relationships/freshmakerevent/1180/successful_koji_builds'
+    with patch.dict(client.application.config, {'RESPONSE_MAX_NODES': 2}):
+        rv = client.get(url + '?order_by=-completion_time&shallow=true')
+        assert rv.status_code == 200
+        rv_json = json.loads(rv.data.decode('utf-8'))
+        assert [build['id'] for build in rv_json['data']] == ['710', '2011']
+        assert rv_json['meta']['truncated'] is True
+        assert rv_json['meta']['total'] == 3
+
+        rv = client.get(url + '?order_by=-completion_time&shallow=true&cursor={0}'.format(
+            rv_json['meta']['next_cursor']))
+        rv_json = json.loads(rv.data.decode('utf-8'))
+        assert [build['id'] for build in rv_json['data']] == ['811']
+        assert 'truncated' not in rv_json['meta']
+        assert rv_json['meta']['next_cursor'] is None
+
+
+@pytest.mark.parametrize('query_string,error', [
+    ('limit=0', 'The limit parameter must be an integer between 1 and 1000'),
+    ('limit=abc', 'The limit parameter must be an integer between 1 and 1000'),
+    ('cursor=abc', 'The cursor parameter is invalid'),
+    ('order_by=not_a_property', (
+        'The order_by parameter must be one of the following properties: completion_time, '
+        'creation_time, epoch, id, name, operator, original_nvr, release, start_time, state, '
+        'version')),
+])
+def test_relationships_pagination_invalid(client, query_string, error):
+    """Tests paginating the one-to-many relationships of an artifact with invalid parameters."""
+    _create_freshmaker_event_with_builds()
+
+    rv = client.get('/api/v1/relationships/freshmakerevent/1180/successful_koji_builds?{0}'
+                    .format(query_string))
+    assert rv.status_code == 400
+    assert json.loads(rv.data.decode('utf-8')) == {'message': error, 'status': 400}
+
+
+def test_relationships_fields(client):
+    """Tests getting only the requested fields of the one-to-many relationships of an artifact."""
+    _create_freshmaker_event_with_builds()
+
+    rv = client.get('/api/v1/relationships/freshmakerevent/1180/successful_koji_builds'
+                    '?order_by=id&fields=id,display_name')
+    assert rv.status_code == 200
+    assert json.loads(rv.data.decode('utf-8'))['data'] == [
+        {'display_name': 'build_2011-1.0-1', 'id': '2011', 'resource_type': 'ContainerKojiBuild'},
+        {'display_name': 'build_710-1.0-1', 'id': '710', 'resource_type': 'ContainerKojiBuild'},
+        {'display_name': 'build_811-1.0-1', 'id': '811', 'resource_type': 'ContainerKojiBuild'},
+    ]
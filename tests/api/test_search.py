@@ -0,0 +1,70 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import json
+
+import pytest
+
+from estuary.models.bugzilla import BugzillaBug
+from estuary.models.errata import Advisory
+from estuary.models.koji import ContainerKojiBuild, KojiBuild
+from estuary.utils.search import create_search_index
+
+
+def test_search(client):
+    """Test that the artifacts are searched by the prefixes of their names and descriptions."""
+    create_search_index()
+    KojiBuild.get_or_create({
+        'id_': '2345',
+        'name': 'slf4j',
+        'release': '4.el7_4',
+        'version': '1.7.4'
+    })
+    ContainerKojiBuild.get_or_create({
+        'id_': '710',
+        'name': 'slf4j-container',
+        'release': '1',
+        'version': '1.7.4'
+    })
+    Advisory.get_or_create({
+        'advisory_name': 'RHBA-2017:2251-02',
+        'id_': '27825',
+        'synopsis': 'slf4j bug fix update'
+    })
+    BugzillaBug.get_or_create({
+        'id_': '12345',
+        'short_description': 'Crash when logging with SLF4J'
+    })
+
+    rv = client.get('/api/v1/search?q=slf4j-cont')
+    assert rv.status_code == 200
+    rv_json = json.loads(rv.data.decode('utf-8'))
+    assert [(node['resource_type'], node['id']) for node in rv_json['data']] == [
+        ('ContainerKojiBuild', '710')]
+    assert rv_json['meta'] == {'limit': 10, 'query': 'slf4j-cont'}
+
+    rv = client.get('/api/v1/search?q=SLF')
+    resource_types = set(node['resource_type'] for node in json.loads(
+        rv.data.decode('utf-8'))['data'])
+    assert resource_types == set(['KojiBuild', 'ContainerKojiBuild', 'Advisory', 'BugzillaBug'])
+
+    rv = client.get('/api/v1/search?q=RHBA-2017:22&limit=1')
+    rv_json = json.loads(rv.data.decode('utf-8'))
+    assert [node['advisory_name'] for node in rv_json['data']] == ['RHBA-2017:2251-02']
+
+    rv = client.get('/api/v1/search?q=errata')
+    assert json.loads(rv.data.decode('utf-8'))['data'] == []
+
+
+@pytest.mark.parametrize('query_string,error', [
+    ('', 'The q parameter must be set'),
+    ('q=%20', 'The q parameter must be set'),
+    ('q=slf4j&limit=0', 'The limit parameter must be an integer between 1 and 50'),
+    ('q=slf4j&limit=51', 'The limit parameter must be an integer between 1 and 50'),
+])
+def test_search_invalid(client, query_string, error):
+    """Test that the invalid query parameters are rejected."""
+    rv = client.get('/api/v1/search?{0}'.format(query_string))
+    assert rv.status_code == 400
+    assert json.loads(rv.data.decode('utf-8')) == {'message': error, 'status': 400}
@@ -6,6 +6,7 @@ import json
 from datetime import datetime
 
 import pytest
+from mock import patch
 
 from estuary.models.bugzilla import BugzillaBug
 from estuary.models.distgit import DistGitCommit
@@ -100,7 +101,10 @@ from estuary.models.koji import ContainerKojiBuild, KojiBuild, ModuleKojiBuild
             }
         ],
         'meta': {
-            'description': 'Builds attached to RHBA-2017:2251-02'
+            'description': 'Builds attached to RHBA-2017:2251-02',
+            'limit': 100,
+            'next_cursor': None,
+            'total': 2
         }
     }),
     ('freshmakerevent', '1180', True, {
@@ -164,7 +168,10 @@ from estuary.models.koji import ContainerKojiBuild, KojiBuild, ModuleKojiBuild
             }
         ],
         'meta': {
-            'description': 'Advisories that triggered Freshmaker event 1180'
+            'description': 'Advisories that triggered Freshmaker event 1180',
+            'limit': 100,
+            'next_cursor': None,
+            'total': 1
         }
     }),
     ('containeradvisory', '12327', True, {
@@ -259,7 +266,10 @@ from estuary.models.koji import ContainerKojiBuild, KojiBuild, ModuleKojiBuild
             }
         ],
         'meta': {
-            'description': 'Container builds attached to RHBA-2017:2251-03'
+            'description': 'Container builds attached to RHBA-2017:2251-03',
+            'limit': 100,
+            'next_cursor': None,
+            'total': 2
         }
     }),
     ('containerkojibuild', '710', False, {
@@ -319,7 +329,10 @@ from estuary.models.koji import ContainerKojiBuild, KojiBuild, ModuleKojiBuild
             }
         ],
         'meta': {
-            'description': 'Container advisories that contain slf4j_2-1.7.4-4.el7_4_as'
+            'description': 'Container advisories that contain slf4j_2-1.7.4-4.el7_4_as',
+            'limit': 100,
+            'next_cursor': None,
+            'total': 1
         }
     })
 ])
@@ -515,7 +528,10 @@ def test_node_siblings(client, resource, uid, backward_rel, expected):
             }
         ],
         'meta':{
-            'description': 'Module builds attached to RHBA-2017:2251-02'
+            'description': 'Module builds attached to RHBA-2017:2251-02',
+            'limit': 100,
+            'next_cursor': None,
+            'total': 1
         }
     }),
     ('containeradvisory', '12327', True, {
@@ -610,7 +626,10 @@ def test_node_siblings(client, resource, uid, backward_rel, expected):
             }
         ],
         'meta': {
-            'description': 'Container builds attached to RHBA-2017:2251-03'
+            'description': 'Container builds attached to RHBA-2017:2251-03',
+            'limit': 100,
+            'next_cursor': None,
+            'total': 2
         }
     })
 ])
@@ -824,3 +843,87 @@ def test_story_path_flag_invalid(client):
     rv = client.get('/api/v1/siblings/advisory/12327?story_type=random')
     assert rv.status_code == 400
     assert json.loads(rv.data.decode('utf-8')) == expected
+
+
+def test_siblings_pagination(client):
+    """Tests paginating the siblings sorted by their timeline property with a cursor."""
+    advisory = Advisory.get_or_create({
+        'advisory_name': 'RHBA-2017:2251-02',
+        'created_at': datetime(2017, 4, 3, 14, 47, 23),
+        'id_': '27825',
+    })[0]
+    for build_id, day in (('2345', 2), ('3456', 1), ('4567', 3)):
+        build = KojiBuild.get_or_create({
+            'creation_time': datetime(2017, 4, day, 19, 39, 6),
+            'epoch': '0',
+            'id_': build_id,
+            'name': 'slf4j',
+            'release': '4.el7_4',
+            'version': build_id
+        })[0]
+        build.advisories.connect(advisory)
+
+    url = '/api/v1/siblings/advisory/27825?backward_rel=true&shallow=true&order=asc&limit=2'
+    rv = client.get(url)
+    assert rv.status_code == 200
+    rv_json = json.loads(rv.data.decode('utf-8'))
+    assert [build['id'] for build in rv_json['data']] == ['3456', '2345']
+    # Shallow nodes don't include the relationships
+    assert 'advisories' not in rv_json['data'][0]
+    assert rv_json['meta']['total'] == 3
+    assert rv_json['meta']['next_cursor']
+
+    rv = client.get('{0}&cursor={1}'.format(url, rv_json['meta']['next_cursor']))
+    assert rv.status_code == 200
+    rv_json = json.loads(rv.data.decode('utf-8'))
+    assert [build['id'] for build in rv_json['data']] == ['4567']
+    assert rv_json['meta']['next_cursor'] is None
+
+
+def test_siblings_hub(client):
+    """Tests that only the most recent siblings of a hub node are returned."""
+    advisory = Advisory.get_or_create({
+        'advisory_name': 'RHBA-2017:2251-02',
+        'created_at': datetime(2017, 4, 3, 14, 47, 23),
+        'id_': '27825',
+    })[0]
+    for build_id, day in (('2345', 2), ('3456', 1), ('4567', 3)):
+        build = KojiBuild.get_or_create({
+            'creation_time': datetime(2017, 4, day, 19, 39, 6),
+            'id_': build_id,
+            'name': 'slf4j',
+            'release': '4.el7_4',
+            'version': build_id
+        })[0]
+        build.advisories.connect(advisory)
+
+    url = '/api/v1/siblings/advisory/27825?backward_rel=true&shallow=true&order=asc'
+    with patch.dict(client.application.config, {'HUB_DEGREE_THRESHOLD': 2, 'HUB_TOP_K': 2}):
+        rv = client.get(url)
+    assert rv.status_code == 200
+    rv_json = json.loads(rv.data.decode('utf-8'))
+    assert [build['id'] for build in rv_json['data']] == ['2345', '4567']
+    # The total is the number of all the siblings
+    assert rv_json['meta']['total'] == 3
+    assert rv_json['meta']['partial'] is True
+
+    rv = client.get(url)
+    rv_json = json.loads(rv.data.decode('utf-8'))
+    assert [build['id'] for build in rv_json['data']] == ['3456', '2345', '4567']
+    assert 'partial' not in rv_json['meta']
+
+
+def test_siblings_order_invalid(client):
+    """Tests getting the siblings with an invalid sort order."""
+    Advisory.get_or_create({
+        'advisory_name': 'RHBA-2017:2251-02',
+        'created_at': datetime(2017, 4, 3, 14, 47, 23),
+        'id_': '27825',
+    })
+
+    rv = client.get('/api/v1/siblings/advisory/27825?backward_rel=true&order=random')
+    assert rv.status_code == 400
+    assert json.loads(rv.data.decode('utf-8')) == {
+        'message': 'The order parameter must be "asc" or "desc"',
+        'status': 400
+    }
@@ -6,14 +6,18 @@ import json
 from datetime import datetime
 
 import pytest
+from mock import patch
+from neo4j.exceptions import Neo4jError
 from six.moves import urllib
 
+from estuary.error import QUERY_TIMEOUT_ERROR_CODES
 from estuary.models.bugzilla import BugzillaBug
 from estuary.models.distgit import DistGitCommit, DistGitRepo
 from estuary.models.errata import Advisory, ContainerAdvisory
 from estuary.models.freshmaker import FreshmakerBuild, FreshmakerEvent
 from estuary.models.koji import ContainerKojiBuild, KojiBuild, ModuleKojiBuild
 from estuary.models.user import User
+from estuary.utils.snapshot import build_graph_snapshot
 
 
 @pytest.mark.parametrize('resource,uids,expected', [
@@ -1774,6 +1778,237 @@ def test_get_story_partial_story(client):
     assert json.loads(rv.data.decode('utf-8')) == expected
 
 
+def test_get_story_window(client):
+    """Test getting a window of the story around the requested resource."""
+    advisory = Advisory.get_or_create({
+        'advisory_name': 'RHBA-2017:2251-02',
+        'created_at': datetime(2017, 4, 3, 14, 47, 23),
+        'id_': '27825',
+    })[0]
+    build = KojiBuild.get_or_create({
+        'completion_time': datetime(2017, 4, 2, 19, 39, 6),
+        'creation_time': datetime(2017, 4, 2, 19, 39, 6),
+        'id_': '2345',
+        'name': 'slf4j',
+        'release': '4.el7_4',
+        'version': '1.7.4'
+    })[0]
+    commit = DistGitCommit.get_or_create({
+        'commit_date': datetime(2017, 4, 2, 19, 39, 6),
+        'hash_': '8a63adb248ba633e200067e1ad6dc61931727bad',
+    })[0]
+    bug = BugzillaBug.get_or_create({
+        'creation_time': datetime(2017, 4, 1, 17, 41, 4),
+        'id_': '12345',
+        'modified_time': datetime(2018, 2, 7, 19, 30, 47),
+    })[0]
+    build.advisories.connect(advisory)
+    build.commit.connect(commit)
+    commit.resolved_bugs.connect(bug)
+
+    rv = client.get('/api/v1/story/kojibuild/2345?window=1')
+    assert rv.status_code == 200
+    rv_json = json.loads(rv.data.decode('utf-8'))
+    assert [node['resource_type'] for node in rv_json['data']] == [
+        'DistGitCommit', 'KojiBuild', 'Advisory']
+    assert rv_json['meta']['requested_node_index'] == 1
+    assert rv_json['meta']['window'] == 1
+    assert rv_json['meta']['has_more_backward'] is True
+    assert rv_json['meta']['has_more_forward'] is False
+
+    rv = client.get('/api/v1/story/kojibuild/2345?window=2')
+    rv_json = json.loads(rv.data.decode('utf-8'))
+    assert [node['resource_type'] for node in rv_json['data']] == [
+        'BugzillaBug', 'DistGitCommit', 'KojiBuild', 'Advisory']
+    assert rv_json['meta']['has_more_backward'] is False
+    assert rv_json['meta']['has_more_forward'] is False
+
+
+def test_get_story_window_module(client):
+    """Test that the story type of a window is determined from the whole story."""
+    bug = BugzillaBug.get_or_create({
+        'creation_time': datetime(2017, 4, 1, 17, 41, 4),
+        'id_': '12345',
+        'modified_time': datetime(2018, 2, 7, 19, 30, 47),
+    })[0]
+    commit = DistGitCommit.get_or_create({
+        'commit_date': datetime(2017, 4, 2, 19, 39, 6),
+        'hash_': '8a63adb248ba633e200067e1ad6dc61931727bad',
+    })[0]
+    build = KojiBuild.get_or_create({
+        'completion_time': datetime(2017, 4, 2, 19, 39, 6),
+        'creation_time': datetime(2017, 4, 2, 19, 39, 6),
+        'id_': '2345',
+        'name': 'slf4j',
+        'release': '4.el7_4',
+        'version': '1.7.4'
+    })[0]
+    module_build = ModuleKojiBuild.get_or_create({
+        'completion_time': datetime(2017, 4, 3, 19, 39, 6),
+        'creation_time': datetime(2017, 4, 3, 19, 39, 6),
+        'id_': '3456',
+        'name': '389-ds',
+        'release': '20180805121332.a2037af3',
+        'version': '1.4',
+    })[0]
+    commit.resolved_bugs.connect(bug)
+    build.commit.connect(commit)
+    module_build.components.connect(build)
+
+    rv = client.get('/api/v1/story/bugzillabug/12345')
+    full_story = json.loads(rv.data.decode('utf-8'))
+    assert full_story['meta']['story_type'] == 'module'
+
+    # The module build is past the window, but the story is still a module story
+    rv = client.get('/api/v1/story/bugzillabug/12345?window=1')
+    rv_json = json.loads(rv.data.decode('utf-8'))
+    assert rv_json['meta']['story_type'] == 'module'
+    assert rv_json['data'] == full_story['data'][:2]
+    assert rv_json['meta']['has_more_forward'] is True
+
+
+def test_get_story_hub(client):
+    """Test that only the most recent nodes related to a hub node are expanded in its story."""
+    advisory = Advisory.get_or_create({
+        'advisory_name': 'RHBA-2017:2251-02',
+        'created_at': datetime(2017, 4, 3, 14, 47, 23),
+        'id_': '27825',
+    })[0]
+    for build_id, day in (('2345', 2), ('3456', 1), ('4567', 3)):
+        build = KojiBuild.get_or_create({
+            'completion_time': datetime(2017, 4, day, 20, 39, 6),
+            'creation_time': datetime(2017, 4, day, 19, 39, 6),
+            'id_': build_id,
+            'name': 'slf4j',
+            'release': '4.el7_4',
+            'version': build_id
+        })[0]
+        build.advisories.connect(advisory)
+
+    with patch.dict(client.application.config, {'HUB_DEGREE_THRESHOLD': 2, 'HUB_TOP_K': 1}):
+        rv = client.get('/api/v1/story/advisory/27825')
+    assert rv.status_code == 200
+    rv_json = json.loads(rv.data.decode('utf-8'))
+    assert [node['id'] for node in rv_json['data']] == ['4567', '27825']
+    assert rv_json['meta']['partial'] is True
+
+    rv = client.get('/api/v1/story/advisory/27825')
+    assert 'partial' not in json.loads(rv.data.decode('utf-8'))['meta']
+
+
+def test_get_story_snapshot(client, tmpdir):
+    """Test that the story computed from the graph snapshot is the same as with Neo4j."""
+    advisory = Advisory.get_or_create({
+        'advisory_name': 'RHBA-2017:2251-02',
+        'created_at': datetime(2017, 4, 3, 14, 47, 23),
+        'id_': '27825',
+    })[0]
+    build = KojiBuild.get_or_create({
+        'completion_time': datetime(2017, 4, 2, 19, 39, 6),
+        'creation_time': datetime(2017, 4, 2, 19, 39, 6),
+        'id_': '2345',
+        'name': 'slf4j',
+        'release': '4.el7_4',
+        'version': '1.7.4'
+    })[0]
+    commit = DistGitCommit.get_or_create({
+        'commit_date': datetime(2017, 4, 2, 19, 39, 6),
+        'hash_': '8a63adb248ba633e200067e1ad6dc61931727bad',
+    })[0]
+    build.advisories.connect(advisory)
+    build.commit.connect(commit)
+    path = str(tmpdir.join('graph.snapshot'))
+    assert build_graph_snapshot(path) == (3, 2)
+
+    rv = client.get('/api/v1/story/kojibuild/2345')
+    assert rv.status_code == 200
+    config = {'GRAPH_SNAPSHOT_PATH': path, 'GRAPH_SNAPSHOT_REFRESH_INTERVAL': 600}
+    with patch.dict(client.application.config, config):
+        rv_snapshot = client.get('/api/v1/story/kojibuild/2345')
+        assert rv_snapshot.status_code == 200
+        assert json.loads(rv_snapshot.data.decode('utf-8')) == json.loads(
+            rv.data.decode('utf-8'))
+
+        # The nodes created after the snapshot are still part of the story
+        bug = BugzillaBug.get_or_create({
+            'creation_time': datetime(2017, 4, 1, 17, 41, 4),
+            'id_': '12345',
+            'modified_time': datetime(2018, 2, 7, 19, 30, 47),
+        })[0]
+        commit.resolved_bugs.connect(bug)
+        rv = client.get('/api/v1/story/bugzillabug/12345')
+        assert [node['resource_type'] for node in json.loads(rv.data.decode('utf-8'))['data']] \
+            == ['BugzillaBug', 'DistGitCommit', 'KojiBuild', 'Advisory']
+
+
+def test_get_story_traversal_backends(client, tmpdir):
+    """Test that the stories are the same with every traversal backend."""
+    advisory = Advisory.get_or_create({
+        'advisory_name': 'RHBA-2017:2251-02',
+        'created_at': datetime(2017, 4, 3, 14, 47, 23),
+        'id_': '27825',
+    })[0]
+    commit = DistGitCommit.get_or_create({
+        'commit_date': datetime(2017, 4, 2, 19, 39, 6),
+        'hash_': '8a63adb248ba633e200067e1ad6dc61931727bad',
+    })[0]
+    for build_id, day in (('2345', 2), ('3456', 1), ('4567', 3)):
+        build = KojiBuild.get_or_create({
+            'completion_time': datetime(2017, 4, day, 20, 39, 6),
+            'creation_time': datetime(2017, 4, day, 19, 39, 6),
+            'id_': build_id,
+            'name': 'slf4j',
+            'release': '4.el7_4',
+            'version': build_id
+        })[0]
+        build.advisories.connect(advisory)
+    build.commit.connect(commit)
+    fm_event = FreshmakerEvent.get_or_create({
+        'id_': '1180',
+        'state_name': 'COMPLETE',
+        'time_created': datetime(2017, 8, 13, 15, 43, 51),
+        'time_done': datetime(2017, 8, 14, 5, 43, 51)
+    })[0]
+    cb = ContainerKojiBuild.get_or_create({
+        'completion_time': datetime(2017, 9, 1, 5, 43, 51),
+        'creation_time': datetime(2017, 8, 14, 5, 43, 51),
+        'id_': '710',
+        'name': 'slf4j_2',
+        'release': '4.el7_4_as',
+        'version': '1.7.4'
+    })[0]
+    fm_event.triggered_by_advisory.connect(advisory)
+    fm_event.successful_koji_builds.connect(cb)
+    path = str(tmpdir.join('graph.snapshot'))
+    build_graph_snapshot(path)
+
+    urls = ['/api/v1/story/kojibuild/4567', '/api/v1/story/advisory/27825',
+            '/api/v1/story/containerkojibuild/710', '/api/v1/allstories/advisory/27825']
+    for hub_config in ({}, {'HUB_DEGREE_THRESHOLD': 2, 'HUB_TOP_K': 1}):
+        responses = []
+        for config in ({'STORY_TRAVERSAL_BACKEND': 'apoc'},
+                       {'STORY_TRAVERSAL_BACKEND': 'cypher'},
+                       {'STORY_TRAVERSAL_BACKEND': 'cypher', 'GRAPH_SNAPSHOT_PATH': path}):
+            config.update(hub_config)
+            with patch.dict(client.application.config, config):
+                responses.append([json.loads(client.get(url).data.decode('utf-8'))
+                                  for url in urls])
+        assert responses[0] == responses[1] == responses[2]
+        assert [node['id'] for node in responses[0][0]['data']] == [
+            '8a63adb248ba633e200067e1ad6dc61931727bad', '4567', '27825', '1180', '710']
+
+
+@pytest.mark.parametrize('window', ('0', '-1', 'one'))
+def test_get_story_window_invalid(client, window):
+    """Test that an invalid window is rejected."""
+    rv = client.get('/api/v1/story/kojibuild/2345?window={0}'.format(window))
+    assert rv.status_code == 400
+    assert json.loads(rv.data.decode('utf-8')) == {
+        'message': 'The window parameter must be a positive integer',
+        'status': 400
+    }
+
+
 def test_get_story_fallback(client):
     """Test getting the story for a resource and falling back to a different label."""
     build = KojiBuild.get_or_create({
@@ -1873,3 +2108,71 @@ def test_get_story_fallback(client):
     rv = client.get('/api/v1/story/containerkojibuild/2345?fallback=kojibuild')
     assert rv.status_code == 200
     assert json.loads(rv.data.decode('utf-8')) == expected
+
+
+def test_get_story_timeout(client):
+    """Test that a story whose queries time out returns a clear error."""
+    KojiBuild.get_or_create({'id_': '2345', 'name': 'slf4j', 'version': '1.7.4'})
+    timeout_error = Neo4jError.hydrate(
+        message='The transaction has been terminated', code=QUERY_TIMEOUT_ERROR_CODES[0])
+    with patch('estuary.utils.story.run_read_queries', side_effect=timeout_error):
+        rv = client.get('/api/v1/story/kojibuild/2345')
+    assert rv.status_code == 504
+    assert json.loads(rv.data.decode('utf-8')) == {
+        'message': 'The request took too long to process and was cancelled',
+        'status': 504
+    }
+    rv = client.get('/monitoring/metrics')
+    assert ('query_timeout_count_total{app_name="estuary-api",'
+            'endpoint="api_v1.get_resource_story"} 1.0') in rv.data.decode('utf-8')
+
+
+def test_get_stories_batch(client):
+    """Test that the batch stories endpoint returns the same stories as the story endpoint."""
+    advisory = Advisory.get_or_create({
+        'advisory_name': 'RHBA-2017:2251-02',
+        'created_at': datetime(2017, 4, 3, 14, 47, 23),
+        'id_': '27825',
+    })[0]
+    for build_id in ('2345', '3456'):
+        build = KojiBuild.get_or_create({
+            'completion_time': datetime(2017, 4, 2, 19, 39, 6),
+            'creation_time': datetime(2017, 4, 2, 19, 39, 6),
+            'id_': build_id,
+            'name': 'slf4j',
+            'release': '4.el7_4',
+            'version': '1.7.4'
+        })[0]
+        build.advisories.connect(advisory)
+
+    payload = {'items': [
+        {'resource': 'kojibuild', 'uid': '2345'},
+        {'resource': 'KojiBuild', 'uid': '3456'},
+        {'resource': 'kojibuild', 'uid': '9999'},
+        {'resource': 'kojibuild', 'uid': '2345'},
+    ]}
+    rv = client.post('/api/v1/stories', data=json.dumps(payload))
+    assert rv.status_code == 200
+    rv_json = json.loads(rv.data.decode('utf-8'))
+    assert len(rv_json) == 4
+    for index, uid in ((0, '2345'), (1, '3456'), (3, '2345')):
+        expected = json.loads(client.get('/api/v1/story/kojibuild/{0}'.format(uid)).data)
+        expected['status'] = 200
+        assert rv_json[index] == expected
+    assert rv_json[2] == {'message': 'This item does not exist', 'status': 404}
+
+
+@pytest.mark.parametrize('payload,error', [
+    ([], 'The JSON body must contain an "items" list'),
+    ({'items': [{'resource': 'kojibuild'}]},
+     'Each item must contain the "resource" and "uid" strings'),
+    ({'items': [{'resource': 'kojibuild', 'uid': '1', 'fallback': 'advisory'}]},
+     'The "fallback" key of an item must be a list of strings'),
+    ({'items': [{'resource': 'kojibuild', 'uid': '1'}] * 501},
+     'The "items" list can\'t contain more than 500 items'),
+])
+def test_get_stories_batch_invalid(client, payload, error):
+    """Test that an invalid batch stories request is rejected."""
+    rv = client.post('/api/v1/stories', data=json.dumps(payload))
+    assert rv.status_code == 400
+    assert json.loads(rv.data.decode('utf-8')) == {'message': error, 'status': 400}
@@ -0,0 +1,66 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import json
+
+from mock import patch
+
+from estuary.models.bugzilla import BugzillaBug
+from estuary.models.errata import ContainerAdvisory
+from estuary.models.koji import KojiBuild
+from estuary.utils.typeahead import TypeaheadIndex
+
+
+def test_typeahead(client):
+    """Test that the artifacts are looked up by the prefix of their identifier."""
+    KojiBuild.get_or_create({
+        'id_': '2345',
+        'name': 'slf4j',
+        'release': '4.el7_4',
+        'version': '1.7.4'
+    })
+    ContainerAdvisory.get_or_create({
+        'advisory_name': 'RHBA-2017:2251-03',
+        'id_': '12327',
+    })
+    BugzillaBug.get_or_create({'id_': '12345'})
+    index = TypeaheadIndex()
+    index.build()
+
+    with patch.dict(client.application.config, {'TYPEAHEAD_ENABLED': True}), \
+            patch('estuary.api.v1.get_typeahead_index', return_value=index):
+        rv = client.get('/api/v1/typeahead?q=SLF4J-1.7')
+        assert rv.status_code == 200
+        assert json.loads(rv.data.decode('utf-8')) == {
+            'data': [{
+                'resource_type': 'KojiBuild',
+                'id': '2345',
+                'identifier': 'slf4j-1.7.4-4.el7_4',
+            }],
+            'meta': {'limit': 10, 'query': 'SLF4J-1.7'},
+        }
+
+        rv = client.get('/api/v1/typeahead?q=rhba')
+        assert json.loads(rv.data.decode('utf-8'))['data'] == [{
+            'resource_type': 'ContainerAdvisory',
+            'id': '12327',
+            'identifier': 'RHBA-2017:2251-03',
+        }]
+
+        rv = client.get('/api/v1/typeahead?q=123&limit=1')
+        assert [node['id'] for node in json.loads(rv.data.decode('utf-8'))['data']] == ['12345']
+
+
+def test_typeahead_unavailable(client):
+    """Test that the typeahead index can't be used when it's disabled or not built yet."""
+    rv = client.get('/api/v1/typeahead?q=slf4j')
+    assert rv.status_code == 404
+    assert json.loads(rv.data.decode('utf-8'))['message'] == 'The typeahead index is disabled'
+
+    with patch.dict(client.application.config, {'TYPEAHEAD_ENABLED': True}), \
+            patch('estuary.api.v1.get_typeahead_index', return_value=None):
+        rv = client.get('/api/v1/typeahead?q=slf4j')
+        assert rv.status_code == 503
+        rv = client.get('/api/v1/typeahead')
+        assert rv.status_code == 400
@@ -6,13 +6,16 @@ from datetime import datetime
 
 import pytest
 import pytz
+from mock import patch
 from neomodel import One, RelationshipTo, UniqueIdProperty
 
+from estuary.app import create_app
 from estuary.models.base import EstuaryStructuredNode
 from estuary.models.bugzilla import BugzillaBug
 from estuary.models.errata import Advisory
-from estuary.models.koji import KojiBuild
+from estuary.models.koji import ContainerKojiBuild, KojiBuild
 from estuary.models.user import User
+from estuary.utils.general import inflate_node
 
 
 def test_conditional_connect_zero_or_one():
@@ -73,3 +76,96 @@ def test_build_added_rel():
     rel.save()
     assert advisory.attached_builds.relationship(build).time_attached == time_attached
     assert rel.time_attached == time_attached
+
+
+def test_serialized_all_relationship_limit():
+    """Test that the related nodes serialized per relationship are limited and counted."""
+    app = create_app('estuary.config.TestConfig')
+    advisory = Advisory(id_='12345', advisory_name='RHBA-2018:12345-01').save()
+    for build_id in ('1', '2', '3'):
+        advisory.attached_builds.connect(KojiBuild(id_=build_id).save())
+    advisory.attached_builds.connect(ContainerKojiBuild(id_='4').save())
+    advisory.reporter.connect(User(username='tbrady').save())
+
+    with app.test_request_context('/api/v1/advisory/12345?relationship_limit=2'):
+        serialized = advisory.serialized_all
+    # The most recently created builds are kept, whatever their labels
+    assert [build['id'] for build in serialized['attached_builds']] == ['4', '3']
+    assert serialized['attached_builds_count'] == 4
+    assert serialized['attached_bugs'] == []
+    assert serialized['attached_bugs_count'] == 0
+    assert serialized['reporter']['username'] == 'tbrady'
+    assert serialized['truncated'] is True
+
+    with app.test_request_context('/api/v1/advisory/12345'):
+        serialized = advisory.serialized_all
+    assert len(serialized['attached_builds']) == 4
+    assert 'attached_builds_count' not in serialized
+    assert 'truncated' not in serialized
+
+
+def test_serialized_all_fields():
+    """Test that only the relationships requested with the fields parameter are queried."""
+    app = create_app('estuary.config.TestConfig')
+    advisory = Advisory(id_='12345', advisory_name='RHBA-2018:12345-01')
+    advisory.id = 1
+
+    with app.test_request_context('/api/v1/advisory/12345?fields=id,display_name'):
+        with patch.object(Advisory, 'cypher') as mock_cypher:
+            serialized = advisory.serialized_all
+    mock_cypher.assert_not_called()
+    assert 'attached_builds' not in serialized
+    # The properties are selected once for the whole response, so they're all serialized here
+    assert serialized['advisory_name'] == 'RHBA-2018:12345-01'
+
+    with app.test_request_context('/api/v1/advisory/12345?fields=id,attached_builds'):
+        with patch.object(Advisory, 'cypher', return_value=([], None)) as mock_cypher:
+            serialized = advisory.serialized_all
+    assert 'MATCH (a)-[r:ATTACHED]-(all)' in mock_cypher.call_args[0][0]
+    assert serialized['attached_builds'] == []
+    assert 'reporter' not in serialized
+
+
+def test_get_projection():
+    """Test that only the requested properties of the nodes are queried."""
+    app = create_app('estuary.config.TestConfig')
+    with app.test_request_context('/api/v1/kojibuild/1'):
+        assert KojiBuild.get_projection('node') == 'node'
+
+    # The properties of the display name and of the models inheriting from KojiBuild are included,
+    # and the unknown fields are ignored
+    with app.test_request_context(
+            '/api/v1/kojibuild/1?fields=display_name,operator,advisories,id})'):
+        assert KojiBuild.get_projection('node') == (
+            '[id(node), labels(node), node {.id, .name, .operator, .release, .version}]')
+        node = inflate_node(
+            [5, ['KojiBuild', 'ContainerKojiBuild'],
+             {'id': '1', 'name': 'slf4j', 'operator': None, 'release': '1', 'version': '1.7'}])
+    assert isinstance(node, ContainerKojiBuild)
+    assert node.id == 5
+    assert node.display_name == 'slf4j-1.7-1'
+    assert node.operator is False
+    assert node.creation_time is None
+
+
+def test_get_related_nodes_query():
+    """Test that the related nodes are paginated by Neo4j and counted separately."""
+    app = create_app('estuary.config.TestConfig')
+    advisory = Advisory(id_='12345', advisory_name='RHBA-2018:12345-01')
+    advisory.id = 1
+
+    with app.test_request_context('/api/v1/advisory/12345/relationships/attached_bugs'):
+        with patch.object(Advisory, 'cypher', return_value=([[2]], None)) as mock_cypher:
+            assert advisory.get_related_nodes('attached_bugs', skip=2, limit=10) == ([], 2)
+        # There is no page to query after the last related node
+        mock_cypher.assert_called_once()
+        assert mock_cypher.call_args[0][0].endswith(
+            'MATCH (item)-[:ATTACHED]->(node:BugzillaBug) RETURN count(node)')
+
+        with patch.object(Advisory, 'cypher', side_effect=[([[3]], None), ([], None)]) \
+                as mock_cypher:
+            advisory.get_related_nodes('attached_bugs', order_by='-priority', skip=2, limit=10)
+        assert mock_cypher.call_args[0][0].endswith(
+            'WITH node ORDER BY node.priority DESC, id(node) DESC SKIP {skip} LIMIT {limit} '
+            'RETURN node')
+        assert mock_cypher.call_args[0][1] == {'skip': 2, 'limit': 10}
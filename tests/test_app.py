@@ -2,8 +2,30 @@
 
 from __future__ import unicode_literals
 
+import json
+import os
+import subprocess
+import sys
+
 import pytest
 
+from estuary.app import create_app
+from estuary.config import TestConfig
+
+# The maximum number of seconds to import and create the application in a new interpreter. The
+# fastest of the runs usually takes about 0.35 seconds, and the margin keeps the benchmark from
+# failing on slow machines. The eager imports are caught by test_startup_lazy_modules instead.
+STARTUP_BUDGET = 3
+# The modules that must only be imported when the feature using them is used
+LAZY_MODULES = ('flask_oidc', 'ldap3', 'numpy', 'pyarrow')
+_STARTUP_SCRIPT = '''
+import json, sys, time
+start = time.time()
+from estuary.app import create_app
+create_app('estuary.config.TestConfig')
+print(json.dumps({'seconds': time.time() - start, 'modules': sorted(sys.modules)}))
+'''
+
 
 @pytest.mark.parametrize('origin, header_set', [
     ('http://localhost:4200', True),
@@ -15,8 +37,44 @@ def test_cors_header(client, origin, header_set):
     if header_set:
         assert 'Access-Control-Allow-Origin: {}'.format(origin) in str(rv.headers)
         assert 'Access-Control-Allow-Headers: Content-Type' in str(rv.headers)
-        assert 'Access-Control-Allow-Methods: GET, OPTIONS' in str(rv.headers)
+        assert 'Access-Control-Allow-Methods: GET, POST, OPTIONS' in str(rv.headers)
     else:
         assert 'Access-Control-Allow-Origin' not in str(rv.headers)
         assert 'Access-Control-Allow-Headers' not in str(rv.headers)
         assert 'Access-Control-Allow-Methods' not in str(rv.headers)
+
+
+def test_worker_threads_reserved():
+    """Test that the application can't start if the expensive requests can take every thread."""
+    config = type(str('Config'), (TestConfig,), {'WORKER_THREADS': 5})
+    with pytest.raises(RuntimeError, match='must be lower than "WORKER_THREADS" \\(5\\)'):
+        create_app(config)
+    config.WORKER_THREADS = 6
+    assert create_app(config)
+
+
+def _start_app():
+    """
+    Import and create the application in a new interpreter.
+
+    :return: the number of seconds it took and the names of the imported modules
+    :rtype: dict
+    """
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, '-c', _STARTUP_SCRIPT], cwd=repo_dir)
+    return json.loads(output.decode('utf-8').splitlines()[-1])
+
+
+def test_startup_lazy_modules():
+    """Test that the application starts without importing the lazy modules."""
+    imported = set(LAZY_MODULES).intersection(_start_app()['modules'])
+    assert not imported, 'The lazy modules {0} were imported on startup'.format(sorted(imported))
+
+
+@pytest.mark.benchmark
+def test_startup_time():
+    """Test that the application starts within the budget."""
+    # Use the fastest run so that a busy machine doesn't fail the test
+    startup_time = min(_start_app()['seconds'] for _ in range(3))
+    assert startup_time < STARTUP_BUDGET, (
+        'Starting the application took {0:.2f} seconds'.format(startup_time))
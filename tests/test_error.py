@@ -0,0 +1,39 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import json
+
+import pytest
+from neo4j.exceptions import ClientError, Neo4jError
+
+from estuary.app import create_app
+from estuary.error import is_pool_exhausted_error, json_error
+
+
+@pytest.mark.parametrize('error,expected', [
+    (ClientError('Failed to obtain a connection from pool within 60s'), True),
+    (Neo4jError.hydrate(message='Invalid input', code='Neo.ClientError.Statement.SyntaxError'),
+     False),
+    (Neo4jError.hydrate(message='Unknown', code='Neo.ClientError.General.Unknown'), False),
+    (RuntimeError('Failed to obtain a connection from pool within 60s'), False),
+])
+def test_is_pool_exhausted_error(error, expected):
+    """Test that only the errors of the driver's connection pool are detected as pool exhaustion."""
+    assert is_pool_exhausted_error(error) is expected
+
+
+@pytest.mark.parametrize('error,status_code,message', [
+    (ClientError('Failed to obtain a connection from pool within 60s'), 503,
+     'The database connection pool is exhausted'),
+    (Neo4jError.hydrate(message='Invalid input "MATCH (n) RETRN n"',
+                        code='Neo.ClientError.Statement.SyntaxError'), 500,
+     'The database failed to process the request'),
+])
+def test_json_error_neo4j(error, status_code, message):
+    """Test that the Neo4j errors don't expose their details to the client."""
+    app = create_app('estuary.config.TestConfig')
+    with app.test_request_context('/api/v1/kojibuild/1'):
+        rv = json_error(error)
+    assert rv.status_code == status_code
+    assert json.loads(rv.data.decode('utf-8')) == {'message': message, 'status': status_code}
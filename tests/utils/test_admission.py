@@ -0,0 +1,42 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+from mock import patch
+
+from estuary.utils.admission import ConcurrencyLimiter
+
+
+def test_concurrency_limiter():
+    """Test that the limiter rejects the requests once the slots and the queue are taken."""
+    limiter = ConcurrencyLimiter(2, 0, 0.01)
+    assert limiter.acquire() is True
+    assert limiter.acquire() is True
+    assert limiter.active == 2
+    assert limiter.acquire() is False
+    limiter.release()
+    assert limiter.active == 1
+    assert limiter.acquire() is True
+
+
+def test_concurrency_limiter_queue_timeout():
+    """Test that a queued request is rejected when it waits for too long."""
+    limiter = ConcurrencyLimiter(1, 1, 0.01)
+    assert limiter.acquire() is True
+    assert limiter.acquire() is False
+    assert limiter.queued == 0
+    assert limiter.active == 1
+
+
+def test_expensive_request_rejected(client):
+    """Test that an expensive request is rejected with Retry-After when the limiter is full."""
+    limiter = ConcurrencyLimiter(1, 0, 0.01)
+    limiter.acquire()
+    with patch('estuary.utils.admission._limiter', limiter):
+        rv = client.get('/api/v1/story/kojibuild/1')
+    assert rv.status_code == 503
+    assert rv.headers['Retry-After'] == '5'
+    assert rv.json == {
+        'message': 'Too many expensive requests are in progress, please try again later',
+        'status': 503
+    }
@@ -0,0 +1,72 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+from estuary.utils import analytics  # noqa: E402
+
+LABELS = ['KojiBuild', 'Advisory', 'FreshmakerEvent', 'ContainerKojiBuild', 'ContainerAdvisory']
+
+
+def test_get_container_stories_query():
+    """Test that the longest path from each container build is the story, like the story API."""
+    query = analytics.get_container_stories_query()
+    assert query.startswith(
+        'MATCH (node0:ContainerAdvisory)-[rel0:ATTACHED]->(node1:ContainerKojiBuild) '
+        'WHERE node0.product_name = {product} AND node0.created_at >= {since} '
+        'AND node0.created_at < {until} '
+        "CALL apoc.path.expandConfig(node1, {sequence:'ContainerKojiBuild, TRIGGERED<, "
+        'FreshmakerEvent, TRIGGERED_BY>, Advisory, ATTACHED>, KojiBuild, BUILT_FROM>, '
+        "DistGitCommit, RESOLVED>, BugzillaBug, None, None', minLevel:0}) YIELD path "
+        'WITH node0, rel0, node1, path ORDER BY length(path) DESC '
+        'WITH node0, rel0, node1, head(collect(path)) AS path ')
+    assert 'path_nodes[5] AS node6, path_rels[0] AS rel1' in query
+    assert 'node6 {.creation_time}' in query
+    assert query.endswith('rel4.time_attached, rel5.time_attached')
+
+
+def test_get_story_metrics():
+    """Test that the metrics of the stories are computed like in the story API."""
+    build = {'creation_time': 0.0, 'completion_time': 100.0}
+    nodes = [
+        [build, None],
+        [{'created_at': 150.0, 'status_time': 400.0, 'state': 'SHIPPED_LIVE'}, None],
+        [{'time_created': 500.0, 'time_done': 900.0, 'state_name': 'COMPLETE'}, None],
+        [{'creation_time': 600.0, 'completion_time': 700.0},
+         {'creation_time': 50.0, 'completion_time': None}],
+        [{'created_at': 800.0, 'status_time': 1000.0, 'state': 'SHIPPED_LIVE'},
+         {'created_at': 100.0, 'status_time': 200.0, 'state': 'NEW_FILES'}],
+    ]
+    attached_times = [[200.0, None], [None, None], [None, None], [750.0, None]]
+    metrics = analytics.get_story_metrics(LABELS, nodes, attached_times, 2000.0)
+
+    assert metrics['lead_time'].tolist() == [1000.0, 1950.0]
+    # Build to advisory: 100, advisory to event: 100, event to container build: not counted,
+    # container build to container advisory: 50
+    assert metrics['wait_time'].tolist() == [250.0, 0.0]
+    # Build: 100, advisory: 200, event: 100, container build: 100, container advisory: 250. The
+    # container build of the second story is still processing, and its container advisory is
+    # skipped since the container build has no completion time.
+    assert metrics['processing_time'].tolist() == [750.0, 1950.0]
+
+
+def test_get_story_metrics_missing_start():
+    """Test that the lead time isn't computed when the first artifact has no start time."""
+    nodes = [[None], [None], [None], [{'creation_time': None, 'completion_time': 700.0}],
+             [{'created_at': 800.0, 'status_time': 1000.0, 'state': 'SHIPPED_LIVE'}]]
+    metrics = analytics.get_story_metrics(LABELS, nodes, [[None]] * 4, 2000.0)
+    assert numpy.isnan(metrics['lead_time'][0])
+    assert metrics['wait_time'].tolist() == [0.0]
+    # The container advisory starts processing when the container build completed
+    assert metrics['processing_time'].tolist() == [300.0]
+
+
+def test_summarize():
+    """Test that the stories without the metric are ignored in the summary."""
+    assert analytics.summarize(numpy.array([10.0, numpy.nan, 20.0, 30.0, 40.0])) == {
+        'count': 4, 'mean': 25.0, 'p50': 25.0, 'p90': 37.0}
+    assert analytics.summarize(numpy.array([numpy.nan])) == {
+        'count': 0, 'mean': None, 'p50': None, 'p90': None}
@@ -0,0 +1,75 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import os
+import time
+from datetime import datetime
+
+from mock import Mock, patch
+
+from estuary.app import create_app
+from estuary.utils.cache import (REFRESH_ENVIRON_KEY, ResponseCache,
+                                 cache_response, warm_up_response_cache)
+
+
+def test_response_cache(tmpdir):
+    """Test that the responses are cached until they expire."""
+    app = create_app('estuary.config.TestConfig')
+    cache = ResponseCache(str(tmpdir), 60)
+    assert cache.get('key') is None
+    with app.app_context():
+        cache.set('key', {'data': [{'completion_time': datetime(2017, 4, 2, 19, 39, 6)}]})
+    assert cache.get('key') == {'data': [{'completion_time': 'Sun, 02 Apr 2017 19:39:06 GMT'}]}
+
+    path = cache._get_path('key')
+    os.utime(path, (time.time() - 120, time.time() - 120))
+    assert cache.get('key') is None
+    cache.remove_expired()
+    assert not os.path.exists(path)
+
+
+def test_cache_response(tmpdir):
+    """Test that the route is only called when its response isn't cached or is refreshed."""
+    app = create_app('estuary.config.TestConfig')
+    app.config['RESPONSE_CACHE_DIR'] = str(tmpdir)
+    route = Mock(side_effect=[{'data': 1}, {'data': 2}])
+    cached_route = cache_response(route)
+
+    with app.test_request_context('/api/v1/story/kojibuild/1'):
+        assert cached_route() == {'data': 1}
+    with app.test_request_context('/api/v1/story/KojiBuild/1'):
+        assert cached_route() == {'data': 1}
+    environ = {REFRESH_ENVIRON_KEY: True}
+    with app.test_request_context('/api/v1/story/kojibuild/1', environ_base=environ):
+        assert cached_route() == {'data': 2}
+    assert route.call_count == 2
+
+
+def test_warm_up_response_cache(tmpdir):
+    """Test that the story and siblings responses of the recent nodes are refreshed."""
+    app = create_app('estuary.config.TestConfig')
+    app.config['RESPONSE_CACHE_DIR'] = str(tmpdir)
+    recent_nodes = (
+        {'KojiBuild': [{'id': '1'}], 'Advisory': [{'id': '2'}]},
+        {'id_keys': {'KojiBuild': 'id', 'Advisory': 'id'}}
+    )
+    mock_client = Mock()
+    mock_client.get.side_effect = lambda url, environ_base: Mock(
+        status_code=400 if url == '/api/v1/siblings/advisory/2?backward_rel=true' else 200)
+    app.test_client = Mock(return_value=mock_client)
+
+    with patch('estuary.utils.recents.get_recent_nodes', return_value=recent_nodes):
+        assert warm_up_response_cache(app, count=1, workers=2) == (5, 0)
+
+    urls = sorted(call[0][0] for call in mock_client.get.call_args_list)
+    assert urls == [
+        '/api/v1/siblings/advisory/2',
+        '/api/v1/siblings/advisory/2?backward_rel=true',
+        '/api/v1/siblings/kojibuild/1',
+        '/api/v1/siblings/kojibuild/1?backward_rel=true',
+        '/api/v1/story/advisory/2',
+        '/api/v1/story/kojibuild/1',
+    ]
+    for call in mock_client.get.call_args_list:
+        assert call[1]['environ_base'] == {REFRESH_ENVIRON_KEY: True}
@@ -0,0 +1,105 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import json
+
+from mock import Mock, patch
+from neomodel import db
+
+from estuary.models.distgit import DistGitRepo
+from estuary.models.koji import ContainerKojiBuild, KojiBuild
+from estuary.models.user import User
+from estuary.utils.changelog import (ChangelogPoller, close_stream,
+                                     create_watermark_constraint, open_stream,
+                                     record_changed_nodes, start_recording,
+                                     stop_recording, stream_changes,
+                                     write_changelog)
+
+
+def test_record_changed_nodes():
+    """Test that the keys of the changed nodes are only recorded when the recording is started."""
+    record_changed_nodes([User(username='tbrady')])
+    assert stop_recording() == set()
+
+    start_recording()
+    record_changed_nodes([ContainerKojiBuild(id_='710'), User(username='tbrady')])
+    record_changed_nodes([DistGitRepo(name='some-repo', namespace='rpms')])
+    assert stop_recording() == set(['containerkojibuild:710', 'kojibuild:710', 'user:tbrady'])
+    record_changed_nodes([User(username='dprescott')])
+    assert stop_recording() == set()
+
+
+def test_get_or_create_records_created_nodes():
+    """Test that get_or_create only records the nodes it created."""
+    KojiBuild.get_or_create({'id_': '1', 'name': 'slf4j'})
+    start_recording()
+    nodes = KojiBuild.get_or_create({'id_': '1', 'name': 'slf4j'}, {'id_': '2', 'name': 'python'})
+    assert stop_recording() == set(['kojibuild:2'])
+    assert [node.id_ for node in nodes] == ['1', '2']
+    assert nodes[1].name == 'python'
+    # The temporary property marking the created nodes isn't stored
+    results, _ = db.cypher_query('MATCH (n) WHERE exists(n._estuary_created) RETURN count(n)')
+    assert results[0][0] == 0
+
+
+def test_create_watermark_constraint():
+    """Test that the watermark node written before the constraint existed is kept."""
+    db.cypher_query('CREATE (w:EstuaryChangelogWatermark {sequence: 3})')
+    create_watermark_constraint()
+    create_watermark_constraint()
+    assert write_changelog('koji', set(['kojibuild:2'])) == 4
+    results, _ = db.cypher_query(
+        'MATCH (w:EstuaryChangelogWatermark) RETURN w.name, w.sequence')
+    assert results == [['changelog', 4]]
+
+
+@patch('estuary.utils.changelog._open_streams', 0)
+def test_open_stream():
+    """Test that the change streams of the process are limited."""
+    assert open_stream(2) is True
+    assert open_stream(2) is True
+    assert open_stream(2) is False
+    close_stream()
+    assert open_stream(2) is True
+
+
+@patch('estuary.utils.changelog.get_changelog_entries')
+@patch('estuary.utils.changelog.get_latest_sequence', return_value=3)
+def test_changelog_poller(mock_latest, mock_entries):
+    """Test that the poller shares its queries and only queries old entries when resuming."""
+    poller = ChangelogPoller(0)
+    assert poller.get_entries(3) == []
+    assert poller.sequence == 3
+    mock_entries.return_value = [(4, set(['kojibuild:1'])), (5, set(['advisory:2']))]
+    assert poller.get_entries(3) == [(4, set(['kojibuild:1'])), (5, set(['advisory:2']))]
+    mock_entries.assert_called_once_with(3)
+
+    mock_entries.return_value = []
+    assert poller.get_entries(4) == [(5, set(['advisory:2']))]
+    assert mock_entries.call_count == 2
+    # The entries before the ones kept in memory are queried for the client resuming from them
+    mock_entries.side_effect = [[], [(2, set(['user:tbrady']))]]
+    assert poller.get_entries(1) == [(2, set(['user:tbrady']))]
+    assert mock_entries.call_args_list[-1][0] == (1,)
+
+    poller.interval = 60
+    assert poller.poll() == 5
+    assert mock_latest.call_count == 1
+
+
+def test_stream_changes():
+    """Test that only the changes to the subscribed nodes are streamed."""
+    poller = Mock(interval=0)
+    poller.get_entries.return_value = [
+        (4, set(['kojibuild:1', 'advisory:2'])), (5, set(['user:tbrady']))]
+    events = list(stream_changes(poller, set(['kojibuild:1', 'kojibuild:3']), False, 3, 0))
+    assert events == [
+        'retry: 0\n\n',
+        'id: 4\nevent: changed\ndata: {0}\n\n'.format(
+            json.dumps({'sequence': 4, 'nodes': ['kojibuild:1'], 'recents': False})),
+    ]
+    poller.get_entries.assert_called_once_with(3)
+
+    events = list(stream_changes(poller, set(), True, 3, 0))
+    assert [event.split('\n')[0] for event in events] == ['retry: 0', 'id: 4', 'id: 5']
@@ -0,0 +1,74 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+from mock import Mock, patch
+from neo4j.graph import Graph
+
+from estuary.models.koji import KojiBuild
+from estuary.utils.degrees import (get_degree_counters, get_degree_query,
+                                   update_degree_counters)
+from estuary.utils.story import ContainerStoryManager
+
+
+def test_get_degree_counters():
+    """Test that the nodes are counted in both directions of the story edges."""
+    counters = get_degree_counters()
+    assert ('ATTACHED', 'Advisory') in counters['KojiBuild']
+    assert ('ATTACHED', 'KojiBuild') in counters['Advisory']
+    assert ('TRIGGERED_BY', 'FreshmakerEvent') in counters['Advisory']
+    assert ('TRIGGERED_BY', 'Advisory') in counters['FreshmakerEvent']
+    assert all(label_counters == sorted(set(label_counters))
+               for label_counters in counters.values())
+
+
+def test_get_degree_query():
+    """Test that the query sets a counter per relationship type and label."""
+    query = get_degree_query(
+        'KojiBuild', [('ATTACHED', 'Advisory'), ('BUILT_FROM', 'DistGitCommit')],
+        'MATCH (node) WHERE id(node) IN {node_ids}')
+    assert query == (
+        'MATCH (node) WHERE id(node) IN {node_ids} WITH node WHERE node:KojiBuild '
+        'SET node.degree_ATTACHED_Advisory = size((node)-[:ATTACHED]-(:Advisory)), '
+        'node.degree_BUILT_FROM_DistGitCommit = size((node)-[:BUILT_FROM]-(:DistGitCommit))')
+
+
+@patch('estuary.utils.degrees.db.cypher_query')
+def test_update_degree_counters(mock_query):
+    """Test that the counters of the changed nodes and their related nodes are updated."""
+    mock_query.return_value = ([[[1, 2, 3]]], ['ids'])
+    assert update_degree_counters({'kojibuild:710', 'advisory:27825', 'unknown:1'}) == 3
+
+    lookup_queries = [call[0] for call in mock_query.call_args_list[:2]]
+    assert ('MATCH (node:Advisory) WHERE node.id IN {uids} ', {'uids': ['27825']}) in [
+        (query[:query.index('OPTIONAL')], params) for query, params in lookup_queries]
+    assert ('MATCH (node:KojiBuild) WHERE node.id IN {uids} ', {'uids': ['710']}) in [
+        (query[:query.index('OPTIONAL')], params) for query, params in lookup_queries]
+    # The counters of every label are set on the batch of nodes
+    update_calls = mock_query.call_args_list[2:]
+    assert len(update_calls) == len(get_degree_counters())
+    assert all(call[0][1] == {'node_ids': [1, 2, 3]} for call in update_calls)
+
+
+def test_inflate_degree_counters():
+    """Test that the degree counters stored on a node are kept when it's inflated."""
+    node = Graph.Hydrator(Graph()).hydrate_node(
+        1, {'KojiBuild'}, {'id': '710', 'degree_ATTACHED_Advisory': 3})
+    build = KojiBuild.inflate(node)
+    assert build.get_degree('ATTACHED', 'Advisory') == 3
+    assert build.get_degree('BUILT_FROM', 'DistGitCommit') is None
+    assert KojiBuild(id='711').get_degree('ATTACHED', 'Advisory') is None
+
+
+@patch('estuary.utils.story.run_story_queries')
+def test_get_sibling_nodes_count_degree_counters(mock_run):
+    """Test that the sibling counts are read from the degree counters without queries."""
+    degrees = {('ATTACHED', 'KojiBuild'): 3, ('TRIGGERED_BY', 'Advisory'): 1}
+    results = [
+        Mock(__label__=label, id=node_id,
+             get_degree=lambda rel_type, label: degrees.get((rel_type, label)))
+        for label, node_id in (('KojiBuild', 1), ('Advisory', 2), ('FreshmakerEvent', 3))
+    ]
+    mock_run.return_value = []
+    assert ContainerStoryManager().get_sibling_nodes_count(results) == [2, 0, 0]
+    mock_run.assert_called_once_with([])
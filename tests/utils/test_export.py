@@ -0,0 +1,113 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import json
+import os
+from datetime import date, datetime
+
+import pytest
+from mock import patch
+
+from estuary.models.errata import Advisory
+from estuary.models.koji import KojiBuild
+from estuary.utils.export import export_stories, get_story_rows
+
+
+def _get_story_rows(node_id):
+    """Create the rows of a story of a single node."""
+    return {
+        'stories': [{'story_id': node_id, 'length': 1}],
+        'nodes': [{'story_id': node_id, 'index': 0, 'node_id': node_id}],
+        'edges': [],
+    }
+
+
+def _read_table(output_dir, table):
+    """Read the rows of an NDJSON export table."""
+    table_dir = os.path.join(output_dir, table)
+    rows = []
+    for name in sorted(os.listdir(table_dir)):
+        with open(os.path.join(table_dir, name)) as part_file:
+            rows += [json.loads(line) for line in part_file]
+    return rows
+
+
+@patch('estuary.utils.export.get_story_rows', side_effect=_get_story_rows)
+@patch('estuary.utils.export.get_export_node_ids')
+def test_export_stories(mock_node_ids, mock_story_rows, tmpdir):
+    """Test that the stories are exported in batches and that the export can be resumed."""
+    output_dir = str(tmpdir)
+    mock_node_ids.side_effect = [[1, 2], RuntimeError('The database is down')]
+    with pytest.raises(RuntimeError, match='The database is down'):
+        export_stories(output_dir, 'Advisory', date(2019, 1, 1), date(2019, 2, 1), workers=1,
+                       batch_size=2)
+    assert os.listdir(os.path.join(output_dir, 'stories')) == ['part-00001.ndjson']
+
+    with pytest.raises(RuntimeError, match='already contains an export'):
+        export_stories(output_dir, 'Advisory', date(2019, 1, 1), date(2019, 2, 1), workers=1)
+    with pytest.raises(RuntimeError, match='has different parameters'):
+        export_stories(output_dir, 'KojiBuild', date(2019, 1, 1), date(2019, 2, 1), workers=1,
+                       resume=True)
+
+    mock_node_ids.side_effect = [[3], []]
+    assert export_stories(output_dir, 'Advisory', date(2019, 1, 1), date(2019, 2, 1), workers=1,
+                          batch_size=2, resume=True) == 3
+    # The export continues after the last node of the checkpoint
+    assert mock_node_ids.call_args_list[-2][1] == {'after': 2, 'limit': 2}
+    assert [row['story_id'] for row in _read_table(output_dir, 'stories')] == [1, 2, 3]
+    assert [row['node_id'] for row in _read_table(output_dir, 'nodes')] == [1, 2, 3]
+    # There are no files for the batches without edges
+    assert os.listdir(os.path.join(output_dir, 'edges')) == []
+    with open(os.path.join(output_dir, 'checkpoint.json')) as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+    assert checkpoint['last_node_id'] == 3
+    assert checkpoint['parts'] == 2
+
+
+def test_get_story_rows(client):
+    """Test that the nodes, edges and metrics of a story are converted to rows."""
+    build = KojiBuild.get_or_create({
+        'completion_time': datetime(2017, 4, 2, 19, 39, 6),
+        'creation_time': datetime(2017, 4, 2, 12, 39, 6),
+        'id_': '2345',
+        'name': 'slf4j',
+        'release': '4.el7_4',
+        'version': '1.7.4'
+    })[0]
+    advisory = Advisory.get_or_create({
+        'advisory_name': 'RHBA-2017:2251-02',
+        'created_at': datetime(2017, 4, 3, 14, 47, 23),
+        'id_': '27825',
+        'state': 'SHIPPED_LIVE',
+        'status_time': datetime(2017, 4, 10, 14, 47, 23),
+    })[0]
+    advisory.attached_builds.connect(build, {'time_attached': datetime(2017, 4, 3, 15, 43, 51)})
+
+    with client.application.app_context():
+        rows = get_story_rows(advisory.id)
+
+    rv = client.get('/api/v1/story/advisory/27825')
+    story_meta = json.loads(rv.data.decode('utf-8'))['meta']
+    assert rows['stories'] == [{
+        'story_id': advisory.id,
+        'resource_type': 'Advisory',
+        'uid': '27825',
+        'story_type': story_meta['story_type'],
+        'length': 2,
+        'partial': False,
+        'total_lead_time': story_meta['total_lead_time'],
+        'total_wait_time': story_meta['total_wait_time'],
+        'total_processing_time': story_meta['total_processing_time'],
+        'processing_time_flag': story_meta['processing_time_flag'],
+    }]
+    assert [(row['index'], row['node_id'], row['resource_type'], row['uid'])
+            for row in rows['nodes']] == [(0, build.id, 'KojiBuild', '2345'),
+                                          (1, advisory.id, 'Advisory', '27825')]
+    assert rows['edges'] == [{
+        'story_id': advisory.id,
+        'index': 0,
+        'relationship': 'ATTACHED',
+        'start_node_id': advisory.id,
+        'end_node_id': build.id,
+    }]
@@ -6,7 +6,12 @@ from datetime import date, datetime
 
 import pytest
 
-from estuary.utils.general import timestamp_to_date, timestamp_to_datetime
+from estuary.app import create_app
+from estuary.error import ValidationError
+from estuary.utils.general import (decode_cursor, encode_cursor,
+                                   get_pagination_meta, get_relationship_limit,
+                                   select_fields, timestamp_to_date,
+                                   timestamp_to_datetime)
 
 
 @pytest.mark.parametrize('input_dt,expected_dt', [
@@ -55,3 +60,70 @@ def test_timestamp_to_datetime_invalid(input_dt):
     with pytest.raises(ValueError)as exc_info:
         timestamp_to_datetime(input_dt)
     assert 'The timestamp "{0}" is an invalid format'.format(input_dt) == str(exc_info.value)
+
+
+def test_cursor():
+    """Test that a cursor can be decoded back to its offset."""
+    assert decode_cursor(encode_cursor(200)) == 200
+
+
+@pytest.mark.parametrize('cursor', ['abc', encode_cursor(-1), 'eyJvZmZzZXQiOiAiMSJ9'])
+def test_decode_cursor_invalid(cursor):
+    """Test that an invalid cursor is rejected."""
+    with pytest.raises(ValidationError, match='The cursor parameter is invalid'):
+        decode_cursor(cursor)
+
+
+@pytest.mark.parametrize('offset,total,has_next', [
+    (0, 250, True),
+    (100, 250, True),
+    (200, 250, False),
+    (0, 100, False),
+])
+def test_get_pagination_meta(offset, total, has_next):
+    """Test that the cursor of the next page is only returned if there are more results."""
+    meta = get_pagination_meta(100, offset, total)
+    assert meta['total'] == total
+    assert meta['limit'] == 100
+    if has_next:
+        assert decode_cursor(meta['next_cursor']) == offset + 100
+    else:
+        assert meta['next_cursor'] is None
+
+
+@pytest.mark.parametrize('config_limit,query_string,expected', [
+    (None, '', None),
+    (None, 'relationship_limit=20', 20),
+    (10, '', 10),
+    (10, 'relationship_limit=5', 5),
+    (10, 'relationship_limit=20', 10),
+])
+def test_get_relationship_limit(config_limit, query_string, expected):
+    """Test that the relationship limit of a request can only lower the configured limit."""
+    app = create_app('estuary.config.TestConfig')
+    app.config['SERIALIZED_RELATIONSHIP_LIMIT'] = config_limit
+    with app.test_request_context('/api/v1/advisory/12345?{0}'.format(query_string)):
+        assert get_relationship_limit() == expected
+
+
+@pytest.mark.parametrize('limit', ['0', 'abc'])
+def test_get_relationship_limit_invalid(limit):
+    """Test that an invalid relationship limit is rejected."""
+    app = create_app('estuary.config.TestConfig')
+    with app.test_request_context('/api/v1/advisory/12345?relationship_limit={0}'.format(limit)):
+        with pytest.raises(ValidationError, match='must be a positive integer'):
+            get_relationship_limit()
+
+
+@pytest.mark.parametrize('query_string,expected', [
+    ('', {'id': '1', 'name': 'slf4j', 'resource_type': 'KojiBuild', 'advisories_count': 2}),
+    ('fields=id', {'id': '1', 'resource_type': 'KojiBuild'}),
+    ('fields=id,+advisories,', {'id': '1', 'resource_type': 'KojiBuild', 'advisories_count': 2}),
+])
+def test_select_fields(query_string, expected):
+    """Test that only the requested fields are kept in a serialized node."""
+    app = create_app('estuary.config.TestConfig')
+    serialized_node = {
+        'id': '1', 'name': 'slf4j', 'resource_type': 'KojiBuild', 'advisories_count': 2}
+    with app.test_request_context('/api/v1/kojibuild/1?{0}'.format(query_string)):
+        assert select_fields(serialized_node) == expected
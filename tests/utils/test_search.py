@@ -0,0 +1,37 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import pytest
+from mock import patch
+
+from estuary.utils.search import create_search_index, get_search_query
+
+
+@pytest.mark.parametrize('text,expected', [
+    ('slf4j-1.7', 'slf4j* AND 1.7*'),
+    ('RHBA-2017:22', 'rhba* AND 2017* AND 22*'),
+    ('  Crash in "libvirt" ', 'crash* AND in* AND libvirt*'),
+    ('slf4j-1.7.4-4.el7_4', 'slf4j* AND 1.7.4* AND 4* AND el7_4*'),
+    ('*:(-)', ''),
+])
+def test_get_search_query(text, expected):
+    """Test that every term of the searched text is a prefix and Lucene syntax is ignored."""
+    assert get_search_query(text) == expected
+
+
+@patch('estuary.utils.search.db.cypher_query')
+def test_create_search_index(mock_query):
+    """Test that the search index is only created when it doesn't exist or changed."""
+    mock_query.return_value = ([[
+        ['Advisory', 'BugzillaBug', 'DistGitCommit', 'KojiBuild'],
+        ['advisory_name', 'log_message', 'name', 'short_description', 'synopsis'],
+    ]], None)
+    assert create_search_index() is False
+    assert mock_query.call_count == 1
+
+    mock_query.return_value = ([[['KojiBuild'], ['name']]], None)
+    assert create_search_index() is True
+    assert mock_query.call_args_list[-2][0][0] == 'CALL db.index.fulltext.drop({name})'
+    assert mock_query.call_args[0][1]['labels'] == [
+        'Advisory', 'BugzillaBug', 'DistGitCommit', 'KojiBuild']
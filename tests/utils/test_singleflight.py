@@ -0,0 +1,119 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import threading
+import time
+
+import pytest
+
+from estuary.app import create_app
+from estuary.utils.singleflight import (FileLockSingleFlight, SingleFlight,
+                                        get_request_key)
+
+
+def _run_concurrently(single_flight, key, fn, count):
+    """Call the single-flight object from several threads and return their results."""
+    results = [None] * count
+
+    def _do(index):
+        try:
+            results[index] = single_flight.do(key, fn)
+        except Exception as error:
+            results[index] = error
+
+    threads = [threading.Thread(target=_do, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_single_flight():
+    """Test that the identical concurrent calls share a single computation."""
+    release = threading.Event()
+    calls = []
+
+    def _compute():
+        calls.append(1)
+        release.wait(5)
+        return {'data': [1, 2]}
+
+    single_flight = SingleFlight()
+    threads, results = _run_concurrently(single_flight, 'key', _compute, 5)
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{'data': [1, 2]}] * 5
+    # The next call is not in progress anymore, so it computes a new result
+    assert single_flight.do('key', lambda: 'new') == 'new'
+
+
+def test_single_flight_error():
+    """Test that the identical concurrent calls share the error of the computation."""
+    release = threading.Event()
+
+    def _compute():
+        release.wait(5)
+        raise RuntimeError('Some failure')
+
+    threads, results = _run_concurrently(SingleFlight(), 'key', _compute, 3)
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_file_lock_single_flight(tmpdir):
+    """Test that the identical concurrent calls of different processes share the result."""
+    app = create_app('estuary.config.TestConfig')
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def _compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {'data': [1, 2]}
+
+    results = {}
+
+    def _do(name):
+        # Each object represents the single-flight object of a different API worker
+        with app.app_context():
+            results[name] = FileLockSingleFlight(str(tmpdir), 5).do('key', _compute)
+
+    first = threading.Thread(target=_do, args=('first',))
+    first.start()
+    started.wait(5)
+    second = threading.Thread(target=_do, args=('second',))
+    second.start()
+    time.sleep(0.2)
+    release.set()
+    first.join()
+    second.join()
+
+    assert len(calls) == 1
+    assert results == {'first': {'data': [1, 2]}, 'second': {'data': [1, 2]}}
+
+
+@pytest.mark.parametrize('url_one,url_two,identical', [
+    ('/api/v1/story/KojiBuild/1?fallback=A&x=1', '/api/v1/story/kojibuild/1?x=1&fallback=a', True),
+    ('/api/v1/story/kojibuild/1', '/api/v1/story/kojibuild/2', False),
+    ('/api/v1/story/kojibuild/1?fallback=a&fallback=b',
+     '/api/v1/story/kojibuild/1?fallback=b&fallback=a', False),
+    ('/api/v1/story/kojibuild/1', '/api/v1/allstories/kojibuild/1', False),
+])
+def test_get_request_key(url_one, url_two, identical):
+    """Test that the identical requests are normalized to the same key."""
+    app = create_app('estuary.config.TestConfig')
+    with app.test_request_context(url_one):
+        key_one = get_request_key()
+    with app.test_request_context(url_two):
+        key_two = get_request_key()
+    assert (key_one == key_two) is identical
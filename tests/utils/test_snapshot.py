@@ -0,0 +1,161 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import os
+
+import pytest
+from mock import Mock, patch
+from neo4j.graph import Graph
+
+from estuary.utils.snapshot import (GraphSnapshot, get_graph_snapshot,
+                                    hydrate_story_paths, write_graph_snapshot)
+from estuary.utils.story import ContainerStoryManager
+
+# The build with the ID 1 is attached to the advisories 2 and 3, and the advisory 2 triggered the
+# Freshmaker event 4, which triggered the container builds 5 and 6
+LABELS = ['Advisory', 'ContainerKojiBuild', 'FreshmakerEvent', 'KojiBuild']
+NODES = {
+    1: (0b1000, 100.0),
+    2: (0b0001, 200.0),
+    3: (0b0001, 300.0),
+    4: (0b0100, 400.0),
+    5: (0b1010, 500.0),
+    6: (0b1010, None),
+}
+RELATIONSHIPS = {
+    'ATTACHED': {10: (2, 1), 11: (3, 1)},
+    'TRIGGERED_BY': {12: (4, 2)},
+    'TRIGGERED': {13: (4, 5), 14: (4, 6)},
+}
+SEQUENCE = ['KojiBuild', 'ATTACHED<', 'Advisory', 'TRIGGERED_BY<', 'FreshmakerEvent',
+            'TRIGGERED>', 'ContainerKojiBuild']
+
+
+@pytest.fixture
+def snapshot_path(tmpdir):
+    """Write the test graph snapshot and return its path."""
+    path = str(tmpdir.join('graph.snapshot'))
+    write_graph_snapshot(path, LABELS, NODES, RELATIONSHIPS)
+    return path
+
+
+def test_graph_snapshot(snapshot_path):
+    """Test that the snapshot counts the related nodes with the relationships and labels."""
+    snapshot = GraphSnapshot(snapshot_path)
+    assert snapshot.node_count == 6
+    assert snapshot.get_index(1) == 0
+    assert snapshot.get_index(7) is None
+    assert snapshot.get_degree(1, 'ATTACHED<', 'Advisory') == 2
+    assert snapshot.get_degree(1, 'ATTACHED>', 'Advisory') == 0
+    assert snapshot.get_degree(1, 'RESOLVED<') == 0
+    assert snapshot.get_degree(7, 'ATTACHED<', 'Advisory') is None
+    assert snapshot.count_related_nodes(4, 'TRIGGERED', 'ContainerKojiBuild') == 2
+    assert snapshot.count_related_nodes(4, 'TRIGGERED', 'Advisory') == 0
+    assert snapshot.count_related_nodes(2, 'TRIGGERED_BY', 'FreshmakerEvent') == 1
+
+
+def test_graph_snapshot_get_story_path(snapshot_path):
+    """Test that the longest path through the most recent nodes is returned."""
+    snapshot = GraphSnapshot(snapshot_path)
+    # Like in Cypher, the nodes without a timestamp are the most recent ones
+    assert snapshot.get_story_path(1, SEQUENCE) == ([1, 2, 4, 6], [10, 12, 14])
+    assert snapshot.get_story_path(1, SEQUENCE, max_level=1) == ([1, 3], [11])
+    assert snapshot.get_story_path(1, SEQUENCE, top_k=1) == ([1, 3], [11])
+    assert snapshot.get_story_path(5, ['ContainerKojiBuild', 'ATTACHED<', 'ContainerAdvisory']) \
+        == ([5], [])
+    assert snapshot.get_story_path(7, SEQUENCE) is None
+
+
+def test_graph_snapshot_invalid(tmpdir):
+    """Test that a file that isn't a graph snapshot is rejected."""
+    path = tmpdir.join('graph.snapshot')
+    path.write('not a snapshot')
+    with pytest.raises(ValueError, match='is not a graph snapshot'):
+        GraphSnapshot(str(path))
+
+
+@patch('estuary.utils.snapshot._refresh_in_background')
+def test_get_graph_snapshot(mock_refresh, snapshot_path):
+    """Test that the snapshot is reloaded when its file is replaced and rebuilt when it's old."""
+    assert get_graph_snapshot({'GRAPH_SNAPSHOT_PATH': None}) is None
+    config = {'GRAPH_SNAPSHOT_PATH': snapshot_path, 'GRAPH_SNAPSHOT_REFRESH_INTERVAL': 600}
+    snapshot = get_graph_snapshot(config)
+    assert snapshot.node_count == 6
+    assert get_graph_snapshot(config) is snapshot
+    mock_refresh.assert_not_called()
+
+    write_graph_snapshot(snapshot_path, LABELS, {1: (0b1000, 100.0)}, {})
+    # Make it older than the refresh interval
+    os.utime(snapshot_path, (snapshot.mtime - 3600, snapshot.mtime - 3600))
+    assert get_graph_snapshot(config).node_count == 1
+    mock_refresh.assert_called_once_with(snapshot_path, 600)
+
+    os.remove(snapshot_path)
+    assert get_graph_snapshot(config) is None
+
+
+@patch('estuary.utils.snapshot.run_read_queries')
+def test_hydrate_story_paths(mock_run):
+    """Test that the story paths are hydrated from the nodes and relationships in Neo4j."""
+    hydrator = Graph.Hydrator(Graph())
+    nodes = [hydrator.hydrate_node(node_id, {'KojiBuild'}, {}) for node_id in (1, 2, 4)]
+    relationships = [hydrator.hydrate_relationship(10, 2, 1, 'ATTACHED', {}),
+                     hydrator.hydrate_relationship(12, 4, 2, 'TRIGGERED_BY', {})]
+    mock_run.return_value = [([[nodes, relationships]], ['nodes', 'relationships'])]
+
+    forward, backward = hydrate_story_paths([([1, 2, 4], [10, 12]), ([1], [])])
+    assert [node.id for node in forward[0][0].nodes] == [1, 2, 4]
+    assert backward == []
+
+    # A relationship was deleted since the snapshot was created
+    mock_run.return_value = [([[nodes, relationships[:1]]], ['nodes', 'relationships'])]
+    assert hydrate_story_paths([([1, 2, 4], [10, 12])]) is None
+    assert hydrate_story_paths([([1], [])]) == [[]]
+    assert mock_run.call_count == 2
+
+
+@patch('estuary.utils.traversal.hydrate_story_paths')
+@patch('estuary.utils.story.run_story_queries')
+@patch('estuary.utils.traversal.get_graph_snapshot')
+def test_get_story_manager_snapshot(mock_snapshot, mock_run, mock_hydrate, snapshot_path):
+    """Test that the story paths and sibling counts are computed from the snapshot."""
+    mock_snapshot.return_value = GraphSnapshot(snapshot_path)
+    mock_hydrate.return_value = [[['forward']], []]
+    config = {'STORY_MANAGER_SEQUENCE': ['ContainerStoryManager'], 'HUB_DEGREE_THRESHOLD': 1,
+              'HUB_TOP_K': 1, 'STORY_TRAVERSAL_BACKEND': 'apoc'}
+    story_manager = ContainerStoryManager.get_story_manager(
+        Mock(__label__='KojiBuild', id=1), config, limit=True)
+    assert story_manager.forward_story == [['forward']]
+    assert story_manager.partial is True
+    mock_hydrate.assert_called_once_with([([1, 3], [11]), ([1], [])])
+    mock_run.assert_not_called()
+
+    # The nodes don't have degree counters
+    results = [Mock(__label__=label, id=node_id, **{'get_degree.return_value': None})
+               for label, node_id in (('Advisory', 2), ('FreshmakerEvent', 4),
+                                      ('ContainerKojiBuild', 5))]
+    assert story_manager.get_sibling_nodes_count(results) == [0, 0, 0]
+    assert story_manager.get_sibling_nodes_count(results, reverse=True) == [0, 0, 1]
+
+    # The nodes created after the snapshot are queried from Neo4j
+    mock_run.return_value = [[[3]]]
+    results[0].id = 7
+    assert story_manager.get_sibling_nodes_count(results, reverse=True) == [0, 2, 1]
+    assert len(mock_run.call_args[0][0]) == 1
+
+
+@patch('estuary.utils.traversal.QueryBackend.get_story_paths', return_value=[[['forward']], []])
+@patch('estuary.utils.traversal.hydrate_story_paths', return_value=None)
+@patch('estuary.utils.traversal.get_graph_snapshot')
+def test_get_story_manager_snapshot_fallback(mock_snapshot, mock_hydrate, mock_paths,
+                                             snapshot_path):
+    """Test that the sibling counts aren't computed from the snapshot when it's out of date."""
+    mock_snapshot.return_value = GraphSnapshot(snapshot_path)
+    config = {'STORY_MANAGER_SEQUENCE': ['ContainerStoryManager'], 'HUB_DEGREE_THRESHOLD': 0,
+              'HUB_TOP_K': 1, 'STORY_TRAVERSAL_BACKEND': 'apoc'}
+    story_manager = ContainerStoryManager.get_story_manager(
+        Mock(__label__='KojiBuild', id=1), config, limit=True)
+    assert story_manager.forward_story == [['forward']]
+    mock_hydrate.assert_called_once()
+    assert story_manager.snapshot is None
@@ -3,8 +3,12 @@
 from __future__ import unicode_literals
 
 import pytest
+from flask import g
+from mock import Mock, patch
 
-from estuary.utils.story import BaseStoryManager, ContainerStoryManager
+from estuary.app import create_app
+from estuary.utils.story import (BaseStoryManager, ContainerStoryManager,
+                                 run_story_queries)
 
 
 @pytest.mark.parametrize('display_name,label,backward,expected', [
@@ -33,3 +37,92 @@ def test_get_siblings_description(display_name, label, backward, expected):
     rv = story_utils.get_siblings_description(
         display_name, ContainerStoryManager().story_flow(label), backward)
     assert rv == expected
+
+
+def test_get_story_query_max_level():
+    """Test that the story query only expands up to the maximum level when it's set."""
+    item = Mock(__label__='KojiBuild', id=1)
+    story_manager = ContainerStoryManager()
+    assert 'maxLevel' not in story_manager.get_story_query(item)
+    query = story_manager.get_story_query(item, reverse=True, max_level=3)
+    assert 'minLevel:1, maxLevel:3}) YIELD path' in query
+
+
+def test_get_story_query_top_k():
+    """Test that the story query of a hub node only expands its most recent related nodes."""
+    item = Mock(__label__='Advisory', id=1)
+    story_manager = ContainerStoryManager()
+    assert story_manager.get_story_degree_query(item) == (
+        'MATCH (node) WHERE id(node) = 1 RETURN size((node)<-[:TRIGGERED_BY]-()), '
+        'size((node)-[:ATTACHED]->())')
+    query = story_manager.get_story_query(item, reverse=True, top_k=10, max_level=3)
+    assert ('MATCH first_hop = (advisory)-[:ATTACHED]->(next_node:KojiBuild) '
+            'WITH first_hop, next_node '
+            'ORDER BY next_node.creation_time DESC, id(next_node) DESC LIMIT 10 ') in query
+    assert ("{sequence:'KojiBuild, BUILT_FROM>, DistGitCommit, RESOLVED>, BugzillaBug, None, "
+            "None', minLevel:0, maxLevel:2}") in query
+
+
+@patch('estuary.utils.story.db')
+def test_get_sibling_nodes_hub(mock_db):
+    """Test that the siblings of a hub are capped in the same query that counts all of them."""
+    story_node = Mock(__label__='Advisory', id=1)
+    story_manager = ContainerStoryManager()
+    mock_db.cypher_query.return_value = ([[3, ['build1', 'build2']]], ['total', 'siblings'])
+    rv = story_manager.get_sibling_nodes(
+        'KojiBuild', story_node, limit=10, descending=False, hub_threshold=2, top_k=2)
+    assert rv == (['build1', 'build2'], 3)
+    assert story_manager.partial is True
+    mock_db.cypher_query.assert_called_once_with(
+        'MATCH (next_node:Advisory)-[:ATTACHED]-(sibling:KojiBuild)WHERE id(next_node)= 1 '
+        'WITH sibling ORDER BY sibling.creation_time DESC, id(sibling) DESC '
+        'WITH collect(sibling) AS siblings WITH size(siblings) AS total, siblings '
+        'WITH total, CASE WHEN total > 2 THEN siblings[..2] ELSE siblings END AS siblings '
+        'WITH total, reverse(siblings) AS siblings '
+        'RETURN total, siblings[0..10] AS siblings')
+
+    story_manager = ContainerStoryManager()
+    mock_db.cypher_query.return_value = ([[2, ['build1', 'build2']]], ['total', 'siblings'])
+    story_manager.get_sibling_nodes('KojiBuild', story_node, hub_threshold=2, top_k=2)
+    assert story_manager.partial is False
+
+
+def test_get_sibling_nodes_query_fields():
+    """Test that only the requested properties of the sibling nodes are queried."""
+    app = create_app('estuary.config.TestConfig')
+    story_node = Mock(__label__='Advisory', id=1)
+    with app.test_request_context('/api/v1/siblings/advisory/1?fields=id,display_name'):
+        query = ContainerStoryManager().get_sibling_nodes_query('KojiBuild', story_node, limit=10)
+    assert query.endswith(
+        'RETURN total, [sibling IN siblings[0..10] | [id(sibling), labels(sibling), '
+        'sibling {.id, .name, .release, .version}]] AS siblings')
+
+
+@patch('estuary.utils.story.run_story_queries')
+def test_get_story_manager_hub(mock_run):
+    """Test that the story of a node above the degree threshold is flagged as partial."""
+    mock_run.side_effect = [[[[2000, 3]]], [[], []]]
+    item = Mock(__label__='Advisory', id=1)
+    config = {'STORY_MANAGER_SEQUENCE': ['ContainerStoryManager'], 'HUB_DEGREE_THRESHOLD': 1000,
+              'HUB_TOP_K': 10, 'STORY_TRAVERSAL_BACKEND': 'apoc'}
+    story_manager = BaseStoryManager.get_story_manager(item, config)
+    assert story_manager.partial is True
+    forward_query, backward_query = mock_run.call_args_list[1][0][0]
+    assert 'LIMIT 10' in forward_query
+    assert 'first_hop' not in backward_query
+
+
+def test_run_story_queries_batch():
+    """Test that the story queries shared by the items of a batch are only run once."""
+    app = create_app('estuary.config.TestConfig')
+    with app.test_request_context('/api/v1/stories', method='POST'):
+        g.batch_cache = {}
+        with patch('estuary.utils.story.run_read_queries') as mock_run:
+            mock_run.side_effect = lambda queries: [([[query]], ['result'])
+                                                    for query, _ in queries]
+            assert run_story_queries(['query_one', '', 'query_two', 'query_one']) == [
+                [['query_one']], [], [['query_two']], [['query_one']]]
+            assert run_story_queries(['query_two', 'query_three']) == [
+                [['query_two']], [['query_three']]]
+    assert mock_run.call_args_list[0][0][0] == [('query_one', None), ('query_two', None)]
+    assert mock_run.call_args_list[1][0][0] == [('query_three', None)]
@@ -0,0 +1,110 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+from mock import Mock, patch
+
+from estuary.utils.story import ContainerStoryManager
+from estuary.utils.story_metrics import (get_node_metric_queries,
+                                         get_processing_time_queries,
+                                         get_story_edges, get_wait_time_query,
+                                         precompute_story_metrics,
+                                         update_story_metrics)
+
+
+def _get_path(nodes, relationships):
+    """Create a mocked Neo4j path with the nodes and relationships."""
+    return Mock(nodes=nodes, relationships=relationships)
+
+
+def _get_relationship(start_node, end_node, properties):
+    """Create a mocked Neo4j relationship between two nodes with the properties."""
+    return Mock(start_node=start_node, end_node=end_node, get=properties.get)
+
+
+def test_get_story_edges():
+    """Test that the story edges of all the story managers are returned once."""
+    edges = get_story_edges()
+    assert ('KojiBuild', 'ATTACHED<', 'Advisory') in edges
+    assert ('ContainerKojiBuild', 'ATTACHED<', 'ContainerAdvisory') in edges
+    assert ('KojiBuild', 'ATTACHED<', 'ModuleKojiBuild') in edges
+    assert len(edges) == len(set(edges))
+    # The last artifacts of the stories don't have a next artifact
+    assert not [edge for edge in edges if edge[0] == 'ContainerAdvisory']
+
+
+def test_get_wait_time_query():
+    """Test that the wait time of an advisory starts when the build was attached to it."""
+    query = get_wait_time_query('KojiBuild', 'ATTACHED<', 'Advisory')
+    assert query.startswith(
+        'CALL apoc.periodic.iterate("MATCH (artifact:KojiBuild)<-[r:ATTACHED]-'
+        '(next_artifact:Advisory) RETURN artifact, r, next_artifact", ')
+    assert ('CASE WHEN next_artifact.created_at IS NOT NULL THEN r.time_attached END AS start '
+            'SET r.wait_time = CASE WHEN completion <= start THEN start - completion END') in query
+
+    query = get_wait_time_query('DistGitCommit', 'BUILT_FROM<', 'KojiBuild')
+    assert 'WITH r, artifact.commit_date AS completion, next_artifact.creation_time AS start ' \
+        in query
+
+
+def test_get_processing_time_queries():
+    """Test that only the processing times of finished artifacts are stored."""
+    build_query, event_query, advisory_query = get_processing_time_queries()
+    assert 'SET build.processing_time = CASE WHEN ' in build_query
+    assert "event.state_name IN ['COMPLETE', 'SKIPPED', 'FAILED', 'CANCELED']" in event_query
+    assert "advisory.state IN ['SHIPPED_LIVE', 'DROPPED_NO_SHIP']" in advisory_query
+    assert 'SET r.processing_time = ' in advisory_query
+
+
+@patch('estuary.utils.story_metrics.db.cypher_query')
+def test_precompute_story_metrics(mock_query):
+    """Test that the number of processed nodes and relationships of every query is summed."""
+    mock_query.return_value = ([[5, 0]], ['total', 'failedOperations'])
+    assert precompute_story_metrics() == 5 * (len(get_story_edges()) + 3)
+
+
+def test_get_node_metric_queries():
+    """Test that the metrics are only updated next to the changed nodes."""
+    queries = get_node_metric_queries()
+    # The wait times and the processing times of the advisories depend on two nodes
+    assert len(queries) == 2 * len(get_story_edges()) + 4
+    assert ('MATCH (artifact:KojiBuild)<-[r:ATTACHED]-(next_artifact:Advisory) '
+            'WHERE id(next_artifact) IN {node_ids} WITH r, ') in ' '.join(queries)
+    assert ('MATCH (build:KojiBuild) WHERE id(build) IN {node_ids} '
+            'SET build.processing_time = ') in ' '.join(queries)
+    assert all(query.endswith(' RETURN count(*)') for query in queries)
+
+
+@patch('estuary.utils.story_metrics.get_node_ids', return_value=[1, 2])
+@patch('estuary.utils.story_metrics.db.cypher_query')
+def test_update_story_metrics(mock_query, mock_node_ids):
+    """Test that only the metrics of the changed nodes are updated."""
+    mock_query.return_value = ([[1]], ['count(*)'])
+    assert update_story_metrics(set(['kojibuild:1', 'advisory:2'])) == \
+        len(get_node_metric_queries())
+    mock_node_ids.assert_called_once_with(set(['kojibuild:1', 'advisory:2']))
+    assert all(call[0][1] == {'node_ids': [1, 2]} for call in mock_query.call_args_list)
+
+
+def test_get_wait_times_precomputed():
+    """Test that the precomputed wait times are used without querying the relationships."""
+    commit = Mock(__label__='DistGitCommit', id=1)
+    build = Mock(__label__='KojiBuild', id=2)
+    advisory = Mock(__label__='Advisory', id=3)
+    event = Mock(__label__='FreshmakerEvent', id=4)
+    container_build = Mock(__label__='ContainerKojiBuild', id=5)
+    story_manager = ContainerStoryManager()
+    story_manager.backward_story = [[_get_path(
+        [build, commit], [_get_relationship(build, commit, {'wait_time': 20.0000001})])]]
+    story_manager.forward_story = [[_get_path(
+        [build, advisory, event, container_build],
+        [_get_relationship(advisory, build, {'wait_time': 30.0}),
+         _get_relationship(event, advisory, {'wait_time': 5.0}),
+         _get_relationship(event, container_build, {'wait_time': 10.0})])]]
+
+    wait_times, total_wait_time = story_manager.get_wait_times(
+        [commit, build, advisory, event, container_build])
+    assert wait_times == [20.0, 30.0, 5.0, 10.0]
+    # The wait time after a Freshmaker event is part of its processing time
+    assert total_wait_time == 55.0
+    advisory.attached_build_time.assert_not_called()
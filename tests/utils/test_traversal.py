@@ -0,0 +1,91 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import pytest
+from mock import Mock, patch
+
+from estuary.utils.snapshot import GraphSnapshot, write_graph_snapshot
+from estuary.utils.traversal import (ApocBackend, CypherBackend,
+                                     SnapshotBackend, Traversal,
+                                     get_traversal_backends)
+
+SEQUENCE = ['KojiBuild', 'ATTACHED<', 'Advisory', 'TRIGGERED_BY<', 'FreshmakerEvent',
+            'TRIGGERED>', 'ContainerKojiBuild']
+
+
+def test_apoc_backend_query_top_k():
+    """Test that the APOC query of a hub node ends its sequence like the other APOC queries."""
+    query = ApocBackend().get_story_query(Traversal(1, SEQUENCE, False, None, 10))
+    assert query == (
+        'MATCH (kojibuild:KojiBuild) WHERE id(kojibuild)= 1 '
+        'MATCH first_hop = (kojibuild)<-[:ATTACHED]-(next_node:Advisory) '
+        'WITH first_hop, next_node '
+        'ORDER BY next_node.created_at DESC, id(next_node) DESC LIMIT 10 '
+        "CALL apoc.path.expandConfig(next_node, {sequence:'Advisory, TRIGGERED_BY<, "
+        "FreshmakerEvent, TRIGGERED>, ContainerKojiBuild, None, None', minLevel:0}) YIELD path "
+        'RETURN apoc.path.combine(first_hop, path) AS path '
+        'ORDER BY length(path) DESC')
+    query = ApocBackend().get_story_query(Traversal(1, SEQUENCE, False, None, None))
+    assert ("{sequence:'KojiBuild, ATTACHED<, Advisory, TRIGGERED_BY<, FreshmakerEvent, "
+            "TRIGGERED>, ContainerKojiBuild, None, None', minLevel:1}") in query
+
+
+def test_cypher_backend_query():
+    """Test that the Cypher query checks every step of the story flow on the paths."""
+    query = CypherBackend().get_story_query(Traversal(1, SEQUENCE, True, None, None))
+    assert query == (
+        'MATCH (node:KojiBuild) WHERE id(node) = 1 '
+        'MATCH path = (node)-[:ATTACHED|TRIGGERED|TRIGGERED_BY*1..3]-() '
+        'WHERE all(index IN range(0, length(path) - 1) WHERE '
+        "type(relationships(path)[index]) = ['ATTACHED', 'TRIGGERED_BY', 'TRIGGERED'][index] "
+        'AND (startNode(relationships(path)[index]) = nodes(path)[index]) = '
+        '[false, false, true][index] AND '
+        "['Advisory', 'FreshmakerEvent', 'ContainerKojiBuild'][index] IN "
+        'labels(nodes(path)[index + 1])) '
+        'RETURN path ORDER BY length(path) DESC LIMIT 1')
+
+
+def test_cypher_backend_query_top_k():
+    """Test that the Cypher query of a hub node only expands its most recent related nodes."""
+    query = CypherBackend().get_story_query(Traversal(1, SEQUENCE, False, 2, 10))
+    assert ('MATCH (node)<-[:ATTACHED]-(next_node:Advisory) WITH node, next_node '
+            'ORDER BY next_node.created_at DESC, id(next_node) DESC LIMIT 10 ') in query
+    assert '-[:ATTACHED|TRIGGERED_BY*1..2]-() WHERE nodes(path)[1] = next_node AND all(' in query
+    assert not query.endswith('LIMIT 1')
+
+
+@pytest.mark.parametrize('backend', (ApocBackend(), CypherBackend()))
+def test_query_backend_no_story(backend):
+    """Test that there is no query when the story doesn't continue in that direction."""
+    assert backend.get_story_query(Traversal(1, ['BugzillaBug'], True, None, None)) == ''
+    assert backend.get_story_query(Traversal(1, SEQUENCE, True, 1, None)) != ''
+
+
+def test_snapshot_backend(tmpdir):
+    """Test that the snapshot backend only computes the longest paths of the nodes it has."""
+    path = str(tmpdir.join('graph.snapshot'))
+    write_graph_snapshot(path, ['Advisory', 'KojiBuild'], {1: (0b10, 100.0), 2: (0b01, 200.0)},
+                         {'ATTACHED': {10: (2, 1)}})
+    backend = SnapshotBackend(GraphSnapshot(path))
+    assert backend.get_degrees(1, [SEQUENCE, ['KojiBuild']]) == [1, 0]
+    assert backend.get_degrees(3, [SEQUENCE]) is None
+    assert backend.get_story_paths([Traversal(1, SEQUENCE, False, None, None)]) is None
+    assert backend.get_story_paths([Traversal(3, SEQUENCE, True, None, None)]) is None
+    with patch('estuary.utils.traversal.hydrate_story_paths') as mock_hydrate:
+        backend.get_story_paths([Traversal(1, SEQUENCE, True, None, None)])
+    mock_hydrate.assert_called_once_with([([1, 2], [10])])
+
+
+@patch('estuary.utils.traversal.get_graph_snapshot')
+def test_get_traversal_backends(mock_snapshot):
+    """Test that the snapshot is only tried first when the longest paths are needed."""
+    mock_snapshot.return_value = Mock()
+    config = {'STORY_TRAVERSAL_BACKEND': 'cypher'}
+    assert [backend.name for backend in get_traversal_backends(config)] == ['cypher']
+    assert [backend.name for backend in get_traversal_backends(config, limit=True)] == [
+        'snapshot', 'cypher']
+
+    config['STORY_TRAVERSAL_BACKEND'] = 'gremlin'
+    with pytest.raises(RuntimeError, match='The story traversal backend gremlin could not be'):
+        get_traversal_backends(config)
@@ -0,0 +1,47 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+from estuary.utils.truncation import ResponseBudget, count_serialized_nodes
+
+
+def test_count_serialized_nodes():
+    """Test that the serialized relationships of a node are counted."""
+    serialized_node = {
+        'id': '2345',
+        'advisories': [{'id': '27825'}, {'id': '27826'}],
+        'commit': {'hash': '8a63adb248ba633e200067e1ad6dc61931727bad'},
+        'owner': None,
+        'tags': ['latest'],
+    }
+    assert count_serialized_nodes(serialized_node) == 4
+
+
+def test_response_budget_nodes():
+    """Test that the items are rejected once the node limit is reached."""
+    budget = ResponseBudget({'RESPONSE_MAX_NODES': 5, 'RESPONSE_MAX_BYTES': None})
+    assert budget.add({'id': '1'}, nodes=3) is True
+    assert budget.add({'id': '2'}, nodes=2) is True
+    assert budget.add({'id': '3'}) is False
+    assert budget.exceeded == 'nodes'
+    # The response stays truncated even if a smaller item would fit
+    assert budget.add({}, nodes=0) is False
+    assert budget.items == 2
+
+
+def test_response_budget_bytes():
+    """Test that the first item is accepted even if it's above the byte limit."""
+    budget = ResponseBudget({'RESPONSE_MAX_NODES': None, 'RESPONSE_MAX_BYTES': 10})
+    assert budget.add({'id': 'a long identifier'}) is True
+    assert budget.add({}) is False
+    assert budget.exceeded == 'bytes'
+    assert budget.bytes == len('{"id": "a long identifier"}')
+
+
+def test_response_budget_size():
+    """Test that the item isn't measured again when its size is provided."""
+    budget = ResponseBudget({'RESPONSE_MAX_NODES': None, 'RESPONSE_MAX_BYTES': 10})
+    assert budget.add({'id': 'a long identifier'}, size=4) is True
+    assert budget.add({'id': 'another identifier'}, size=6) is True
+    assert budget.bytes == 10
+    assert budget.add({}, size=1) is False
@@ -0,0 +1,58 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+from mock import patch
+
+from estuary.utils.typeahead import TypeaheadIndex, get_typeahead_query
+
+
+def _get_entry(resource_type, uid, identifier):
+    """Create an entry of the typeahead index."""
+    return (identifier.lower(), resource_type, uid, identifier)
+
+
+def test_get_typeahead_query():
+    """Test that only the labels of the changed artifacts are queried."""
+    query, params = get_typeahead_query({'Advisory': set(['2', '1'])})
+    assert query.startswith('MATCH (node:Advisory) WHERE node.id IN {advisory_uids} RETURN ')
+    assert 'UNION' not in query
+    assert params == {'advisory_uids': ['1', '2']}
+
+    query, params = get_typeahead_query()
+    assert query.count(' UNION ALL ') == 2
+    assert params == {}
+
+
+@patch('estuary.utils.typeahead.get_changelog_entries')
+@patch('estuary.utils.typeahead.get_latest_sequence', return_value=3)
+@patch('estuary.utils.typeahead._scan')
+def test_typeahead_index(mock_scan, mock_sequence, mock_entries):
+    """Test that the index is built, looked up by prefix and refreshed from the changelog."""
+    mock_scan.return_value = [
+        _get_entry('KojiBuild', '2345', 'slf4j-1.7.4-4.el7_4'),
+        _get_entry('ContainerKojiBuild', '710', 'slf4j-container-1.7.4-1'),
+        _get_entry('Advisory', '27825', 'RHBA-2017:2251-02'),
+        _get_entry('BugzillaBug', '12345', '12345'),
+    ]
+    index = TypeaheadIndex()
+    index.build()
+    assert index.sequence == 3
+    assert index.size == 4
+    assert index.memory_bytes > 0
+    assert [entry[2] for entry in index.lookup('SLF4J', 10)] == ['2345', '710']
+    assert [entry[2] for entry in index.lookup('slf4j-c', 10)] == ['710']
+    assert [entry[2] for entry in index.lookup('slf', 1)] == ['2345']
+    assert index.lookup('slf4k', 10) == []
+
+    mock_entries.return_value = [
+        (4, set(['advisory:27825', 'containeradvisory:27825'])),
+        (5, set(['freshmakerevent:1180'])),
+    ]
+    mock_scan.return_value = [_get_entry('Advisory', '27825', 'RHBA-2017:2251-03')]
+    index.refresh()
+    mock_entries.assert_called_once_with(3)
+    mock_scan.assert_called_with({'Advisory': set(['27825'])})
+    assert index.sequence == 5
+    assert index.size == 4
+    assert [entry[3] for entry in index.lookup('rhba', 10)] == ['RHBA-2017:2251-03']